@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""measures how many bytes the :py:class:`~xmpp.models.node.Node`
+wrappers of each stanza take and reports it as JSON.
+
+usage::
+
+    python benchmarks/node_memory.py --output memory.json
+
+For every traffic of ``parse_throughput.py`` it reports:
+
+* ``node_bytes_per_stanza``: the wrappers of every element of a stanza
+* ``dict_node_bytes_per_stanza``: the same wrappers laid out in a
+  ``__dict__`` with two ``OrderedDict``, as nodes used to be
+* ``stanza_bytes``: everything a parsed stanza holds on to, elements included
+"""
+import os
+import sys
+import json
+import logging
+import platform
+import argparse
+import tracemalloc
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from speakers import Speaker as Events  # noqa
+
+from xmpp.core import ET  # noqa
+from xmpp.models.node import Node  # noqa
+from xmpp.version import version  # noqa
+
+from parse_throughput import SYNTHETIC_TRAFFIC  # noqa
+from parse_throughput import STREAM_HEADER  # noqa
+from parse_throughput import feed_all  # noqa
+
+
+class DictNode(object):
+    """the layout of the nodes before they declared ``__slots__``"""
+    def __init__(self, element):
+        self._element = element
+        self._closed = False
+        self._tag = element.tag
+        self._namespaces = OrderedDict()
+        self._attributes = OrderedDict(element.attrib)
+
+
+def traced_bytes(build):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    kept = build()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return after - before
+
+
+def measure(make_stanza, stanzas):
+    elements = [ET.fromstring(make_stanza(index)) for index in range(stanzas)]
+    subtrees = [list(element.iter()) for element in elements]
+
+    node_bytes = traced_bytes(lambda: [[Node.from_element(e) for e in tree] for tree in subtrees])
+    dict_node_bytes = traced_bytes(lambda: [[DictNode(e) for e in tree] for tree in subtrees])
+
+    chunk = STREAM_HEADER + ''.join(make_stanza(index) for index in range(stanzas)).encode('utf-8')
+    stanza_bytes = traced_bytes(lambda: feed_all([chunk], None, history_size=stanzas))
+    Events.release_all()
+
+    return OrderedDict([
+        ('stanzas', stanzas),
+        ('elements_per_stanza', float(sum(len(tree) for tree in subtrees)) / stanzas),
+        ('node_bytes_per_stanza', float(node_bytes) / stanzas),
+        ('dict_node_bytes_per_stanza', float(dict_node_bytes) / stanzas),
+        ('reduction', 1 - float(node_bytes) / dict_node_bytes),
+        ('stanza_bytes', float(stanza_bytes) / stanzas),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stanzas', type=int, default=5000, help='how many stanzas of each traffic')
+    parser.add_argument('--output', help='write the JSON report to this file instead of the stdout')
+    options = parser.parse_args(argv)
+    logging.getLogger('xmpp').setLevel(logging.ERROR)
+
+    results = []
+    for name, make_stanza in SYNTHETIC_TRAFFIC.items():
+        result = OrderedDict([('traffic', name)])
+        result.update(measure(make_stanza, options.stanzas))
+        results.append(result)
+
+    report = json.dumps(OrderedDict([
+        ('benchmark', 'node_memory'),
+        ('xmpp', version),
+        ('python', platform.python_version()),
+        ('implementation', platform.python_implementation()),
+        ('results', results),
+    ]), indent=2)
+
+    if options.output:
+        with open(options.output, 'w') as fd:
+            fd.write(report)
+    else:
+        sys.stdout.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""measures the CPU time that the main loop spends on the XML of a
+stream parsed in process and parsed by a
+:py:class:`~xmpp.offload.ParsingPool`, and reports it as JSON.
+
+usage::
+
+    python benchmarks/offload_replay.py --output offload.json
+    python benchmarks/offload_replay.py --traffic roster --pool 4
+
+The traffic of ``parse_throughput.py`` is fed in 64 KiB chunks and
+each run reports:
+
+* ``in_process_seconds``: :py:meth:`~xmpp.stream.XMLStream.feed` of every chunk
+* ``replay_seconds``: unpickling the records that a worker produced
+  for the same chunks and :py:meth:`~xmpp.stream.XMLStream.feed_records`,
+  which is what :py:meth:`~xmpp.offload.ParsingPool.dispatch` does in
+  the main loop
+* ``replay_ratio``: ``replay_seconds / in_process_seconds``
+* ``record_bytes``: the pickled records sent back by the worker
+
+With ``--pool`` the records come from a real pool of that many
+processes, ``pool_seconds`` is then the CPU time of the main process
+submitting the chunks and dispatching the records, measured with
+:py:func:`time.process_time`, which leaves the workers out.
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import logging
+import argparse
+import platform
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from speakers import Speaker as Events  # noqa
+
+from parse_throughput import BenchmarkConnection  # noqa
+from parse_throughput import fragment  # noqa
+from parse_throughput import load_traffic  # noqa
+
+from xmpp.stream import XMLStream  # noqa
+from xmpp.offload import ParsingPool  # noqa
+from xmpp.offload import StreamParser  # noqa
+from xmpp.parser import get_parser_backend  # noqa
+from xmpp.version import version  # noqa
+
+
+def in_process(chunks, parser_backend):
+    stream = XMLStream(BenchmarkConnection(), parser_backend=parser_backend)
+    stanzas = 0
+    started = time.process_time()
+    for chunk in chunks:
+        stanzas += len(stream.feed(chunk))
+
+    return stanzas, time.process_time() - started
+
+
+def replay(chunks, parser_backend):
+    # the records are pickled like the result queue of the pool does
+    worker = StreamParser(get_parser_backend(parser_backend))
+    results = [pickle.dumps(worker.feed(chunk), pickle.HIGHEST_PROTOCOL) for chunk in chunks]
+
+    stream = XMLStream(BenchmarkConnection(), parser_backend=parser_backend)
+    stanzas = 0
+    started = time.process_time()
+    for result in results:
+        stanzas += len(stream.feed_records(pickle.loads(result)))
+
+    elapsed = time.process_time() - started
+    return stanzas, elapsed, sum(len(result) for result in results)
+
+
+def pool_run(pool, chunks, parser_backend, expected):
+    stream = XMLStream(BenchmarkConnection(), parser_backend=parser_backend, parsing_pool=pool)
+    stanzas = 0
+    started = time.process_time()
+    for chunk in chunks:
+        stream.feed(chunk)
+        stanzas += pool.dispatch()
+
+    while stanzas < expected:
+        stanzas += pool.dispatch(timeout=5)
+
+    elapsed = time.process_time() - started
+    stream.release_parser()
+    return elapsed
+
+
+def run(options):
+    traffic = load_traffic(options.stanzas)
+    pool = options.pool and ParsingPool(processes=options.pool) or None
+    results = []
+    try:
+        for name, data in traffic.items():
+            if options.traffic and name not in options.traffic:
+                continue
+
+            chunks = fragment(data, '64k')
+            stanzas, in_process_seconds = in_process(chunks, options.backend)
+            Events.release_all()
+            replayed, replay_seconds, record_bytes = replay(chunks, options.backend)
+            Events.release_all()
+
+            result = OrderedDict([
+                ('traffic', name),
+                ('stanzas', stanzas),
+                ('replayed', replayed),
+                ('bytes', len(data)),
+                ('record_bytes', record_bytes),
+                ('in_process_seconds', in_process_seconds),
+                ('replay_seconds', replay_seconds),
+                ('replay_ratio', replay_seconds / max(in_process_seconds, 1e-9)),
+            ])
+            if pool is not None:
+                result['pool_seconds'] = pool_run(pool, chunks, options.backend, stanzas)
+                Events.release_all()
+
+            results.append(result)
+            sys.stderr.write('{traffic:>32}: in process {in_process_seconds:.3f}s, replay {replay_seconds:.3f}s ({replay_ratio:.2f})\n'.format(**result))
+    finally:
+        if pool is not None:
+            pool.close()
+
+    return OrderedDict([
+        ('benchmark', 'offload_replay'),
+        ('xmpp', version),
+        ('python', platform.python_version()),
+        ('implementation', platform.python_implementation()),
+        ('parser_backend', options.backend or 'default'),
+        ('pool', options.pool),
+        ('results', results),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stanzas', type=int, default=5000, help='how many stanzas of each traffic')
+    parser.add_argument('--traffic', action='append', help='only run the given traffic, can be repeated')
+    parser.add_argument('--backend', help='the parser backend: etree, expat or lxml')
+    parser.add_argument('--pool', type=int, default=0, help='also measure a ParsingPool with this many processes')
+    parser.add_argument('--output', help='write the JSON report to this file instead of the stdout')
+    options = parser.parse_args(argv)
+
+    # the traffic has stanzas without models, which are logged
+    logging.getLogger('xmpp').setLevel(logging.ERROR)
+
+    report = json.dumps(run(options), indent=2)
+    if options.output:
+        with open(options.output, 'w') as fd:
+            fd.write(report)
+    else:
+        sys.stdout.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
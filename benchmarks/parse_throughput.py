@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+#
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""feeds recorded and synthetic XMPP traffic through
+:py:meth:`~xmpp.stream.XMLStream.feed` and reports the parse
+throughput as JSON.
+
+usage::
+
+    python benchmarks/parse_throughput.py --output parse.json
+    python benchmarks/parse_throughput.py --traffic message --fragmentation byte
+
+Every combination of traffic and fragmentation is measured three
+times:
+
+* a timed run, for ``stanzas_per_second`` and ``bytes_per_second``,
+  as well as ``node_lookup_misses``: the elements that fell back to
+  the generic :py:class:`~xmpp.models.node.Node`
+* a traced run with :py:mod:`tracemalloc`, for ``peak_memory``
+* a traced run that keeps every stanza, for ``allocations_per_stanza``
+  and ``bytes_per_stanza``: the memory blocks still referenced by
+  each parsed stanza
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tracemalloc
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from speakers import Speaker as Events  # noqa
+
+from xmpp.stream import XMLStream  # noqa
+from xmpp.models.node import get_node_statistics  # noqa
+from xmpp.models.node import reset_node_statistics  # noqa
+from xmpp.networking.core import create_connection_events  # noqa
+from xmpp.version import version  # noqa
+
+
+TRAFFIC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'traffic')
+
+STREAM_HEADER = (
+    b"<?xml version='1.0'?>"
+    b'<stream:stream xmlns="jabber:client" xmlns:stream="http://etherx.jabber.org/streams"'
+    b' id="bench" from="capulet.lit" version="1.0" xml:lang="en">'
+)
+
+FRAGMENTATIONS = OrderedDict([
+    ('byte', 1),
+    ('random', None),
+    ('64k', 65536),
+])
+
+
+class BenchmarkConnection(object):
+    """the bare minimum of a :py:class:`~xmpp.networking.core.XMPPConnection`
+    needed to build a :py:class:`~xmpp.stream.XMLStream`"""
+    def __init__(self):
+        self.on = create_connection_events()
+
+    def send(self, data):
+        pass
+
+
+def message_stanza(index):
+    return (
+        '<message from="romeo@montague.lit/orchard" to="juliet@capulet.lit/balcony" type="chat" id="m{0}">'
+        '<active xmlns="http://jabber.org/protocol/chatstates"/>'
+        '<body>But soft, what light through yonder window breaks? #{0}</body>'
+        '</message>'
+    ).format(index)
+
+
+def presence_stanza(index):
+    return (
+        '<presence from="contact{0}@montague.lit/orchard" to="juliet@capulet.lit/balcony">'
+        '<show>away</show><status>thinking of thee</status><priority>{1}</priority>'
+        '<c xmlns="http://jabber.org/protocol/caps" hash="sha-1" node="http://gajim.org" ver="QxGyOW6Y5AIdI6z40mPY+smQYSc="/>'
+        '</presence>'
+    ).format(index, index % 128)
+
+
+def iq_stanza(index):
+    return (
+        '<iq from="capulet.lit" to="juliet@capulet.lit/balcony" id="ping{0}" type="get">'
+        '<ping xmlns="urn:xmpp:ping"/>'
+        '</iq>'
+    ).format(index)
+
+
+def roster_stanza(index, items=20):
+    contacts = ''.join(
+        '<item jid="contact{0}@montague.lit" name="Contact {0}" subscription="both"><group>Friends</group></item>'.format(number)
+        for number in range(items)
+    )
+    return (
+        '<iq id="roster{0}" type="result" to="juliet@capulet.lit/balcony">'
+        '<query xmlns="jabber:iq:roster" ver="ver{0}">{1}</query>'
+        '</iq>'
+    ).format(index, contacts)
+
+
+SYNTHETIC_TRAFFIC = OrderedDict([
+    ('message', message_stanza),
+    ('presence', presence_stanza),
+    ('iq', iq_stanza),
+    ('roster', roster_stanza),
+])
+
+
+def synthetic_traffic(make_stanza, stanzas):
+    body = ''.join(make_stanza(index) for index in range(stanzas))
+    return STREAM_HEADER + body.encode('utf-8')
+
+
+def recorded_traffic(filename, stanzas):
+    """replays the stanzas of a recorded session until the expected
+    number of stanzas is reached"""
+    with open(os.path.join(TRAFFIC_PATH, filename), 'rb') as fd:
+        lines = [l.strip() for l in fd.read().splitlines() if l.strip()]
+
+    header = [l for l in lines if l.startswith(b'<?xml') or l.startswith(b'<stream:')]
+    recorded = [l for l in lines if l not in header]
+
+    body = [recorded[index % len(recorded)] for index in range(stanzas)]
+    return b''.join(header + body)
+
+
+def load_traffic(stanzas):
+    traffic = OrderedDict()
+    for name, make_stanza in SYNTHETIC_TRAFFIC.items():
+        traffic[name] = synthetic_traffic(make_stanza, stanzas)
+
+    for filename in sorted(os.listdir(TRAFFIC_PATH)):
+        name = 'recorded:{0}'.format(os.path.splitext(filename)[0])
+        traffic[name] = recorded_traffic(filename, stanzas)
+
+    return traffic
+
+
+def fragment(data, fragmentation, seed=0):
+    """splits the traffic in the chunks that will be fed to the stream"""
+    size = FRAGMENTATIONS[fragmentation]
+    if size:
+        return [data[i:i + size] for i in range(0, len(data), size)]
+
+    rand = random.Random(seed)
+    chunks = []
+    position = 0
+    while position < len(data):
+        step = rand.randint(1, 4096)
+        chunks.append(data[position:position + step])
+        position += step
+
+    return chunks
+
+
+def feed_all(chunks, parser_backend, history_size=0):
+    stream = XMLStream(BenchmarkConnection(), parser_backend=parser_backend, history_size=history_size)
+    stanzas = 0
+    for chunk in chunks:
+        stanzas += len(stream.feed(chunk))
+
+    return stream, stanzas
+
+
+def measure(chunks, parser_backend):
+    reset_node_statistics()
+    started = time.perf_counter()
+    stream, stanzas = feed_all(chunks, parser_backend)
+    elapsed = time.perf_counter() - started
+    Events.release_all()
+    lookups = get_node_statistics()
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    feed_all(chunks, parser_backend)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    Events.release_all()
+
+    # keeps every stanza around to find out how much memory each
+    # one of them holds on to
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    stream, _ = feed_all(chunks, parser_backend, history_size=stanzas)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    Events.release_all()
+
+    retained = after.compare_to(before, 'filename')
+    blocks = sum(stat.count_diff for stat in retained)
+    size = sum(stat.size_diff for stat in retained)
+    total_bytes = sum(len(chunk) for chunk in chunks)
+
+    return OrderedDict([
+        ('stanzas', stanzas),
+        ('bytes', total_bytes),
+        ('chunks', len(chunks)),
+        ('seconds', elapsed),
+        ('stanzas_per_second', stanzas / elapsed),
+        ('bytes_per_second', total_bytes / elapsed),
+        ('allocations_per_stanza', float(blocks) / max(stanzas, 1)),
+        ('bytes_per_stanza', float(size) / max(stanzas, 1)),
+        ('peak_memory', peak - baseline),
+        ('node_lookups', lookups['lookups']),
+        ('node_lookup_misses', lookups['misses']),
+    ])
+
+
+def run(options):
+    traffic = load_traffic(options.stanzas)
+    results = []
+    for name, data in traffic.items():
+        if options.traffic and name not in options.traffic:
+            continue
+
+        for fragmentation in FRAGMENTATIONS:
+            if options.fragmentation and fragmentation not in options.fragmentation:
+                continue
+
+            sample = data
+            if fragmentation == 'byte':
+                # feeding one byte at a time is two orders of
+                # magnitude slower, a tenth of the traffic is enough
+                sample = data[:max(len(data) // 10, len(STREAM_HEADER) + 1)]
+
+            result = OrderedDict([
+                ('traffic', name),
+                ('fragmentation', fragmentation),
+            ])
+            result.update(measure(fragment(sample, fragmentation, options.seed), options.backend))
+            results.append(result)
+            sys.stderr.write('{traffic:>32} {fragmentation:>6}: {stanzas_per_second:12.1f} stanzas/s\n'.format(**result))
+
+    return OrderedDict([
+        ('benchmark', 'parse_throughput'),
+        ('xmpp', version),
+        ('python', platform.python_version()),
+        ('implementation', platform.python_implementation()),
+        ('parser_backend', options.backend or 'default'),
+        ('results', results),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stanzas', type=int, default=2000, help='how many stanzas of each traffic')
+    parser.add_argument('--traffic', action='append', help='only run the given traffic, can be repeated')
+    parser.add_argument('--fragmentation', action='append', choices=list(FRAGMENTATIONS),
+                        help='only run the given fragmentation, can be repeated')
+    parser.add_argument('--backend', help='the parser backend: etree, expat or lxml')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random fragmentation')
+    parser.add_argument('--output', help='write the JSON report to this file instead of the stdout')
+    options = parser.parse_args(argv)
+
+    # the traffic has stanzas without models, which are logged
+    logging.getLogger('xmpp').setLevel(logging.ERROR)
+
+    report = json.dumps(run(options), indent=2)
+    if options.output:
+        with open(options.output, 'w') as fd:
+            fd.write(report)
+    else:
+        sys.stdout.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
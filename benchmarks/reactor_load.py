@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+#
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""opens many XML streams over loopback TCP in a single process, all
+of them served by one :py:class:`~xmpp.networking.reactor.XMPPReactor`,
+and reports how fast they open and exchange stanzas as JSON.
+
+usage::
+
+    python benchmarks/reactor_load.py --streams 10000 --output reactor.json
+
+A forked process echoes every byte back with a reactor of its own, so
+each client stream receives its own ``<stream:stream>`` and then every
+``<message>`` it sends. It reports:
+
+* ``connect_seconds``: opening the TCP connections, which is blocking
+* ``open_seconds``: until every stream received its ``<stream:stream>``
+* ``stanzas_per_second``: the messages sent and parsed back by all the streams
+* ``loops`` and ``ready_per_loop``: the calls to ``loop_once`` and how
+  many sockets were ready in each one
+* ``round_trip_ms``: the mean time for a message of one stream to come
+  back while every other stream is idle
+
+With ``--compare`` the same load runs again calling
+:py:meth:`~xmpp.networking.core.XMPPConnection.loop_once` of every
+connection in turns, one ``select()`` per connection, as it was done
+before the reactor. ``select()`` cannot wait for file descriptors
+above 1024, so that only works with 300 streams or less.
+
+Every stream takes a file descriptor in each process, ``--compare``
+takes two more for the wakeup of each connection. The soft limit of
+open files is raised to the hard limit, see ``ulimit -Hn``.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import platform
+import argparse
+import multiprocessing
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xmpp.stream import XMLStream  # noqa
+from xmpp.networking.core import XMPPConnection  # noqa
+from xmpp.networking.reactor import XMPPReactor  # noqa
+from xmpp.version import version  # noqa
+
+
+# select() cannot wait for file descriptors above this one
+FD_SETSIZE = 1024
+
+
+def raise_open_files_limit(needed):
+    if resource is None:
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        soft = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        raise SystemExit('{0} open files are needed but the limit is {1}, see ulimit -Hn'.format(needed, soft))
+
+
+def echo(event, connection):
+    connection.send(b''.join(connection.receive_all()))
+
+
+def serve(listener, streams):
+    # accepts every stream and echoes their bytes until they disconnect
+    reactor = XMPPReactor()
+    for _ in range(streams):
+        sock, _ = listener.accept()
+        connection = XMPPConnection('127.0.0.1', listener.getsockname()[1])
+        connection.socket = sock
+        connection.on.ready_to_read(echo)
+        reactor.register(connection)
+
+    listener.close()
+    while len(reactor):
+        reactor.loop_once()
+
+    reactor.close()
+
+
+def start_server(streams):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(min(streams, socket.SOMAXCONN))
+
+    context = multiprocessing.get_context('fork')
+    server = context.Process(target=serve, args=(listener, streams))
+    server.daemon = True
+    server.start()
+
+    port = listener.getsockname()[1]
+    listener.close()
+    return server, port
+
+
+class Client(object):
+    """a stream that sends its messages once it is open"""
+
+    def __init__(self, port, stanzas, counters):
+        self.stanzas = stanzas
+        self.counters = counters
+        self.connection = XMPPConnection('127.0.0.1', port)
+        self.stream = XMLStream(self.connection)
+        self.stream.on.open(self.opened)
+        self.stream.on.message(self.received)
+
+    def opened(self, event, node):
+        self.counters['open'] += 1
+        for index in range(self.stanzas):
+            self.stream.send_message('ping {0}'.format(index), to='juliet@capulet.com')
+
+    def received(self, event, node):
+        self.counters['messages'] += 1
+
+
+def run(mode, options):
+    streams = options.streams
+    counters = {'open': 0, 'messages': 0}
+    expected = streams * options.stanzas
+    server, port = start_server(streams)
+
+    started = time.perf_counter()
+    clients = [Client(port, options.stanzas, counters) for _ in range(streams)]
+    for client in clients:
+        client.connection.connect()
+
+    connected = time.perf_counter()
+
+    connections = [client.connection for client in clients]
+    if mode == 'reactor':
+        reactor = XMPPReactor()
+        for connection in connections:
+            reactor.register(connection)
+
+        def loop_once():
+            return reactor.loop_once(1)
+    else:
+        def loop_once():
+            for connection in connections:
+                connection.loop_once(0)
+
+            return 0
+
+    for client in clients:
+        client.stream.open_client('capulet.com')
+
+    loops = 0
+    ready = 0
+    opened = None
+    deadline = time.perf_counter() + options.timeout
+    while counters['messages'] < expected and time.perf_counter() < deadline:
+        ready += loop_once() or 0
+        loops += 1
+        if opened is None and counters['open'] == streams:
+            opened = time.perf_counter()
+
+    finished = time.perf_counter()
+    opened = opened or finished
+    exchanged = counters['messages']
+
+    # a single stream exchanges messages while the others are idle
+    latencies = []
+    stream = clients[0].stream
+    for index in range(options.round_trips):
+        sent = time.perf_counter()
+        received = counters['messages'] + 1
+        stream.send_message('round trip {0}'.format(index), to='juliet@capulet.com')
+        while counters['messages'] < received and time.perf_counter() < deadline:
+            loop_once()
+
+        latencies.append(time.perf_counter() - sent)
+
+    if mode == 'reactor':
+        reactor.close()
+
+    for connection in connections:
+        connection.disconnect()
+
+    server.join(options.timeout)
+
+    result = OrderedDict([
+        ('mode', mode),
+        ('streams', streams),
+        ('opened', counters['open']),
+        ('stanzas', exchanged),
+        ('complete', exchanged == expected),
+        ('connect_seconds', connected - started),
+        ('open_seconds', opened - connected),
+        ('exchange_seconds', finished - opened),
+        ('stanzas_per_second', exchanged / max(finished - opened, 1e-9)),
+        ('loops', loops),
+        ('round_trip_ms', 1000 * sum(latencies) / max(len(latencies), 1)),
+    ])
+    if mode == 'reactor':
+        result['ready_per_loop'] = ready / max(loops, 1)
+
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=1000, help='how many concurrent streams')
+    parser.add_argument('--stanzas', type=int, default=10, help='how many messages each stream sends')
+    parser.add_argument('--round-trips', type=int, default=100, help='how many messages a single stream exchanges while the others are idle')
+    parser.add_argument('--timeout', type=float, default=300, help='the most seconds to wait for each run')
+    parser.add_argument('--compare', action='store_true', help='run the same load with one select() per connection')
+    parser.add_argument('--output', help='write the JSON report to this file instead of the stdout')
+    options = parser.parse_args(argv)
+    logging.getLogger('xmpp').setLevel(logging.ERROR)
+
+    modes = ['reactor']
+    if options.compare:
+        if options.streams * 3 + 64 > FD_SETSIZE:
+            parser.error('--compare waits with select(), which only takes file descriptors below {0}, use --streams 300 or less'.format(FD_SETSIZE))
+
+        modes.append('select')
+
+    raise_open_files_limit(options.streams * (options.compare and 3 or 1) + 64)
+
+    results = []
+    for mode in modes:
+        result = run(mode, options)
+        results.append(result)
+        sys.stderr.write('{mode:>8}: {streams} streams, {stanzas_per_second:10.0f} stanzas/s, open in {open_seconds:.2f}s, round trip {round_trip_ms:.2f}ms\n'.format(**result))
+
+    report = json.dumps(OrderedDict([
+        ('benchmark', 'reactor_load'),
+        ('xmpp', version),
+        ('python', platform.python_version()),
+        ('implementation', platform.python_implementation()),
+        ('platform', platform.system()),
+        ('results', results),
+    ]), indent=2)
+
+    if options.output:
+        with open(options.output, 'w') as fd:
+            fd.write(report)
+    else:
+        sys.stdout.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
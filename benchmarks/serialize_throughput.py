@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""serializes the synthetic traffic of ``parse_throughput.py`` with
+:py:func:`~xmpp.serializer.element_to_bytes` and with the
+:py:mod:`xml.etree.ElementTree` path it replaced, and reports the
+throughput of both as JSON.
+
+usage::
+
+    python benchmarks/serialize_throughput.py --output serialize.json
+
+For every traffic it reports:
+
+* ``etree_stanzas_per_second``: :py:func:`~xmpp.core.node_to_string`
+  followed by the encoding that the connection used to need
+* ``bytes_stanzas_per_second``: :py:func:`~xmpp.serializer.element_to_bytes`
+* ``identical``: whether both wrote the same bytes for every stanza
+"""
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import argparse
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xmpp.core import ET  # noqa
+from xmpp.core import node_to_string  # noqa
+from xmpp.compat import cast_bytes  # noqa
+from xmpp.models.node import Node  # noqa
+from xmpp.serializer import element_to_bytes  # noqa
+from xmpp.version import version  # noqa
+
+from parse_throughput import SYNTHETIC_TRAFFIC  # noqa
+
+
+def etree_to_bytes(node):
+    return cast_bytes(node_to_string(node))
+
+
+def bytes_to_bytes(node):
+    return element_to_bytes(node._element)
+
+
+def timed(serialize, nodes, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for node in nodes:
+            serialize(node)
+
+    return time.perf_counter() - started
+
+
+def measure(make_stanza, stanzas, rounds):
+    # parsed nodes keep the namespaces in the tags of their
+    # elements, which is what the serializers see when a received
+    # stanza is forwarded
+    nodes = [
+        Node.from_element(ET.fromstring('<stream xmlns="jabber:client">' + make_stanza(index) + '</stream>')[0], lazy=True)
+        for index in range(stanzas)
+    ]
+
+    identical = all(etree_to_bytes(node) == bytes_to_bytes(node) for node in nodes)
+    etree = timed(etree_to_bytes, nodes, rounds)
+    direct = timed(bytes_to_bytes, nodes, rounds)
+    total = stanzas * rounds
+
+    return OrderedDict([
+        ('stanzas', total),
+        ('etree_stanzas_per_second', total / etree),
+        ('bytes_stanzas_per_second', total / direct),
+        ('speedup', etree / direct),
+        ('identical', identical),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stanzas', type=int, default=2000, help='how many stanzas of each traffic')
+    parser.add_argument('--rounds', type=int, default=5, help='how many times each stanza is serialized')
+    parser.add_argument('--output', help='write the JSON report to this file instead of the stdout')
+    options = parser.parse_args(argv)
+    logging.getLogger('xmpp').setLevel(logging.ERROR)
+
+    results = []
+    for name, make_stanza in SYNTHETIC_TRAFFIC.items():
+        result = OrderedDict([('traffic', name)])
+        result.update(measure(make_stanza, options.stanzas, options.rounds))
+        results.append(result)
+        sys.stderr.write('{traffic:>10}: {speedup:6.2f}x\n'.format(**result))
+
+    report = json.dumps(OrderedDict([
+        ('benchmark', 'serialize_throughput'),
+        ('xmpp', version),
+        ('python', platform.python_version()),
+        ('implementation', platform.python_implementation()),
+        ('results', results),
+    ]), indent=2)
+
+    if options.output:
+        with open(options.output, 'w') as fd:
+            fd.write(report)
+    else:
+        sys.stdout.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -16,7 +16,6 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-import time
 import random
 import logging
 import traceback
@@ -43,7 +42,7 @@ def application():
     connection = XMPPConnection(DOMAIN, PORT, debug=DEBUG)
 
     # create a XML stream
-    stream = XMLStream(connection, debug=DEBUG)
+    stream = XMLStream(connection, debug=DEBUG, lazy_nodes=True)
 
     @stream.on.closed
     def auto_reconnect(event, node):
@@ -53,13 +52,16 @@ def application():
     def stream_error(event, error):
         logging.error(error.to_xml())
 
-    @connection.on.ready_to_write
-    def keep_alive(event, connection):
+    def keep_alive():
         "send whitespace keep alive every 60 seconds"
-        if stream.is_authenticated_component() and (int(time.time()) % 60 == 0):
+        if stream.is_authenticated_component():
             print('keepalive')
             connection.send_whitespace_keepalive()
 
+        connection.call_later(60, keep_alive)
+
+    connection.call_later(60, keep_alive)
+
     @connection.on.tcp_established
     def step1_open_stream(event, host_ip):
         "sends a <stream:stream> to the XMPP server"
@@ -73,10 +75,10 @@ def application():
 
     @stream.on.presence
     def step3_auto_subscribe(event, presence):
-        from_jid = presence.attr['to']
-        presence_type = presence.attr.get('type')
+        from_jid = presence.to
+        presence_type = presence.type
 
-        params = {'from': from_jid, 'to': presence.attr['from']}
+        params = {'from': from_jid, 'to': presence.from_}
         if presence_type == 'subscribe':
             stream.send_presence(type='subscribed', **params)
 
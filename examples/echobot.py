@@ -16,7 +16,6 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-import time
 import logging
 import traceback
 import coloredlogs
@@ -56,7 +55,7 @@ def application():
 
     @stream.on.presence
     def handle_presence(event, presence):
-        logging.debug("presence from: %s %s(%s)", presence.attr['from'], presence.status.strip(), presence.show.strip())
+        logging.debug("presence from: %s %s(%s)", presence.from_, presence.status.strip(), presence.show.strip())
 
     @connection.on.tcp_established
     def step1_open_stream(event, host_ip):
@@ -89,17 +88,21 @@ def application():
         if presence.delay:
             stream.send_presence()
 
-    @connection.on.ready_to_write
-    def keep_alive(event, connection):
-        if stream.has_gone_through_sasl() and (time.time() % 60 == 0):
+    def keep_alive():
+        "send whitespace keep alive every 60 seconds"
+        if stream.has_gone_through_sasl():
             print('keepalive')
             connection.send_whitespace_keepalive()
 
+        connection.call_later(60, keep_alive)
+
+    connection.call_later(60, keep_alive)
+
     @stream.on.message
     def auto_reply(event, message):
         stream.send_presence()
 
-        from_jid = JID(message.attr['from'])
+        from_jid = JID(message.from_)
         if message.is_composing():
             logging.warning("%s is composing", from_jid.nick)
 
@@ -17,7 +17,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import time
 import logging
 import traceback
 import coloredlogs
@@ -60,10 +59,10 @@ def application():
 
     @stream.on.presence
     def handle_presence(event, presence):
-        if not presence.attr.get('from'):
+        if not presence.from_:
             return
 
-        logging.debug("presence from: %s %s(%s)", presence.attr['from'], presence.status.strip(), presence.show.strip())
+        logging.debug("presence from: %s %s(%s)", presence.from_, presence.status.strip(), presence.show.strip())
 
     @connection.on.tcp_established
     def step1_open_stream(event, host_ip):
@@ -93,27 +92,30 @@ def application():
 
     @stream.on.presence
     def step6_auto_subscribe(event, presence):
-        if not presence.attr.get('from'):
+        if not presence.from_:
             return
 
-        presence_type = presence.attr.get('type')
+        presence_type = presence.type
 
-        params = {'from': jid.bare, 'to': presence.attr['from']}
+        params = {'from': jid.bare, 'to': presence.from_}
         if presence_type == 'subscribe':
             stream.send_presence(type='subscribed', **params)
 
         elif presence_type == 'subscribed':
-            stream.add_contact(presence.attr['from'])
+            stream.add_contact(presence.from_)
         else:
             stream.send_presence(**params)
 
-    @connection.on.ready_to_write
-    def keep_alive(event, connection):
+    def keep_alive():
         "send whitespace keep alive every 60 seconds"
-        if stream.has_gone_through_sasl() and (time.time() % 60 == 0):
+        if stream.has_gone_through_sasl():
             print('keepalive')
             connection.send_whitespace_keepalive()
 
+        connection.call_later(60, keep_alive)
+
+    connection.call_later(60, keep_alive)
+
     connection.connect()
 
     try:
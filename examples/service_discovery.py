@@ -17,7 +17,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import time
 import logging
 import traceback
 import coloredlogs
@@ -63,7 +62,7 @@ def application():
 
     @stream.on.presence
     def handle_presence(event, presence):
-        logging.debug("presence from: %s %s(%s)", presence.attr['from'], presence.status.strip(), presence.show.strip())
+        logging.debug("presence from: %s %s(%s)", presence.from_, presence.status.strip(), presence.show.strip())
 
     @connection.on.tcp_established
     def step1_open_stream(event, host_ip):
@@ -99,12 +98,16 @@ def application():
         if presence.delay:
             stream.send_presence()
 
-    @connection.on.ready_to_write
-    def keep_alive(event, connection):
-        if stream.has_gone_through_sasl() and (time.time() % 60 == 0):
+    def keep_alive():
+        "send whitespace keep alive every 60 seconds"
+        if stream.has_gone_through_sasl():
             print('keepalive')
             connection.send_whitespace_keepalive()
 
+        connection.call_later(60, keep_alive)
+
+    connection.call_later(60, keep_alive)
+
     @service_discovery.on.query_items
     def handle_disco_items(event, query):
         logging.info("Disco Items:\n%s", "\n".join(map(repr, query.get_children())))
@@ -127,3 +127,24 @@ def test_disco_events():
     # Then the handler should have been called appropriately
     handle_query_items.assert_called_once_with(ANY, query_items)
     handle_query_info.assert_called_once_with(ANY, query_info)
+
+
+def test_disco_results():
+    ('xep0030.QueryInfo.features and QueryItems.jids should read the results')
+
+    # Given the results of a disco#info and a disco#items query
+    info = QueryInfo.from_xml(
+        '<query xmlns="http://jabber.org/protocol/disco#info">'
+        '<identity category="server" type="im"/>'
+        '<feature var="jabber:iq:roster"/><feature var="urn:xmpp:ping"/>'
+        '</query>'
+    )
+    items = QueryItems.from_xml(
+        '<query xmlns="http://jabber.org/protocol/disco#items">'
+        '<item jid="conference.foo.com"/><item jid="pubsub.foo.com"/>'
+        '</query>'
+    )
+
+    # Then their fields can be read
+    info.features.should.equal(['jabber:iq:roster', 'urn:xmpp:ping'])
+    items.jids.should.equal(['conference.foo.com', 'pubsub.foo.com'])
@@ -86,7 +86,7 @@ def test_open():
     component.open('capulet.com', True)
 
     connection.output.should.equal([
-        '<stream:stream to="capulet.com" xmlns="jabber:component:accept" xmlns:stream="http://etherx.jabber.org/streams"><starttls xmlns="urn:ietf:params:xml:ns:xmpp-tls" />'
+        b'<stream:stream to="capulet.com" xmlns="jabber:component:accept" xmlns:stream="http://etherx.jabber.org/streams"><starttls xmlns="urn:ietf:params:xml:ns:xmpp-tls" />'
     ])
 
 
@@ -105,5 +105,5 @@ def test_authenticate():
     component.authenticate('thesecret')
 
     connection.output.should.equal([
-        '<handshake>12b52c66db926224809745acfcb361d06ccd4472</handshake>',
+        b'<handshake>12b52c66db926224809745acfcb361d06ccd4472</handshake>',
     ])
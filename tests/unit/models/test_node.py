@@ -16,10 +16,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from xmpp.core import ET
 from xmpp.models import Node
 from xmpp.models import IQ
+from xmpp.models import Message
+from xmpp.models import Presence
 from xmpp.models import ResourceBind
+from xmpp.models import RosterGroup
+from xmpp.models import RosterItem
 from xmpp.models import Stream
+from xmpp.models import StreamError
+from xmpp.models.node import NodeDefinitionError
+from xmpp.models.node import get_node_statistics
+from xmpp.models.node import reset_node_statistics
 
 
 from tests.unit.util import XML
@@ -154,3 +163,373 @@ def test_append():
         TypeError,
         'Refused to append a child to the closed node: <iq foo="bar" />',
     )
+
+
+def test_lazy_node():
+    ('Node.from_element(lazy=True) should defer the namespace fixup until first accessed')
+
+    # Given a parsed element with namespaces
+    element = ET.fromstring(
+        '<iq xmlns="jabber:client" type="result"><bind xmlns="urn:ietf:params:xml:ns:xmpp-bind"/></iq>')
+
+    # When I wrap it lazily
+    node = Node.from_element(element, allow_fixedup=True, lazy=True)
+
+    # Then the element is untouched
+    node.is_materialized.should.be.false
+    element.tag.should.equal('{jabber:client}iq')
+
+    # And accessing the attributes materializes it
+    dict(node.attr).should.equal({'type': 'result'})
+    node.is_materialized.should.be.true
+    node.tag.should.equal('iq')
+
+    # And its children were fixed up as well
+    [c.tag for c in node.get_children()].should.equal(['bind'])
+
+
+def test_lazy_node_equals_eager_node():
+    ('a lazy Node should serialize and compare the same as an eager one')
+
+    source = '<message xmlns="jabber:client" to="juliet@capulet"><body>hi</body></message>'
+
+    lazy = Node.from_element(ET.fromstring(source), lazy=True)
+    eager = Node.from_element(ET.fromstring(source))
+
+    lazy.should.equal(eager)
+    lazy.to_xml().should.equal(eager.to_xml())
+
+
+def test_nodes_have_slots():
+    ('Node and its subclasses should not have a __dict__')
+
+    node = IQ.create(type='get')
+    node.should_not.have.property('__dict__')
+    Stream.create_client('capulet').should_not.have.property('__dict__')
+
+    node.set_attribute('id', 'ping1')
+    dict(node.attr).should.equal({'type': 'get', 'id': 'ping1'})
+
+
+def test_nodes_defined_outside_of_xmpp_have_a_dict():
+    ('Node subclasses defined by applications can keep state in initialize()')
+
+    class Mood(Node):
+        __tag__ = 'mood'
+        __etag__ = '{http://jabber.org/protocol/mood}mood'
+
+        def initialize(self):
+            self.seen = 0
+
+    node = Mood.create()
+    node.seen += 1
+    node.seen.should.equal(1)
+    node.should.have.property('__dict__')
+
+
+def test_from_element_namespaces():
+    ('Node.from_element() should resolve the nodes in the namespace they arrive')
+
+    def node_class(tag):
+        return type(Node.from_element(ET.Element(tag)))
+
+    node_class('{jabber:client}message').should.be(Message)
+    node_class('{jabber:server}presence').should.be(Presence)
+    node_class('{jabber:component:accept}iq').should.be(IQ)
+    node_class('message').should.be(Message)
+    node_class('{jabber:iq:roster}item').should.be(RosterItem)
+    node_class('{jabber:iq:roster}group').should.be(RosterGroup)
+    node_class('{http://etherx.jabber.org/streams}error').should.be(StreamError)
+    node_class('{urn:test}message').should.be(Node)
+
+
+def test_node_definition_conflict():
+    ('defining a Node for a name already taken by an unrelated Node should fail')
+
+    def define():
+        class Roster(Node):
+            __tag__ = 'query'
+            __etag__ = '{jabber:iq:roster}query'
+
+    define.when.called_with().should.throw(
+        NodeDefinitionError,
+        'node query in the namespace "jabber:iq:roster" is already defined by xmpp.models.core.RosterQuery'
+    )
+
+
+def test_node_statistics():
+    ('get_node_statistics() should count the elements that fell back to Node')
+
+    reset_node_statistics()
+
+    Node.from_element(ET.Element('{jabber:client}message'))
+    Node.from_element(ET.Element('{urn:test}unknown'))
+    Node.from_element(ET.Element('{urn:test}unknown'))
+
+    statistics = get_node_statistics()
+    statistics['lookups'].should.equal(3)
+    statistics['hits'].should.equal(1)
+    statistics['misses'].should.equal(2)
+    statistics['missed'].should.equal([('{urn:test}unknown', 2)])
+
+
+def test_attr_view():
+    ('Node.attr should be a read-only view that is only built once')
+
+    # Given a parsed stanza
+    node = Node.from_xml('<iq xmlns="jabber:client" id="ping1" type="get" from="juliet@capulet" to="capulet"/>')
+
+    # Then its attributes can't be changed through the view
+    node.attr.should.be(node.attr)
+    def change_id():
+        node.attr['id'] = 'ping2'
+
+    change_id.when.called_with().should.throw(TypeError)
+
+    # And the common attributes have accessors of their own
+    node.id.should.equal('ping1')
+    node.type.should.equal('get')
+    node.from_.should.equal('juliet@capulet')
+    node.to.should.equal('capulet')
+    node.get_attribute('xml:lang', 'en').should.equal('en')
+
+    # And setting an attribute refreshes the view
+    node.set_attribute('id', 'ping2')
+    node.attr['id'].should.equal('ping2')
+    node.id.should.equal('ping2')
+
+
+def test_child_wrappers():
+    ('Node.get, Node.query and Node.get_children should return the same node for the same element')
+
+    # Given a parsed presence
+    presence = Node.from_xml(
+        '<presence xmlns="jabber:client"><show>away</show><status>thinking of thee</status></presence>')
+
+    # When I access its children more than once
+    show = presence.get('show')
+
+    # Then the same nodes come back
+    presence.get('show').should.be(show)
+    presence.query('show').should.equal([show])
+    presence.query('show')[0].should.be(show)
+    presence.get_children()[0].should.be(show)
+    presence.get_children()[1].should.be(presence.get('status'))
+
+    # And the accessors still read the values
+    presence.show.should.equal('away')
+    presence.status.should.equal('thinking of thee')
+
+
+def test_fingerprint():
+    ('Node.fingerprint should be the same before and after the namespaces are fixed up')
+
+    source = (
+        '<message xmlns="jabber:client" to="juliet@capulet" type="chat">'
+        '<body>hi</body><active xmlns="http://jabber.org/protocol/chatstates"/></message>'
+    )
+
+    # Given a lazy and an eager node of the same stanza
+    lazy = Node.from_element(ET.fromstring(source), lazy=True)
+    eager = Node.from_element(ET.fromstring(source))
+
+    # And the same message created from scratch
+    created = Message.create('hi', to='juliet@capulet')
+    created.set_active()
+
+    # Then they are all equal and can be deduplicated
+    eager.fingerprint.should.equal(lazy.fingerprint)
+    created.should.equal(eager)
+    set([lazy, eager, created]).should.have.length_of(1)
+
+
+def test_fingerprint_tail():
+    ('Node.fingerprint should tell apart the text that follows the children')
+
+    # Given two messages that only differ in the text after their body
+    message = Node.from_xml('<message xmlns="jabber:client"><body>hi</body> there</message>')
+    other = Node.from_xml('<message xmlns="jabber:client"><body>hi</body></message>')
+
+    # Then they are not equal
+    message.fingerprint.should_not.equal(other.fingerprint)
+    message.should_not.equal(other)
+
+
+def test_equality_of_different_classes():
+    ('Node objects of different classes should not be equal, whichever side is compared')
+
+    # Given an IQ and a generic node of the same element
+    iq = IQ.create(type='get', id='1')
+    node = Node(iq._element, lazy=True)
+
+    # Then they are not equal either way
+    (iq == node).should.be.false
+    (node == iq).should.be.false
+
+
+def test_fingerprint_changes():
+    ('Node.fingerprint should be updated when the node or its children change')
+
+    # Given a presence whose fingerprint was computed
+    presence = Node.from_xml('<presence xmlns="jabber:client"><show>away</show></presence>')
+    other = Node.from_xml('<presence xmlns="jabber:client"><show>away</show></presence>')
+    fingerprint = presence.fingerprint
+    hash(presence).should.equal(hash(other))
+
+    # When one of its children changes
+    presence.get('show').value = 'chat'
+
+    # Then the fingerprint changes as well
+    presence.fingerprint.should_not.equal(fingerprint)
+    presence.should_not.equal(other)
+
+    # And it goes back once the change is undone
+    presence.get('show').value = 'away'
+    presence.fingerprint.should.equal(fingerprint)
+
+    # And changing an attribute also changes it
+    presence.set_attribute('type', 'unavailable')
+    presence.should_not.equal(other)
+
+
+def test_clone():
+    ('Node.clone() should share the element tree until one of the nodes changes')
+
+    # Given a parsed message
+    message = Node.from_xml(
+        '<message xmlns="jabber:client" to="juliet@capulet" type="chat"><body>hi</body></message>')
+
+    # When I clone it for another recipient
+    clone = message.clone(to='nurse@capulet')
+
+    # Then only the clone has the new recipient
+    clone.to.should.equal('nurse@capulet')
+    message.to.should.equal('juliet@capulet')
+
+    # And the children are still shared
+    clone._element[0].should.be(message._element[0])
+
+    # When I change a child of the clone
+    clone.get('body').value = 'hello'
+
+    # Then the original is left untouched
+    clone.get_body().should.equal('hello')
+    message.get_body().should.equal('hi')
+    message.to_xml().should.equal('<message to="juliet@capulet" type="chat"><body>hi</body></message>')
+
+
+def test_clone_original_changes():
+    ('changing the original node should not change its clones')
+
+    # Given a presence whose child was already wrapped
+    presence = Node.from_xml(
+        '<presence xmlns="jabber:client"><status>away</status><c xmlns="http://jabber.org/protocol/caps"/></presence>')
+    status = presence.get('status')
+
+    # And a clone of it
+    clone = presence.clone()
+    clone.should.equal(presence)
+
+    # When the original changes
+    status.value = 'busy'
+    presence.append(Node.from_xml('<priority>1</priority>'))
+
+    # Then the clone is left untouched
+    clone.status.should.equal('away')
+    clone.query('priority').should.equal([])
+    presence.status.should.equal('busy')
+    clone.should_not.equal(presence)
+
+
+def test_clone_appended_children():
+    ('Node.clone() should share the children that were appended to the node')
+
+    # Given a presence with an appended child
+    presence = Presence.create(to='juliet@capulet')
+    status = Node.from_xml('<status>away</status>')
+    presence.append(status)
+
+    # And a clone of it
+    clone = presence.clone()
+
+    # Then the appended child is shared as well
+    status.is_shared.should.be.true
+    presence.get('status').should.be(status)
+
+    # When the appended child changes
+    status.value = 'busy'
+
+    # Then the clone is left untouched
+    clone.get('status').value.should.equal('away')
+    presence.get('status').value.should.equal('busy')
+
+
+def test_append_moves_the_node():
+    ('appending a node to a second parent should move it out of the first one')
+
+    # Given a status appended to a presence that was serialized
+    first = Presence.create(to='juliet@capulet')
+    second = Presence.create(to='nurse@capulet')
+    status = Node.from_xml('<status>away</status>')
+    first.append(status)
+    first.to_xml().should.equal('<presence to="juliet@capulet"><status>away</status></presence>')
+
+    # When it is appended to another presence
+    second.append(status)
+
+    # Then only the second one has it
+    first.to_xml().should.equal('<presence to="juliet@capulet" />')
+    second.to_xml().should.equal('<presence to="nurse@capulet"><status>away</status></presence>')
+
+    # And its changes reach the second one
+    status.value = 'busy'
+    second.to_xml().should.equal('<presence to="nurse@capulet"><status>busy</status></presence>')
+
+
+def test_append_moves_a_shared_node():
+    ('moving a child of a cloned node should leave the clone untouched')
+
+    # Given a parsed message and a clone of it
+    message = Node.from_xml(
+        '<message xmlns="jabber:client" to="juliet@capulet"><body>hi</body></message>')
+    clone = message.clone(to='nurse@capulet')
+    other = Message.create(to='romeo@monteque')
+
+    # When the body of the original is moved to another message
+    other.append(message.get('body'))
+
+    # Then the clone still has its body
+    message.to_xml().should.equal('<message to="juliet@capulet" />')
+    clone.to_xml().should.equal('<message to="nurse@capulet"><body>hi</body></message>')
+    other.to_xml().should.equal('<message to="romeo@monteque" type="chat"><body>hi</body></message>')
+
+
+def test_to_xml_does_not_change_the_element():
+    ('Node.to_xml() should not fix up the element of a lazy node')
+
+    node = Node.from_element(ET.fromstring('<iq xmlns="jabber:client" type="get"/>'), lazy=True)
+
+    node.to_xml().should.equal('<iq type="get" />')
+    node._element.tag.should.equal('{jabber:client}iq')
+
+
+def test_to_xml_cache():
+    ('Node.to_xml() should be kept until the node or a descendant changes')
+
+    # Given a parsed message serialized once
+    message = Node.from_xml(
+        '<message xmlns="jabber:client" to="juliet@capulet"><body>hi</body></message>')
+    xml = message.to_xml()
+
+    # Then serializing it again returns the same string
+    message.to_xml().should.be(xml)
+
+    # When a child changes
+    message.get('body').value = 'hello'
+
+    # Then the parent is serialized again
+    message.to_xml().should.equal('<message to="juliet@capulet"><body>hello</body></message>')
+
+    # And so it is after an attribute is set
+    message.set_attribute('type', 'chat')
+    message.to_xml().should.equal('<message to="juliet@capulet" type="chat"><body>hello</body></message>')
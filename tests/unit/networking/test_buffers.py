@@ -0,0 +1,98 @@
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from xmpp.compat import Queue
+from xmpp.networking.buffers import ByteBuffer
+from xmpp.networking.buffers import BufferEmpty
+from xmpp.networking.buffers import BufferFull
+
+
+def test_byte_buffer_fifo():
+    ('ByteBuffer should return the chunks in the order they were added')
+
+    buffer = ByteBuffer()
+    buffer.append(b'<presence/>')
+    buffer.append(b'')
+    buffer.append(b'<message/>')
+
+    len(buffer).should.equal(21)
+    buffer.popleft().should.equal(b'<presence/>')
+    buffer.drain().should.equal([b'<message/>'])
+    buffer.should_not.be.ok
+    buffer.popleft.when.called_with().should.throw(BufferEmpty)
+
+
+def test_byte_buffer_high_water_mark():
+    ('ByteBuffer should refuse bytes once it reached its high-water mark')
+
+    buffer = ByteBuffer(high_water_mark=10)
+    buffer.append(b'<presence/>')
+
+    buffer.is_full.should.be.true
+    buffer.append.when.called_with(b'<message/>').should.throw(BufferFull)
+
+    # unless forced
+    buffer.append(b'<message/>', force=True)
+    len(buffer).should.equal(21)
+
+
+def test_byte_buffer_errors_are_queue_errors():
+    ('the ByteBuffer errors should be caught like the ones of Queue')
+
+    issubclass(BufferFull, Queue.Full).should.be.true
+    issubclass(BufferEmpty, Queue.Empty).should.be.true
+
+
+def test_byte_buffer_view_and_consume():
+    ('ByteBuffer.view() should join the chunks and consume() should forget the written bytes')
+
+    buffer = ByteBuffer()
+    buffer.append(b'<presence/>')
+    buffer.append(b'<message/>')
+
+    buffer.view().tobytes().should.equal(b'<presence/><message/>')
+
+    buffer.consume(5)
+    len(buffer).should.equal(16)
+    buffer.view().tobytes().should.equal(b'ence/><message/>')
+
+    buffer.append(b'<iq/>')
+    buffer.consume(6)
+    buffer.popleft().should.equal(b'<message/>')
+    buffer.drain().should.equal([b'<iq/>'])
+    len(buffer).should.equal(0)
+
+
+def test_byte_buffer_view_after_a_partial_write():
+    ('ByteBuffer.view() should not copy the bytes that are left after a partial write')
+
+    buffer = ByteBuffer()
+    buffer.append(b'a' * 10)
+    buffer.append(b'b' * 10)
+    joined = buffer.view().obj
+
+    # a partial write, then more bytes
+    buffer.consume(15)
+    buffer.append(b'<iq/>')
+
+    view = buffer.view()
+    view.obj.should.be(joined)
+    view.tobytes().should.equal(b'b' * 5)
+    len(buffer).should.equal(10)
+
+    buffer.consume(5)
+    buffer.view().tobytes().should.equal(b'<iq/>')
+    len(buffer).should.equal(5)
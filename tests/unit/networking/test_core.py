@@ -14,10 +14,12 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import errno
 import socket
-from xmpp.compat import Queue
 from mock import patch, ANY, Mock
 from xmpp.networking.core import XMPPConnection
+from xmpp.networking.buffers import BufferEmpty
+from xmpp.networking.buffers import BufferFull
 from tests.unit.util import EventHandlerMock
 from tests.unit.util import event_test
 
@@ -210,20 +212,21 @@ def test_send_whitespace_keepalive_failed(context, socket_ready):
 
 @event_test
 def test_perform_write_ok(context):
-    ('XMPPConnection.perform_write() should consume the write queue')
+    ('XMPPConnection.perform_write() should write the whole write queue at once')
     conn = XMPPConnection('capulet.com', 5222)
-    conn.write_queue = Mock(name='write_queue')
-    conn.write_queue.get.return_value = '<data />'
+    conn.send(b'<presence />')
+    conn.send(b'<message />')
 
     write = EventHandlerMock('on_write')
     conn.on.write(write)
 
     socket = Mock(name='socket')
+    socket.send.side_effect = lambda data: len(data)
     conn.perform_write(socket)
 
-    socket.sendall.assert_called_once_with('<data />')
-    write.assert_called_once_with(ANY, '<data />')
-    conn.write_queue.get.assert_called_once_with(block=False, timeout=3)
+    socket.send.assert_called_once_with(ANY)
+    write.assert_called_once_with(ANY, b'<presence /><message />')
+    conn.has_pending_output().should.be.false
 
 
 @event_test
@@ -232,8 +235,6 @@ def test_perform_write_empty_queue(context):
      'nothing when has an empty write queue')
 
     conn = XMPPConnection('capulet.com', 5222)
-    conn.write_queue = Mock(name='write_queue')
-    conn.write_queue.get.side_effect = Queue.Empty('dang!')
 
     write = EventHandlerMock('on_write')
     conn.on.write(write)
@@ -241,10 +242,58 @@ def test_perform_write_empty_queue(context):
     socket = Mock(name='socket')
     conn.perform_write(socket)
 
-    socket.sendall.called.should.be.false
+    socket.send.called.should.be.false
     write.called.should.be.false
 
 
+@event_test
+def test_perform_write_partial(context):
+    ('XMPPConnection.perform_write() should keep what the socket did not accept')
+
+    conn = XMPPConnection('capulet.com', 5222)
+    conn.send(b'<presence />')
+
+    write = EventHandlerMock('on_write')
+    conn.on.write(write)
+
+    # Given a socket that only takes 5 bytes at a time
+    socket = Mock(name='socket')
+    socket.send.side_effect = lambda data: min(len(data), 5)
+
+    # When it becomes writable once
+    conn.perform_write(socket)
+
+    # Then only the accepted bytes were written
+    write.assert_called_once_with(ANY, b'<pres')
+    len(conn.write_buffer).should.equal(7)
+    conn.has_pending_output().should.be.true
+
+    # And the rest is written the next times
+    conn.perform_write(socket)
+    conn.perform_write(socket)
+    bytes(socket.send.call_args[0][0]).should.equal(b'/>')
+    conn.has_pending_output().should.be.false
+
+
+@event_test
+def test_perform_write_would_block(context):
+    ('XMPPConnection.perform_write() should wait for the next time '
+     'the socket is ready when it would block')
+
+    conn = XMPPConnection('capulet.com', 5222)
+    conn.send(b'<presence />')
+
+    tcp_disconnect = EventHandlerMock('on_tcp_disconnect')
+    conn.on.tcp_disconnect(tcp_disconnect)
+
+    socket_ = Mock(name='socket')
+    socket_.send.side_effect = socket.error(errno.EAGAIN, 'try again')
+    conn.perform_write(socket_)
+
+    tcp_disconnect.called.should.be.false
+    conn.write_buffer.view().tobytes().should.equal(b'<presence />')
+
+
 @event_test
 @patch('xmpp.networking.core.logger')
 def test_perform_write_socket_error(context, logger):
@@ -252,8 +301,7 @@ def test_perform_write_socket_error(context, logger):
      'fire tcp_disconnect on socket error')
 
     conn = XMPPConnection('capulet.com', 5222)
-    conn.write_queue = Mock(name='write_queue')
-    conn.write_queue.get.return_value = '<data />'
+    conn.send(b'<data />')
 
     write = EventHandlerMock('on_write')
     tcp_disconnect = EventHandlerMock('on_tcp_disconnect')
@@ -262,24 +310,23 @@ def test_perform_write_socket_error(context, logger):
     conn.on.tcp_disconnect(tcp_disconnect)
 
     sock = Mock(name='socket')
-    sock.sendall.side_effect = socket.error('boom')
+    sock.send.side_effect = socket.error('boom')
     conn.perform_write(sock)
 
-    sock.sendall.assert_called_once_with('<data />')
     write.called.should.be.false
 
     tcp_disconnect.assert_called_once_with(ANY, 'boom')
 
     logger.warning.assert_called_once_with(
-        'failed to write data (%s): %s', 'boom', '<data />'
+        'failed to write data (%s): %s', 'boom', b'<data />'
     )
+    conn.write_buffer.view().tobytes().should.equal(b'<data />')
 
 
 @event_test
 def test_perform_read_ok(context):
-    ('XMPPConnection.perform_read() should consume the read queue')
+    ('XMPPConnection.perform_read() should fill the read buffer')
     conn = XMPPConnection('capulet.com', 5222, recv_chunk_size=420)
-    conn.read_queue = Mock(name='read_queue')
 
     read = EventHandlerMock('on_read')
     conn.on.read(read)
@@ -290,7 +337,7 @@ def test_perform_read_ok(context):
 
     socket.recv.assert_called_once_with(420)
     read.assert_called_once_with(ANY, '<data />')
-    conn.read_queue.put.assert_called_once_with('<data />', block=False, timeout=3)
+    conn.receive_all().should.equal(['<data />'])
 
 
 @event_test
@@ -300,8 +347,6 @@ def test_perform_read_socket_error(context, logger):
      'fire tcp_disconnect on socket error')
 
     conn = XMPPConnection('capulet.com', 5222, recv_chunk_size=420)
-    conn.read_queue = Mock(name='read_queue')
-    conn.read_queue.get.return_value = '<data />'
 
     read = EventHandlerMock('on_read')
     tcp_disconnect = EventHandlerMock('on_tcp_disconnect')
@@ -330,8 +375,6 @@ def test_perform_read_socket_error(context, logger):
      'fire tcp_disconnect on socket error')
 
     conn = XMPPConnection('capulet.com', 5222, recv_chunk_size=420)
-    conn.read_queue = Mock(name='read_queue')
-    conn.read_queue.get.return_value = '<data />'
 
     read = EventHandlerMock('on_read')
     tcp_disconnect = EventHandlerMock('on_tcp_disconnect')
@@ -355,45 +398,155 @@ def test_perform_read_socket_error(context, logger):
 
 @event_test
 def test_perform_read_no_data(context):
-    ('XMPPConnection.perform_read() should do nothing '
-     'if no data was received')
+    ('XMPPConnection.perform_read() should close the socket '
+     'and fire tcp_disconnect when the peer closed the connection')
 
     conn = XMPPConnection('capulet.com', 5222, recv_chunk_size=420)
-    conn.read_queue = Mock(name='read_queue')
+    sock = Mock(name='socket')
+    conn.socket = sock
 
     read = EventHandlerMock('on_read')
+    tcp_disconnect = EventHandlerMock('on_tcp_disconnect')
     conn.on.read(read)
+    conn.on.tcp_disconnect(tcp_disconnect)
 
-    socket = Mock(name='socket')
-    socket.recv.return_value = ''
-    conn.perform_read(socket)
+    sock.recv.return_value = b''
+    conn.perform_read(sock)
 
-    socket.recv.assert_called_once_with(420)
+    sock.recv.assert_called_once_with(420)
     read.called.should.be.false
-    conn.read_queue.put.called.should.be.false
+    conn.receive_all().should.equal([])
+
+    sock.close.assert_called_once_with()
+    conn.socket.should.be.none
+    tcp_disconnect.assert_called_once_with(ANY, 'closed by the peer')
+
+
+@event_test
+def test_perform_read_would_block(context):
+    ('XMPPConnection.perform_read() should keep the socket when there is nothing to read yet')
+
+    conn = XMPPConnection('capulet.com', 5222)
+    sock = Mock(name='socket')
+    conn.socket = sock
+
+    tcp_disconnect = EventHandlerMock('on_tcp_disconnect')
+    conn.on.tcp_disconnect(tcp_disconnect)
+
+    sock.recv.side_effect = socket.error(errno.EAGAIN, 'try again')
+    conn.perform_read(sock)
+
+    conn.socket.should.be(sock)
+    tcp_disconnect.called.should.be.false
+
+
+@event_test
+def test_loop_once_peer_closed(context):
+    ('XMPPConnection.loop_once() should stop waiting for a socket closed by the peer')
+
+    local, peer = socket.socketpair()
+    conn = XMPPConnection('capulet.com', 5222)
+    conn.socket = local
+
+    tcp_disconnect = EventHandlerMock('on_tcp_disconnect')
+    conn.on.tcp_disconnect(tcp_disconnect)
+
+    peer.close()
+    conn.loop_once(1)
+
+    conn.socket.should.be.none
+    tcp_disconnect.assert_called_once_with(ANY, 'closed by the peer')
+
+    # the next loops only wait for the timers
+    calls = []
+    conn.call_later(0, calls.append, 'due')
+    conn.loop_once(1)
+
+    calls.should.equal(['due'])
+    tcp_disconnect.assert_called_once_with(ANY, 'closed by the peer')
 
 
 @event_test
 def test_send(context):
-    ('XMPPConnection.send() should adds data to a write queue')
+    ('XMPPConnection.send() should add bytes to the write buffer')
 
     conn = XMPPConnection('capulet.com', 5222)
-    conn.write_queue = Mock(name='write_queue')
 
     conn.send('foo')
-    conn.write_queue.put.assert_called_once_with('foo', block=False, timeout=3)
+    conn.send(b'bar')
+    conn.write_buffer.drain().should.equal([b'foo', b'bar'])
+
+
+@event_test
+def test_send_full(context):
+    ('XMPPConnection.send() should signal when the write buffer reaches hwm_out and refuse more bytes')
+
+    conn = XMPPConnection('capulet.com', 5222, hwm_out=8)
+    write_buffer_full = EventHandlerMock('on_write_buffer_full')
+    write_buffer_drained = EventHandlerMock('on_write_buffer_drained')
+    conn.on.write_buffer_full(write_buffer_full)
+    conn.on.write_buffer_drained(write_buffer_drained)
+
+    # When the buffer goes over its high-water mark
+    conn.send(b'<presence />')
+
+    # Then the event is fired
+    write_buffer_full.assert_called_once_with(ANY, conn)
+
+    # And no more bytes are accepted
+    conn.send.when.called_with(b'<message />').should.throw(BufferFull)
+
+    # Until it is written
+    socket = Mock(name='socket')
+    socket.send.side_effect = lambda data: len(data)
+    conn.perform_write(socket)
+
+    write_buffer_drained.assert_called_once_with(ANY, conn)
+    conn.send(b'<message />')
+
+
+@event_test
+def test_submit(context):
+    ('XMPPConnection.submit() should hand bytes to the thread that writes')
+
+    conn = XMPPConnection('capulet.com', 5222)
+    conn.send(b'<presence />')
+
+    # When another thread submits bytes
+    conn.submit(b'<message />')
+
+    # Then they are pending
+    conn.has_pending_output().should.be.true
+
+    # And written after the bytes sent before
+    socket = Mock(name='socket')
+    socket.send.side_effect = lambda data: len(data)
+    conn.perform_write(socket)
+
+    bytes(socket.send.call_args[0][0]).should.equal(b'<presence /><message />')
+    conn.has_pending_output().should.be.false
 
 
 @event_test
 def test_receive(context):
-    ('XMPPConnection.receive() should adds data to a read queue')
+    ('XMPPConnection.receive() should take the first chunk of the read buffer')
 
     conn = XMPPConnection('capulet.com', 5222)
-    conn.read_queue = Mock(name='read_queue')
+    conn.read_buffer.append(b'<presence/>')
+
+    conn.receive(30).should.equal(b'<presence/>')
+    conn.receive.when.called_with(30).should.throw(BufferEmpty)
 
-    conn.receive(30)
 
-    conn.read_queue.get.assert_called_once_with(block=False, timeout=30)
+def test_receive_all():
+    ('XMPPConnection.receive_all() should drain the read buffer')
+
+    conn = XMPPConnection('capulet.com', 5222)
+    conn.read_buffer.append(b'<presence/>')
+    conn.read_buffer.append(b'<message/>')
+
+    conn.receive_all().should.equal([b'<presence/>', b'<message/>'])
+    conn.receive_all().should.equal([])
 
 
 @event_test
@@ -406,12 +559,107 @@ def test_loop_once(context, socket_ready, perform_write, perform_read):
 
     conn = XMPPConnection('capulet.com', 5222)
     conn.socket = Mock(name='socket')
-    conn.read_queue = Mock(name='read_queue')
-    conn.write_queue = Mock(name='write_queue')
+    conn.send(b'<presence />')
 
     conn.loop_once(2)
 
     conn.socket.setblocking.assert_called_once_with(False)
+    socket_ready.assert_called_once_with(conn.socket, 2, to_read=True, to_write=True, wakeup=conn.wakeup)
 
     perform_write.assert_called_once_with(socket.write)
     perform_read.assert_called_once_with(socket.read)
+
+
+@event_test
+@patch('xmpp.networking.core.XMPPConnection.perform_read')
+@patch('xmpp.networking.core.XMPPConnection.perform_write')
+@patch('xmpp.networking.core.socket_ready')
+def test_loop_once_nothing_to_write(context, socket_ready, perform_write, perform_read):
+    ('XMPPConnection.loop_once() should not wait for the socket to be writable without pending output')
+
+    conn = XMPPConnection('capulet.com', 5222)
+    conn.socket = Mock(name='socket')
+
+    conn.loop_once(2)
+
+    socket_ready.assert_called_once_with(conn.socket, 2, to_read=True, to_write=False, wakeup=conn.wakeup)
+
+
+@event_test
+@patch('xmpp.networking.core.XMPPConnection.perform_read')
+@patch('xmpp.networking.core.XMPPConnection.perform_write')
+@patch('xmpp.networking.core.socket_ready')
+def test_loop_once_read_buffer_full(context, socket_ready, perform_write, perform_read):
+    ('XMPPConnection.loop_once() should stop reading while the read buffer is full')
+
+    conn = XMPPConnection('capulet.com', 5222, hwm_in=4)
+    conn.socket = Mock(name='socket')
+    conn.read_buffer.append(b'<presence/>')
+
+    conn.loop_once(2)
+
+    socket_ready.assert_called_once_with(conn.socket, 2, to_read=False, to_write=False, wakeup=conn.wakeup)
+
+
+@event_test
+@patch('xmpp.networking.core.XMPPConnection.perform_read')
+@patch('xmpp.networking.core.XMPPConnection.perform_write')
+@patch('xmpp.networking.core.socket_ready')
+def test_loop_once_until_next_timer(context, socket_ready, perform_write, perform_read):
+    ('XMPPConnection.loop_once() should only wait until the next timer is due')
+
+    conn = XMPPConnection('capulet.com', 5222)
+    conn.socket = Mock(name='socket')
+    conn.call_later(0.5, Mock())
+
+    conn.loop_once(30)
+
+    timeout = socket_ready.call_args[0][1]
+    timeout.should.be.lower_than_or_equal_to(0.5)
+
+
+@event_test
+@patch('xmpp.networking.util.monotonic')
+def test_call_later(context, monotonic):
+    ('XMPPConnection.call_later() should call the callbacks that are due in the order of their deadlines')
+
+    monotonic.return_value = 100
+    conn = XMPPConnection('capulet.com', 5222)
+    calls = []
+
+    conn.call_later(2, calls.append, 'second')
+    conn.call_later(1, calls.append, 'first')
+    conn.call_later(3, calls.append, 'cancelled').cancel()
+    conn.call_later(10, calls.append, 'later')
+
+    conn.next_timeout(30).should.equal(1)
+
+    monotonic.return_value = 103
+    conn.run_timers()
+
+    calls.should.equal(['first', 'second'])
+    conn.next_timeout(30).should.equal(7)
+    conn.next_timeout(None).should.equal(7)
+
+
+def test_submit_wakes_up_the_loop():
+    ('XMPPConnection.submit() should notify the wakeup of the loop')
+
+    conn = XMPPConnection('capulet.com', 5222)
+    conn.wakeup = Mock(name='wakeup')
+
+    conn.submit(b'<presence />')
+
+    conn.wakeup.notify.assert_called_once_with()
+
+
+@event_test
+@patch('xmpp.networking.core.socket_ready')
+def test_send_whitespace_keepalive_pending_output(context, socket_ready):
+    ('XMPPConnection.send_whitespace_keepalive() should not write while there is pending output')
+
+    conn = XMPPConnection('capulet.com', 5222)
+    conn.send(b'<presence />')
+
+    conn.send_whitespace_keepalive().should.be.true
+    socket_ready.called.should.be.false
@@ -0,0 +1,276 @@
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import socket
+import selectors
+import threading
+from mock import ANY
+from xmpp.stream import XMLStream
+from xmpp.networking.core import XMPPConnection
+from xmpp.networking.reactor import XMPPReactor
+from tests.unit.util import EventHandlerMock
+from tests.unit.util import event_test
+
+
+def connected_pair(**kw):
+    # a connection with a socket of a socketpair, and the other side
+    local, peer = socket.socketpair()
+    conn = XMPPConnection('capulet.com', 5222, **kw)
+    conn.socket = local
+    return conn, peer
+
+
+def registered_events(reactor, conn):
+    try:
+        return reactor.selector.get_key(conn.socket).events
+    except KeyError:
+        return 0
+
+
+@event_test
+def test_register(context):
+    ('XMPPReactor.register() should wait for the socket to be readable and take over the wakeup and timers of the connection')
+
+    reactor = XMPPReactor()
+    conn, peer = connected_pair()
+    timer = conn.call_later(10, lambda: None)
+
+    reactor.register(conn)
+
+    len(reactor).should.equal(1)
+    conn.reactor.should.equal(reactor)
+    conn.wakeup.should.equal(reactor.wakeup)
+    conn.timers.should.equal(reactor.timers)
+    list(reactor.timers).should.equal([timer])
+    conn.socket.gettimeout().should.equal(0.0)
+    registered_events(reactor, conn).should.equal(selectors.EVENT_READ)
+
+    reactor.close()
+    peer.close()
+
+
+@event_test
+def test_unregister(context):
+    ('XMPPReactor.unregister() should stop waiting for the socket and leave it open')
+
+    reactor = XMPPReactor()
+    conn, peer = connected_pair()
+    reactor.register(conn)
+
+    reactor.unregister(conn)
+
+    len(reactor).should.equal(0)
+    conn.reactor.should.be.none
+    conn.wakeup.should.be.none
+    conn.timers.should_not.equal(reactor.timers)
+    reactor.selector.get_map().should.have.length_of(1)
+    conn.socket.fileno().should.be.greater_than(0)
+
+    reactor.close()
+    conn.socket.close()
+    peer.close()
+
+
+@event_test
+def test_loop_once_writes_pending_output(context):
+    ('XMPPReactor.loop_once() should write the output of a connection and then stop waiting for it to be writable')
+
+    reactor = XMPPReactor()
+    conn, peer = connected_pair()
+    reactor.register(conn)
+
+    conn.send(b'<presence />')
+    reactor.loop_once(1)
+
+    peer.recv(1024).should.equal(b'<presence />')
+    registered_events(reactor, conn).should.equal(selectors.EVENT_READ)
+
+    reactor.close()
+    peer.close()
+
+
+@event_test
+def test_loop_once_dispatches_reads_to_the_stream(context):
+    ('XMPPReactor.loop_once() should read the sockets that are ready and dispatch the bytes to their XMLStream')
+
+    reactor = XMPPReactor()
+    handlers = []
+    peers = []
+    for index in range(3):
+        conn, peer = connected_pair()
+        stream = XMLStream(conn)
+        handler = EventHandlerMock('on_presence_{0}'.format(index))
+        stream.on.presence(handler)
+        reactor.register(conn)
+        handlers.append(handler)
+        peers.append(peer)
+
+    peers[1].sendall(b'<stream:stream xmlns="jabber:client" xmlns:stream="http://etherx.jabber.org/streams">')
+    peers[1].sendall(b'<presence from="juliet@capulet.com" />')
+
+    while not handlers[1].called:
+        reactor.loop_once(1)
+
+    handlers[1].assert_called_once_with(ANY, ANY)
+    handlers[0].called.should.be.false
+    handlers[2].called.should.be.false
+
+    reactor.close()
+    for peer in peers:
+        peer.close()
+
+
+@event_test
+def test_loop_once_peer_closed(context):
+    ('XMPPReactor.loop_once() should unregister and disconnect the connections closed by the peer')
+
+    reactor = XMPPReactor()
+    conn, peer = connected_pair()
+    tcp_disconnect = EventHandlerMock('on_tcp_disconnect')
+    conn.on.tcp_disconnect(tcp_disconnect)
+    reactor.register(conn)
+
+    peer.close()
+    reactor.loop_once(1)
+
+    len(reactor).should.equal(0)
+    conn.socket.should.be.none
+    tcp_disconnect.assert_called_once_with(ANY, 'closed by the peer')
+    reactor.wakeup.reader.fileno().should.be.greater_than(0)
+
+    reactor.close()
+
+
+@event_test
+def test_disconnect_outside_of_the_loop(context):
+    ('XMPPConnection.disconnect() should unregister the connection, so that its file descriptor can be reused')
+
+    reactor = XMPPReactor()
+    conn, peer = connected_pair()
+    reactor.register(conn)
+    fileno = conn.socket.fileno()
+
+    conn.disconnect()
+    peer.close()
+
+    len(reactor).should.equal(0)
+    conn.reactor.should.be.none
+    reactor.wakeup.reader.fileno().should.be.greater_than(0)
+
+    # the next socket gets the same file descriptor
+    other, other_peer = connected_pair()
+    other.socket.fileno().should.equal(fileno)
+    reactor.register(other)
+
+    len(reactor).should.equal(1)
+    registered_events(reactor, other).should.equal(selectors.EVENT_READ)
+
+    other_peer.close()
+    reactor.close()
+
+
+@event_test
+def test_loop_once_read_buffer_full(context):
+    ('XMPPReactor.loop_once() should stop reading a connection while its read buffer is full')
+
+    reactor = XMPPReactor()
+    conn, peer = connected_pair(hwm_in=4)
+    reactor.register(conn)
+
+    peer.sendall(b'<presence />')
+    reactor.loop_once(1)
+
+    registered_events(reactor, conn).should.equal(0)
+    reactor.throttled.should.equal({conn})
+
+    conn.receive_all().should.equal([b'<presence />'])
+    reactor.loop_once(0)
+
+    registered_events(reactor, conn).should.equal(selectors.EVENT_READ)
+    reactor.throttled.should.be.empty
+
+    reactor.close()
+    peer.close()
+
+
+@event_test
+def test_loop_once_submit_from_another_thread(context):
+    ('XMPPReactor.loop_once() should wake up and write the bytes submitted by other threads')
+
+    reactor = XMPPReactor()
+    conn, peer = connected_pair()
+    reactor.register(conn)
+
+    thread = threading.Thread(target=conn.submit, args=(b'<presence />',))
+    thread.start()
+    thread.join()
+
+    reactor.loop_once(10)
+    reactor.loop_once(10)
+
+    peer.recv(1024).should.equal(b'<presence />')
+
+    reactor.close()
+    peer.close()
+
+
+@event_test
+def test_loop_once_runs_the_timers(context):
+    ('XMPPReactor.loop_once() should call the timers scheduled by its connections')
+
+    reactor = XMPPReactor()
+    conn, peer = connected_pair()
+    reactor.register(conn)
+    calls = []
+
+    conn.call_later(0, calls.append, 'due')
+    conn.call_later(60, calls.append, 'later')
+    reactor.loop_once(10)
+
+    calls.should.equal(['due'])
+
+    reactor.close()
+    peer.close()
+
+
+@event_test
+def test_loop_once_many_connections(context):
+    ('XMPPReactor.loop_once() should serve many connections at once')
+
+    reactor = XMPPReactor()
+    pairs = [connected_pair() for _ in range(100)]
+    received = []
+    for conn, peer in pairs:
+        conn.on.ready_to_read(lambda event, conn: received.extend(conn.receive_all()))
+        reactor.register(conn)
+        peer.sendall(b' ')
+
+    while len(received) < 100:
+        reactor.loop_once(1)
+
+    for conn, peer in pairs:
+        conn.send(b'<presence />')
+
+    while any(conn.has_pending_output() for conn, _ in pairs):
+        reactor.loop_once(1)
+
+    for conn, peer in pairs:
+        peer.recv(1024).should.equal(b'<presence />')
+
+    reactor.close()
+    for conn, peer in pairs:
+        conn.socket.close()
+        peer.close()
@@ -15,10 +15,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import socket
+
 from mock import patch, Mock, call
 from xmpp.networking.util import create_tcp_socket
 from xmpp.networking.util import address_is_ip
 from xmpp.networking.util import socket_ready
+from xmpp.networking.util import Wakeup
 from xmpp.networking.util import SocketStatePair
 from xmpp.networking.util import set_keepalive
 from xmpp.networking.util import set_keepalive_osx
@@ -112,6 +115,32 @@ def test_socket_ready(select):
     result.read.should.equal('reader1')
     result.write.should.equal('writer1')
 
+    # And the timeout is in seconds
+    select.select.assert_called_once_with([sock], [sock], [], 420.0)
+
+
+def test_socket_ready_wakeup():
+    ('xmpp.networking.util.socket_ready() should return when the wakeup is notified')
+
+    reader, writer = socket.socketpair()
+    wakeup = Wakeup()
+    try:
+        wakeup.notify()
+        wakeup.notify()
+
+        result = socket_ready(reader, 10, to_write=False, wakeup=wakeup)
+
+        result.read.should.be.none
+        result.write.should.be.none
+
+        # And the notifications were consumed
+        socket_ready(reader, 0, to_write=False, wakeup=wakeup).read.should.be.none
+        wakeup.reader.recv.when.called_with(1).should.throw(socket.error)
+    finally:
+        wakeup.close()
+        reader.close()
+        writer.close()
+
 
 def test_address_is_ip():
     ('xmpp.networking.util.address_is_ip() returns True for numbers')
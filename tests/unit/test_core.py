@@ -21,6 +21,7 @@ from xmpp.core import generate_id
 from xmpp.core import is_element
 from xmpp.core import cast_string
 from xmpp.core import fixup_unknown_element
+from xmpp.core import split_tag_and_namespace
 from tests.unit.util import XML
 
 
@@ -57,3 +58,26 @@ def test_is_element():
 
     is_element(ET.Element('tag')).should.be.true
     is_element(None).should.be.false
+
+
+def test_split_tag_and_namespace():
+    ('split_tag_and_namespace() should split names in {namespace}name notation')
+
+    split_tag_and_namespace('{jabber:client}message').should.equal(('message', 'jabber:client'))
+    split_tag_and_namespace('{urn:xmpp:sid:0}stanza-id').should.equal(('stanza-id', 'urn:xmpp:sid:0'))
+    split_tag_and_namespace('stream:stream').should.equal(('stream:stream', ''))
+    split_tag_and_namespace('{}message').should.equal(('{}message', ''))
+
+
+@patch('xmpp.core.SPLIT_NAMES_LIMIT', 2)
+def test_split_tag_and_namespace_is_bounded():
+    ('split_tag_and_namespace() should memoize a bounded amount of names')
+
+    from xmpp.core import _SPLIT_NAMES
+    _SPLIT_NAMES.clear()
+
+    for index in range(5):
+        split_tag_and_namespace('{{urn:test}}name{0}'.format(index))
+
+    len(_SPLIT_NAMES).should.be.lower_than(3)
+    split_tag_and_namespace('{urn:test}name4').should.be(split_tag_and_namespace('{urn:test}name4'))
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import threading
+
+from mock import Mock
+
+from xmpp import XMLStream
+from xmpp.core import ET
+from xmpp.core import element_to_record
+from xmpp.core import record_to_element
+from xmpp.offload import ParsingPool
+from xmpp.offload import StreamParser
+from xmpp.parser import ParserLimits
+
+from .util import EventHandlerMock, event_test, FakeConnection
+
+
+OPEN_STREAM = (
+    '<stream:stream from="capulet" id="ofl" version="1.0" xmlns="jabber:client" '
+    'xmlns:stream="http://etherx.jabber.org/streams">'
+    '<stream:features><starttls xmlns="urn:ietf:params:xml:ns:xmpp-tls"/></stream:features>'
+)
+
+
+def test_element_records():
+    ('record_to_element() rebuilds the element serialized by element_to_record()')
+
+    source = '<message xmlns="jabber:client" to="juliet@capulet"><body>hi</body> there <x xmlns="x:y"/></message>'
+    element = ET.fromstring(source)
+
+    rebuilt = record_to_element(element_to_record(element))
+
+    ET.tostring(rebuilt).should.equal(ET.tostring(element))
+
+
+def test_stream_parser_records():
+    ('StreamParser turns the XML of a stream into records')
+
+    parser = StreamParser()
+
+    records = parser.feed(OPEN_STREAM.encode('utf-8') + b'<presence from="romeo@monteque"/><pres')
+
+    [kind for kind, _ in records].should.equal([
+        'node_did_open',
+        'stanza_did_close',
+        'stanza_did_close',
+    ])
+    # the <starttls> child is not recorded again, only its path
+    features, paths = records[1][1]
+    features[0].should.equal('{http://etherx.jabber.org/streams}features')
+    paths.should.equal(((0,),))
+
+    record, paths = records[-1][1]
+    record[0].should.equal('{jabber:client}presence')
+    paths.should.equal(())
+
+
+def test_feed_records_dispatches_like_feed():
+    ('XMLStream.feed_records() dispatches the same nodes as XMLStream.feed()')
+
+    xml = OPEN_STREAM + (
+        '<iq type="result" id="r1"><query xmlns="jabber:iq:roster">'
+        '<item jid="romeo@monteque"><group>Friends</group></item>'
+        '</query></iq>'
+        '<presence from="romeo@monteque"><priority>10</priority></presence>'
+    )
+
+    def dispatched(feed):
+        stream = XMLStream(FakeConnection())
+        nodes = []
+        stream.on.node(lambda event, node: nodes.append(node))
+        feed(stream)
+        return stream, nodes
+
+    _, expected = dispatched(lambda stream: stream.feed(xml))
+    stream, nodes = dispatched(lambda stream: stream.feed_records(StreamParser().feed(xml)))
+
+    [type(n) for n in nodes].should.equal([type(n) for n in expected])
+    [n.to_xml() for n in nodes].should.equal([n.to_xml() for n in expected])
+    stream.stream_node.supports_tls().should.be.true
+
+    # the children are the nodes of the subtree of their stanza
+    presence = nodes[-1]
+    presence.get('priority').should.be(nodes[-2])
+
+
+def test_stream_parser_errors():
+    ('StreamParser records limit violations and malformed xml, then stops parsing')
+
+    parser = StreamParser(limits=ParserLimits(max_depth=2))
+
+    parser.feed(OPEN_STREAM).should.have.length_of(2)
+    parser.feed('<message><a><b/></a></message>').should.equal([
+        ('limit_exceeded', 'stanza is nested deeper than 2 elements'),
+    ])
+    # the stream failed, nothing else is parsed
+    parser.feed(b'<presence/>').should.equal([])
+
+    parser = StreamParser()
+    parser.feed(OPEN_STREAM)
+    records = parser.feed(b'</wat>')
+    [kind for kind, _ in records].should.equal(['unhandled_xml', 'bad_format'])
+    records[0][1].should.equal(b'</wat>')
+    parser.feed(b'<presence/>').should.equal([])
+
+
+@event_test
+def test_parsing_pool(context):
+    ('XMLStream(parsing_pool=ParsingPool()) dispatches the stanzas parsed by the workers in order')
+
+    pool = ParsingPool(processes=2)
+    try:
+        handlers = []
+        streams = []
+        for index in range(3):
+            handler = EventHandlerMock('on_presence_{0}'.format(index))
+            stream = XMLStream(FakeConnection(), parsing_pool=pool)
+            stream.on.node(handler)
+            stream.feed(OPEN_STREAM)
+            handlers.append(handler)
+            streams.append(stream)
+
+        for number in range(20):
+            for index, stream in enumerate(streams):
+                stream.feed('<presence from="romeo{0}@monteque{1}"/>'.format(number, index))
+
+        dispatched = 0
+        while dispatched < 60:
+            dispatched += pool.dispatch(timeout=5)
+
+        for index, (stream, handler) in enumerate(zip(streams, handlers)):
+            stream.stream_node.supports_tls().should.be.true
+            senders = [c[0][-1].attr.get('from') for c in handler.call_args_list[2:]]
+            senders.should.equal(['romeo{0}@monteque{1}'.format(number, index) for number in range(20)])
+    finally:
+        pool.close()
+
+
+def test_parsing_pool_close_discards_pending_records():
+    ('ParsingPool.close() returns while the workers hold records that were never dispatched')
+
+    pool = ParsingPool(processes=1)
+    stream = XMLStream(FakeConnection(), parsing_pool=pool)
+    stream.feed(OPEN_STREAM)
+    for number in range(200):
+        stream.feed('<message><body>{0}</body></message>'.format('x' * 1024))
+
+    closing = threading.Thread(target=pool.close)
+    closing.daemon = True
+    closing.start()
+    closing.join(30)
+
+    closing.is_alive().should.be.false
+    pool.workers.should.equal([])
+
+
+def test_close_does_not_register_a_new_parser():
+    ('XMLStream.close() releases its parser without registering a new one in the pool')
+
+    pool = Mock(name='ParsingPool')
+    stream = XMLStream(FakeConnection(), parsing_pool=pool)
+    parser = stream.parser
+
+    stream.close(disconnect=False)
+
+    pool.register.call_count.should.equal(1)
+    pool.unregister.assert_called_once_with(parser)
+    stream.parser.should.be.none
+
+    # the next feed registers the stream again
+    stream.feed(OPEN_STREAM)
+    pool.register.call_count.should.equal(2)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from xmpp.core import ET
+from xmpp.parser import IncrementalParser
+from xmpp.parser import ElementTreeBackend
+from xmpp.parser import available_parser_backends
+from xmpp.parser import get_parser_backend
+
+
+class RecordingTarget(object):
+    def __init__(self):
+        self.events = []
+
+    def reset(self):
+        self.events = []
+
+    def start(self, tag, attrib):
+        self.events.append(('start', tag))
+        if attrib:
+            self.events.append(('attrib', sorted(attrib.items())))
+
+    def end(self, tag):
+        self.events.append(('end', tag))
+
+    def data(self, text):
+        if self.events and self.events[-1][0] == 'data':
+            self.events[-1] = ('data', self.events[-1][1] + text)
+        else:
+            self.events.append(('data', text))
+
+    def close(self):
+        pass
+
+
+def parsed_events(chunks, backend):
+    target = RecordingTarget()
+    parser = IncrementalParser(target, backend)
+    for chunk in chunks:
+        parser.feed(chunk)
+
+    return [e for e in target.events if e[0] != 'data' or e[1].strip()]
+
+
+RESTART = (
+    b"<?xml version='1.0'?>\n<stream:stream xmlns='jabber:client' "
+    b"xmlns:stream='http://etherx.jabber.org/streams'><success xmlns='urn:ietf:params:xml:ns:xmpp-sasl'/>"
+    b"<?xml version='1.0'?>\r\n  <stream:stream xmlns='jabber:client' "
+    b"xmlns:stream='http://etherx.jabber.org/streams'> <presence/> "
+)
+
+EXPECTED_EVENTS = [
+    ('start', 'xmpp-envelope'),
+    ('start', '{http://etherx.jabber.org/streams}stream'),
+    ('start', '{urn:ietf:params:xml:ns:xmpp-sasl}success'),
+    ('end', '{urn:ietf:params:xml:ns:xmpp-sasl}success'),
+    ('start', '{http://etherx.jabber.org/streams}stream'),
+    ('start', '{jabber:client}presence'),
+    ('end', '{jabber:client}presence'),
+]
+
+
+def test_skips_xml_declarations():
+    ('IncrementalParser.feed() skips xml declarations, including stream restarts')
+
+    for backend in available_parser_backends():
+        parsed_events([RESTART], backend).should.equal(EXPECTED_EVENTS)
+
+
+def test_xml_declaration_split_anywhere():
+    ('IncrementalParser.feed() skips xml declarations split across chunks at any position')
+
+    for backend in available_parser_backends():
+        for position in range(1, len(RESTART)):
+            chunks = [RESTART[:position], RESTART[position:]]
+            parsed_events(chunks, backend).should.equal(EXPECTED_EVENTS)
+
+        # and split at every byte offset at once
+        chunks = [RESTART[i:i + 1] for i in range(len(RESTART))]
+        parsed_events(chunks, backend).should.equal(EXPECTED_EVENTS)
+
+
+def test_keeps_xml_declarations_outside_of_stream_boundaries():
+    ('IncrementalParser.feed() only skips the xml declarations right before a <stream:stream>')
+
+    stanza = (
+        b"<stream:stream xmlns='jabber:client' xmlns:stream='http://etherx.jabber.org/streams'>"
+        b"<message><?xml-stylesheet href='romeo.xsl'?><body><![CDATA[<?xml version='1.0'?> <presence/>]]></body></message>"
+    )
+    expected = [
+        ('start', 'xmpp-envelope'),
+        ('start', '{http://etherx.jabber.org/streams}stream'),
+        ('start', '{jabber:client}message'),
+        ('start', '{jabber:client}body'),
+        ('data', u"<?xml version='1.0'?> <presence/>"),
+        ('end', '{jabber:client}body'),
+        ('end', '{jabber:client}message'),
+    ]
+
+    for backend in available_parser_backends():
+        parsed_events([stanza], backend).should.equal(expected)
+        for position in range(1, len(stanza)):
+            chunks = [stanza[:position], stanza[position:]]
+            parsed_events(chunks, backend).should.equal(expected)
+
+
+def test_accepts_buffers():
+    ('IncrementalParser.feed() accepts bytes, bytearray and memoryview chunks')
+
+    for backend in available_parser_backends():
+        chunks = [RESTART[:60], bytearray(RESTART[60:130]), memoryview(RESTART)[130:]]
+        parsed_events(chunks, backend).should.equal(EXPECTED_EVENTS)
+
+
+def test_backends_namespaces_attributes_and_text():
+    ('every parser backend yields the same namespaced tags, attributes and text')
+
+    stanza = (
+        u'<stream:stream xmlns="jabber:client" xmlns:stream="http://etherx.jabber.org/streams" xml:lang="en">'
+        u'<message to="juliet@capulet" type="chat"><body>wherefore art thou, '
+        u'Romeo? \u2764</body><x xmlns="vcard-temp:x:update"/></message>'
+    ).encode('utf-8')
+
+    expected = [
+        ('start', 'xmpp-envelope'),
+        ('start', '{http://etherx.jabber.org/streams}stream'),
+        ('attrib', [('{http://www.w3.org/XML/1998/namespace}lang', 'en')]),
+        ('start', '{jabber:client}message'),
+        ('attrib', [('to', 'juliet@capulet'), ('type', 'chat')]),
+        ('start', '{jabber:client}body'),
+        ('data', u'wherefore art thou, Romeo? \u2764'),
+        ('end', '{jabber:client}body'),
+        ('start', '{vcard-temp:x:update}x'),
+        ('end', '{vcard-temp:x:update}x'),
+        ('end', '{jabber:client}message'),
+    ]
+
+    for backend in available_parser_backends():
+        parsed_events([stanza], backend).should.equal(expected)
+        parsed_events([stanza[i:i + 1] for i in range(len(stanza))], backend).should.equal(expected)
+
+
+def test_backends_raise_parse_error():
+    ('every parser backend raises ParseError for malformed XML')
+
+    for backend in available_parser_backends():
+        parser = IncrementalParser(RecordingTarget(), backend)
+        parser.feed.when.called_with(b'<presence from=romeo />').should.throw(ET.ParseError)
+
+
+def test_get_parser_backend():
+    ('get_parser_backend() resolves names and falls back to ElementTree')
+
+    get_parser_backend().should.equal(ElementTreeBackend)
+    get_parser_backend('etree').should.equal(ElementTreeBackend)
+    get_parser_backend('expat').name.should.equal('expat')
+    get_parser_backend.when.called_with('sax').should.throw(ValueError, 'unknown parser backend: sax')
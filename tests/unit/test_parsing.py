@@ -15,17 +15,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import random
 from mock import Mock, ANY, call
 
 from xmpp import XMLStream
+from xmpp.parser import available_parser_backends
 from xmpp.models import (
     SASLMechanism,
     SASLMechanismSet,
     StartTLS,
     IQRegister,
     StreamFeatures,
-    StreamError,
-    InvalidNamespace
 )
 
 from .util import XML, EventHandlerMock, nodes_from_call, event_test
@@ -134,3 +134,92 @@ def test_stream_parse_stream_features(context):
 #     ])
 
 #     unhandled_handler.assert_has_calls([])
+
+
+STREAM_TRAFFIC = XML('''
+<stream:stream
+    from="my.server"
+    id="c2a55811-7b4f-4429-919a-c3d91a666f83"
+    version="1.0"
+    xmlns="jabber:client"
+    xmlns:stream="http://etherx.jabber.org/streams" xml:lang="en">
+   <stream:features>
+         <mechanisms xmlns="urn:ietf:params:xml:ns:xmpp-sasl">
+             <mechanism>SCRAM-SHA-1</mechanism>
+         </mechanisms>
+         <starttls xmlns="urn:ietf:params:xml:ns:xmpp-tls"/>
+   </stream:features>
+   <presence from="romeo@monteque/orchard" to="juliet@capulet"><show>away</show><status>thinking of thee</status></presence>
+   <message from="romeo@monteque/orchard" to="juliet@capulet" type="chat"><body>Wherefore art thou?</body></message>
+   <iq id="roster1" type="result"><query xmlns="jabber:iq:roster"><item jid="nurse@capulet" name="Nurse"/></query></iq>
+''')
+
+
+def feed_in_chunks(chunks, parser_backend=None):
+    connection = Mock(name='connection')
+    node_handler = EventHandlerMock('on_node')
+    unhandled_handler = EventHandlerMock('on_unhandled_xml')
+
+    stream = XMLStream(connection, parser_backend=parser_backend)
+    stream.on.node(node_handler)
+    stream.on.unhandled_xml(unhandled_handler)
+    parser = stream.parser
+
+    for chunk in chunks:
+        stream.feed(chunk)
+
+    stream.parser.should.be(parser)
+    unhandled_handler.called.should.be.false
+    return [c[0][-1].to_xml() for c in node_handler.call_args_list]
+
+
+@event_test
+def test_stream_parse_single_chunk(context):
+    ('XMLStream.feed dispatches every top-level stanza of a single chunk')
+
+    nodes = feed_in_chunks([STREAM_TRAFFIC])
+
+    # the children with a model are dispatched before their stanzas
+    nodes.should.have.length_of(12)
+    nodes[4].should.equal('<show>away</show>')
+    nodes[6].should.contain('thinking of thee')
+    nodes[8].should.contain('Wherefore art thou?')
+    nodes[-1].should.contain('nurse@capulet')
+
+
+@event_test
+def test_stream_parse_byte_per_byte(context):
+    ('XMLStream.feed yields the same stanzas when fed one byte at a time')
+
+    expected = feed_in_chunks([STREAM_TRAFFIC])
+
+    feed_in_chunks(list(STREAM_TRAFFIC)).should.equal(expected)
+
+
+@event_test
+def test_stream_parse_random_fragmentation(context):
+    ('XMLStream.feed yields the same stanzas regardless of fragmentation')
+
+    expected = feed_in_chunks([STREAM_TRAFFIC])
+    randomizer = random.Random(42)
+
+    for _ in range(20):
+        chunks = []
+        position = 0
+        while position < len(STREAM_TRAFFIC):
+            size = randomizer.randint(1, 64)
+            chunks.append(STREAM_TRAFFIC[position:position + size])
+            position += size
+
+        feed_in_chunks(chunks).should.equal(expected)
+
+
+@event_test
+def test_stream_parse_every_backend(context):
+    ('XMLStream.feed dispatches the same nodes with every available parser backend')
+
+    expected = feed_in_chunks([STREAM_TRAFFIC], 'etree')
+
+    for backend in available_parser_backends():
+        feed_in_chunks([STREAM_TRAFFIC], backend).should.equal(expected)
+        feed_in_chunks(list(STREAM_TRAFFIC), backend).should.equal(expected)
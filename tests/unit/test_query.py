@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import types
+
+from mock import patch
+
+from xmpp.models import Node
+from xmpp.models import RosterItem
+from xmpp.query import QuerySyntaxError
+from xmpp.query import compile_query
+
+
+ROSTER = (
+    '<iq xmlns="jabber:client" type="result">'
+    '<query xmlns="jabber:iq:roster">'
+    '<item jid="nurse@capulet" subscription="both"><group>Capulet</group></item>'
+    '<item jid="romeo@montague" subscription="to"><group>Montague</group><group>Friends</group></item>'
+    '</query>'
+    '<query xmlns="urn:test"><item jid="tybalt@capulet"/></query>'
+    '</iq>'
+)
+
+
+def test_query_prefixes():
+    ('Node.query() should match the prefixes declared by the nodes')
+
+    iq = Node.from_xml(ROSTER)
+
+    iq.query('query/item/@jid').should.equal(['nurse@capulet', 'romeo@montague', 'tybalt@capulet'])
+    iq.query('roster:query/roster:item/@jid').should.equal(['nurse@capulet', 'romeo@montague'])
+    iq.query('{urn:test}query/item/@jid').should.equal(['tybalt@capulet'])
+    iq.query('test:query/item/@jid', {'test': 'urn:test'}).should.equal(['tybalt@capulet'])
+    iq.get('roster:query').jids.should.equal(['nurse@capulet', 'romeo@montague'])
+
+
+def test_query_predicates_and_descendants():
+    ('Node.query() should filter by attributes and find descendants')
+
+    iq = Node.from_xml(ROSTER)
+
+    iq.query('roster:query/item[@subscription="both"]/@jid').should.equal(['nurse@capulet'])
+    iq.query("*/item[@subscription='to']/group/text()").should.equal(['Montague', 'Friends'])
+    iq.query('.//roster:group/text()').should.equal(['Capulet', 'Montague', 'Friends'])
+    iq.query('query//group').should.have.length_of(3)
+    iq.query('roster:query/item[@name]').should.equal([])
+
+
+def test_query_from_child_nodes():
+    ('the nodes of a subtree should know the namespace they inherited')
+
+    iq = Node.from_xml(ROSTER)
+
+    item = iq.get('roster:query/item')
+    item.should.be.a(RosterItem)
+    item.query('roster:group/text()').should.equal(['Capulet'])
+
+
+def test_iterquery():
+    ('Node.iterquery() should return a generator')
+
+    iq = Node.from_xml(ROSTER)
+
+    matches = iq.iterquery('.//item')
+    matches.should.be.a(types.GeneratorType)
+    next(matches).attr['jid'].should.equal('nurse@capulet')
+
+
+def test_query_syntax_errors():
+    ('compile_query() should refuse the paths it does not understand')
+
+    compile_query.when.called_with('/iq').should.throw(QuerySyntaxError)
+    compile_query.when.called_with('query/').should.throw(QuerySyntaxError)
+    compile_query.when.called_with('query///item').should.throw(QuerySyntaxError)
+    compile_query.when.called_with('item[1]').should.throw(QuerySyntaxError)
+
+
+@patch('xmpp.query.QUERY_CACHE_SIZE', 2)
+def test_compiled_queries_are_cached():
+    ('compile_query() should keep the most recently used paths')
+
+    first = compile_query('query/item')
+
+    compile_query('query/item').should.be(first)
+    compile_query('a')
+    compile_query('query/item')
+    compile_query('b')
+
+    compile_query('query/item').should.be(first)
+    compile_query('query/item', {'test': 'urn:test'}).should_not.be(first)
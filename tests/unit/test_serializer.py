@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from xmpp.core import ET
+from xmpp.core import element_to_string
+from xmpp.models import Node
+from xmpp.models import Stream
+from xmpp.serializer import element_to_bytes
+from xmpp.serializer import namespace_declarations
+
+
+STANZAS = [
+    '<message xmlns="jabber:client" to="juliet@capulet" type="chat">'
+    '<active xmlns="http://jabber.org/protocol/chatstates"/><body>soft &amp; &lt;3</body></message>',
+    '<presence xmlns="jabber:client"><show>away</show>'
+    '<c xmlns="http://jabber.org/protocol/caps" hash="sha-1" ver="QxGyOW6Y5AIdI6z40mPY+smQYSc="/></presence>',
+    '<iq xmlns="jabber:client" type="result"><query xmlns="jabber:iq:roster" ver="1">'
+    '<item jid="romeo@montague" name="R&quot;omeo&#10;"><group>Friends</group></item></query></iq>',
+    '<iq xmlns="jabber:client" type="get"><unknown xmlns="urn:unknown" a="1"><child>text</child>tail</unknown></iq>',
+    u'<message xmlns="jabber:client" xml:lang="en"><body>caf\xe9</body></message>',
+]
+
+
+def test_element_to_bytes_matches_element_to_string():
+    ('element_to_bytes() should write the same bytes as element_to_string()')
+
+    for xml in STANZAS:
+        element = ET.fromstring(xml)
+        element_to_bytes(element).should.equal(element_to_string(element))
+
+
+def test_element_to_bytes_leaves_the_element_untouched():
+    ('element_to_bytes() should not fix up the given element')
+
+    element = ET.fromstring(STANZAS[0])
+
+    element_to_bytes(element).should.equal(
+        b'<message to="juliet@capulet" type="chat">'
+        b'<active xmlns="http://jabber.org/protocol/chatstates" /><body>soft &amp; &lt;3</body></message>')
+
+    element.tag.should.equal('{jabber:client}message')
+
+
+def test_element_to_bytes_namespaced_attributes():
+    ('element_to_bytes() should fall back to ElementTree for attributes in other namespaces')
+
+    element = ET.fromstring('<message xmlns="jabber:client" xmlns:foo="urn:foo" foo:bar="1"/>')
+
+    element_to_bytes(element).should.equal(b'<message xmlns:ns0="urn:foo" ns0:bar="1" />')
+
+
+def test_namespace_declarations():
+    ('namespace_declarations() should return the xmlns attributes of a model')
+
+    namespace_declarations(Stream).should.equal((
+        ('xmlns', 'jabber:client'),
+        ('xmlns:stream', 'http://etherx.jabber.org/streams'),
+    ))
+
+
+def test_node_to_bytes():
+    ('Node.to_bytes() should return the bytes that Node.to_xml() decodes')
+
+    node = Node.from_xml(STANZAS[4])
+
+    node.to_bytes().should.equal(b'<message xml:lang="en"><body>caf\xc3\xa9</body></message>')
+    node.to_xml().should.equal(u'<message xml:lang="en"><body>caf\xe9</body></message>')
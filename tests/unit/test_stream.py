@@ -27,6 +27,9 @@ from xmpp.models.core import Stream
 from xmpp.models.core import ResourceBind
 from xmpp.models.core import MissingJID
 from xmpp.models.core import ServiceUnavailable
+from xmpp.models.core import StreamError
+from xmpp.parser import ParserLimits
+from xmpp.parser import available_parser_backends
 from .util import EventHandlerMock, event_test, FakeConnection
 
 
@@ -117,7 +120,7 @@ def test_send_presence():
 
     # Then it should have sent the correct XML
     connection.output.should.equal([
-        '<presence from="juliet@capulet" to="romeo@monteque"><priority>10</priority></presence>'
+        b'<presence from="juliet@capulet" to="romeo@monteque"><priority>10</priority></presence>'
     ])
 
 
@@ -141,7 +144,7 @@ def test_send_presence_jid():
 
     # Then it should have sent the correct XML
     connection.output.should.equal([
-        '<presence from="romeu@monteque" to="juliet@capulet"><priority>10</priority></presence>',
+        b'<presence from="romeu@monteque" to="juliet@capulet"><priority>10</priority></presence>',
     ])
 
 
@@ -185,7 +188,7 @@ def test_send_presence_delay():
 
     # Then it should have sent the correct XML
     connection.output.should.equal([
-        '<presence from="romeu@monteque" to="juliet@capulet"><delay from="romeu@monteque" stamp="foobar" xmlns="urn:xmpp:delay" /><priority>10</priority></presence>'
+        b'<presence from="romeu@monteque" to="juliet@capulet"><delay from="romeu@monteque" stamp="foobar" xmlns="urn:xmpp:delay" /><priority>10</priority></presence>'
     ])
 
 
@@ -209,10 +212,98 @@ def test_send_message():
 
     # Then it should have sent the correct XML
     connection.output.should.equal([
-        '<message from="romeu@monteque" to="juliet@capulet" type="chat"><body>Hello</body></message>'
+        b'<message from="romeu@monteque" to="juliet@capulet" type="chat"><body>Hello</body></message>'
     ])
 
 
+def test_send_many():
+    ('XMLStream.send_many() should send every node in a single write')
+
+    # Given a connection
+    connection = FakeConnection()
+
+    # And a XMLStream
+    stream = XMLStream(connection)
+
+    # When I send a few nodes at once
+    presence = Presence.create(to='romeo@monteque')
+    stream.send_many([presence, presence.clone(to='mercutio@monteque'), IQ.create(type='get')])
+
+    # Then they were sent as a single buffer
+    connection.output.should.equal([
+        b'<presence to="romeo@monteque" /><presence to="mercutio@monteque" /><iq type="get" />'
+    ])
+
+
+def test_send_many_nothing():
+    ('XMLStream.send_many() should not write anything without nodes')
+
+    connection = FakeConnection()
+    stream = XMLStream(connection)
+
+    stream.send_many([])
+
+    connection.output.should.equal([])
+
+
+def test_batch():
+    ('XMLStream.batch() should join nested blocks and send at the end of the outermost one')
+
+    # Given a connection
+    connection = FakeConnection()
+
+    # And a XMLStream
+    stream = XMLStream(connection)
+
+    # When I send nodes inside nested batches
+    with stream.batch():
+        stream.send(IQ.create(type='get'))
+        with stream.batch():
+            stream.send(IQ.create(type='set'))
+
+        # Then nothing was sent before the outermost block ends
+        connection.output.should.equal([])
+
+    # And everything was sent at once afterwards
+    connection.output.should.equal([b'<iq type="get" /><iq type="set" />'])
+
+
+def test_close_flushes_the_batch():
+    ('XMLStream.close() should send the current batch before closing the stream')
+
+    # Given a connection
+    connection = Mock(name='connection')
+
+    # And a XMLStream
+    stream = XMLStream(connection)
+
+    # When I close it in a batch
+    with stream.batch():
+        stream.send(IQ.create(type='get'))
+        stream.close()
+
+    # Then the batch was sent with the closing tag
+    connection.send.assert_called_once_with(b'<iq type="get" /></stream:stream>')
+    connection.disconnect.assert_called_once_with()
+
+
+def test_feed_after_close():
+    ('XMLStream.feed() should parse a new stream after XMLStream.close()')
+
+    # Given a XMLStream that was closed
+    stream = XMLStream(FakeConnection())
+    stream.feed(OPEN_STREAM)
+    stream.close(disconnect=False)
+
+    # When it is fed a new stream
+    stream.feed(OPEN_STREAM)
+    nodes = stream.feed('<presence from="juliet@capulet"/>')
+
+    # Then the stanzas are parsed
+    [n.tag for n in nodes].should.equal(['presence'])
+    stream.state.should.equal('OPEN')
+
+
 def test_handle_message():
     ('XMLStream.handle_message() should forward the `on.message` event')
 
@@ -487,3 +578,313 @@ def test_parse_noxml(logger):
     result = stream.parse()
 
     result.should.be.none
+
+
+@event_test
+def test_ready_to_read_drains_connection(context):
+    ('XMLStream.ready_to_read() should dispatch every stanza buffered by the connection')
+
+    # Given a connection with two buffered chunks
+    connection = FakeConnection()
+    connection.receive_all = Mock(name='receive_all', return_value=[
+        '<presence from="romeo@monteque"/><presence from="juliet@capulet"/><mess',
+        'age to="romeo@monteque"><body>hi</body></message>',
+    ])
+
+    # And a XMLStream with node handlers
+    stream = XMLStream(connection)
+    node_handler = EventHandlerMock('on_node')
+    nodes_handler = EventHandlerMock('on_nodes')
+    stream.on.node(node_handler)
+    stream.on.nodes(nodes_handler)
+
+    # When the connection is ready to read
+    stream.ready_to_read(None, connection)
+
+    # Then every stanza was dispatched individually, along with the
+    # <body> of the message
+    node_handler.call_count.should.equal(4)
+
+    # And once as a batch, in order
+    nodes_handler.call_count.should.equal(1)
+    batch = nodes_handler.call_args[0][-1]
+    [n.tag for n in batch].should.equal(['presence', 'presence', 'message'])
+    batch[1].attr['from'].should.equal('juliet@capulet')
+
+
+OPEN_STREAM = (
+    '<stream:stream xmlns="jabber:client" xmlns:stream="http://etherx.jabber.org/streams" id="s1">'
+    '<stream:features><starttls xmlns="urn:ietf:params:xml:ns:xmpp-tls"/></stream:features>'
+)
+
+
+def test_stanzas_are_released_after_dispatch():
+    ('XMLStream should not keep dispatched stanzas by default')
+
+    # Given a XMLStream
+    stream = XMLStream(FakeConnection())
+
+    # When it receives many stanzas
+    stream.feed(OPEN_STREAM)
+    for index in range(50):
+        stream.feed('<presence from="romeo{0}@monteque"/>'.format(index))
+
+    # Then it kept no history
+    list(stream.nodes).should.equal([])
+
+    # And the stream node only kept its features
+    [c.tag for c in stream.stream_node.get_children()].should.equal(['stream:features'])
+    stream.stream_node.supports_tls().should.be.true
+
+
+def test_stanza_history_is_bounded():
+    ('XMLStream(history_size=3) keeps only the last 3 dispatched stanzas')
+
+    # Given a XMLStream with a bounded history
+    stream = XMLStream(FakeConnection(), history_size=3)
+
+    # When it receives many stanzas
+    stream.feed(OPEN_STREAM)
+    for index in range(50):
+        stream.feed('<presence from="romeo{0}@monteque"/>'.format(index))
+
+    # Then only the last 3 are kept
+    [n.attr['from'] for n in stream.nodes].should.equal([
+        'romeo47@monteque',
+        'romeo48@monteque',
+        'romeo49@monteque',
+    ])
+
+
+def test_dispatched_children_are_the_wrappers_of_their_stanza():
+    ('XMLStream dispatches the same child nodes that their stanza hands out')
+
+    # Given a XMLStream that keeps the dispatched nodes
+    stream = XMLStream(FakeConnection())
+    nodes = []
+    stream.on.node(lambda event, node: nodes.append(node))
+
+    # When it receives a presence with a priority
+    stream.feed(OPEN_STREAM)
+    stream.feed('<presence from="romeo@monteque"><priority>10</priority></presence>')
+    priority, presence = nodes[-2:]
+
+    # Then the presence hands out the dispatched priority
+    presence.get('priority').should.be(priority)
+    presence.get_children().should.equal([priority])
+    presence.get_children()[0].should.be(priority)
+
+
+def test_dispatched_children_forget_their_cached_xml():
+    ('the dispatched child nodes should not keep stale xml when changed through their stanza')
+
+    # Given a presence with a priority dispatched by a XMLStream
+    stream = XMLStream(FakeConnection())
+    nodes = []
+    stream.on.node(lambda event, node: nodes.append(node))
+    stream.feed(OPEN_STREAM)
+    stream.feed('<presence from="romeo@monteque"><priority>10</priority></presence>')
+    priority, presence = nodes[-2:]
+
+    # And both were serialized already
+    priority.to_xml().should.equal('<priority>10</priority>')
+    presence.to_bytes().should.equal(b'<presence from="romeo@monteque"><priority>10</priority></presence>')
+
+    # When the priority is changed through the presence
+    presence.get('priority').value = '5'
+
+    # Then the dispatched nodes serialize the new value
+    priority.to_xml().should.equal('<priority>5</priority>')
+    priority.to_bytes().should.equal(b'<priority>5</priority>')
+    presence.to_xml().should.equal('<presence from="romeo@monteque"><priority>5</priority></presence>')
+
+
+@patch('xmpp.stream.logger')
+def test_lazy_nodes(logger):
+    ('XMLStream(lazy_nodes=True) dispatches nodes that are only materialized when touched')
+
+    # Given a XMLStream with lazy nodes
+    stream = XMLStream(FakeConnection(), lazy_nodes=True, history_size=2)
+
+    # When it receives stanzas
+    stream.feed(OPEN_STREAM)
+    stream.feed('<presence from="romeo@monteque"/><presence from="juliet@capulet"/>')
+
+    # Then they were not materialized while routing
+    first, second = stream.nodes
+    first.is_materialized.should.be.false
+
+    # And they look the same as eager nodes once touched
+    first.attr['from'].should.equal('romeo@monteque')
+    second.to_xml().should.equal('<presence from="juliet@capulet" />')
+
+
+def feed_with_limits(chunks, parser_backend=None, **limits):
+    stream = XMLStream(FakeConnection(), parser_backend=parser_backend, limits=ParserLimits(**limits))
+    error_handler = EventHandlerMock('on_error')
+    node_handler = EventHandlerMock('on_node')
+    stream.on.error(error_handler)
+    stream.on.node(node_handler)
+
+    stream.feed(OPEN_STREAM)
+    for chunk in chunks:
+        stream.feed(chunk)
+
+    errors = [c[0][-1] for c in error_handler.call_args_list]
+    nodes = [c[0][-1] for c in node_handler.call_args_list]
+    return stream, errors, nodes
+
+
+def assert_stream_failed(stream, errors, condition, text):
+    errors.should.have.length_of(1)
+    error = errors[0]
+    error.should.be.a(StreamError)
+    error.to_xml().should.contain('<{0} xmlns="urn:ietf:params:xml:ns:xmpp-streams" />'.format(condition))
+    error.to_xml().should.contain(text)
+
+    # the error is sent to the peer and the stream is closed
+    stream.state.should.equal('CLOSED')
+    stream._connection.output.should.equal([error.to_bytes() + b'</stream:stream>'])
+
+
+def assert_policy_violation(stream, errors, text):
+    assert_stream_failed(stream, errors, 'policy-violation', text)
+
+
+def test_limits_max_depth():
+    ('XMLStream enforces ParserLimits.max_depth while parsing')
+
+    stream, errors, nodes = feed_with_limits([
+        '<message><a><b><c><d>deep</d></c></b></a></message>',
+        '<presence from="romeo@monteque"/>',
+    ], max_depth=4)
+
+    assert_policy_violation(stream, errors, 'stanza is nested deeper than 4 elements')
+    [n.tag for n in nodes].should.equal(['starttls', 'stream:features'])
+
+
+def test_limits_max_attributes():
+    ('XMLStream enforces ParserLimits.max_attributes while parsing')
+
+    stream, errors, nodes = feed_with_limits([
+        '<presence a="1" b="2" c="3"/>',
+    ], max_attributes=2)
+
+    assert_policy_violation(stream, errors, 'element has more than 2 attributes')
+
+
+def test_limits_max_text_length():
+    ('XMLStream enforces ParserLimits.max_text_length while parsing')
+
+    stream, errors, nodes = feed_with_limits([
+        '<message><body>', 'x' * 60, 'x' * 60, '</body></message>',
+    ], max_text_length=100)
+
+    assert_policy_violation(stream, errors, 'stanza text exceeds 100 characters')
+
+
+def test_limits_max_stanza_size_across_chunks():
+    ('XMLStream enforces ParserLimits.max_stanza_size before the stanza is complete')
+
+    stream, errors, nodes = feed_with_limits(
+        ['<message to="juliet@capulet">'] + ['<x/>' * 10] * 10,
+        max_stanza_size=200,
+    )
+
+    assert_policy_violation(stream, errors, 'stanza exceeds 200 bytes')
+
+    # the rest of the message is discarded instead of being parsed
+    # as standalone stanzas
+    [n.tag for n in nodes].should.equal(['starttls', 'stream:features'])
+
+
+def test_limits_max_stanza_size_counts_each_stanza():
+    ('XMLStream charges ParserLimits.max_stanza_size only with the bytes of each stanza, not with the whole chunk')
+
+    presences = '<presence from="romeo@monteque"/>' * 750
+    for backend in available_parser_backends():
+        stream, errors, nodes = feed_with_limits([
+            '<message to="juliet@capulet"><body>',
+            'wherefore art thou</body></message>' + presences,
+        ], parser_backend=backend, max_stanza_size=16384)
+
+        errors.should.equal([])
+        [n.tag for n in nodes].count('presence').should.equal(750)
+        [n.tag for n in nodes].count('message').should.equal(1)
+
+
+def test_limits_max_stanza_size_unterminated_start_tag():
+    ('XMLStream enforces ParserLimits.max_stanza_size on a start tag that never ends')
+
+    for backend in available_parser_backends():
+        stream, errors, nodes = feed_with_limits(
+            ["<message to='"] + ['x' * 1024] * 1024,
+            parser_backend=backend, max_stanza_size=1000,
+        )
+        assert_policy_violation(stream, errors, 'stanza exceeds 1000 bytes')
+
+        # the parser and what it buffered are released right away
+        stream.parser.should.be.none
+        stream.target.should.be.none
+
+        stream, errors, nodes = feed_with_limits(
+            ["<message to='" + 'x' * 1024 * 1024],
+            parser_backend=backend, max_stanza_size=1000,
+        )
+        assert_policy_violation(stream, errors, 'stanza exceeds 1000 bytes')
+
+
+def test_limits_discard_the_input_until_reset():
+    ('XMLStream discards the input after a limit violation until reset()')
+
+    iq_set = EventHandlerMock('on_iq_set')
+    stream, errors, nodes = feed_with_limits([
+        '<message><body>' + 'x' * 120,
+        '</body></message>',
+        '<iq type="set" id="1"><query xmlns="jabber:iq:roster"/></iq>',
+    ], max_text_length=100)
+
+    assert_policy_violation(stream, errors, 'stanza text exceeds 100 characters')
+    stream.on.iq_set(iq_set)
+    stream.feed('<iq type="set" id="2"><query xmlns="jabber:iq:roster"/></iq>').should.be.empty
+
+    [n.tag for n in nodes].should.equal(['starttls', 'stream:features'])
+    iq_set.called.should.be.false
+
+    # a reset stream parses again
+    stream.reset()
+    stream.feed(OPEN_STREAM)
+    [n.tag for n in stream.feed('<presence/>')].should.equal(['presence'])
+
+
+def test_malformed_xml_fails_the_stream():
+    ('XMLStream sends a bad-format stream error on malformed xml and discards the input until reset()')
+
+    stream = XMLStream(FakeConnection())
+    error_handler = EventHandlerMock('on_error')
+    unhandled_xml = EventHandlerMock('on_unhandled_xml')
+    node_handler = EventHandlerMock('on_node')
+    stream.on.error(error_handler)
+    stream.on.unhandled_xml(unhandled_xml)
+    stream.feed(OPEN_STREAM)
+    stream.on.node(node_handler)
+
+    stream.feed('<message><body>hello</wat>')
+    stream.feed('</body></message><presence/>').should.be.empty
+
+    errors = [c[0][-1] for c in error_handler.call_args_list]
+    assert_stream_failed(stream, errors, 'bad-format', '')
+    unhandled_xml.assert_called_once_with(ANY, '<message><body>hello</wat>')
+    node_handler.called.should.be.false
+
+
+@patch('xmpp.stream.time')
+def test_limits_max_stanza_rate(time):
+    ('XMLStream enforces ParserLimits.max_stanza_rate while parsing')
+
+    # every stanza arrives within the same second
+    time.time.return_value = 1000.5
+    stream, errors, nodes = feed_with_limits(['<presence/>' * 5], max_stanza_rate=3)
+
+    assert_policy_violation(stream, errors, 'stanza rate exceeds 3 per second')
+    [n.tag for n in nodes].should.equal(['starttls', 'stream:features', 'presence', 'presence'])
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from xmpp.core import ET
+from xmpp.models import IQ
+from xmpp.models import Node
+from xmpp.stream import XMLStream
+from xmpp.templates import StanzaTemplate
+from xmpp.templates import message_template
+from xmpp.templates import presence_template
+from xmpp.templates import slot
+
+from tests.unit.util import FakeConnection
+
+
+def test_render_escapes_values():
+    ('StanzaTemplate.render() should escape the values of attributes and texts')
+
+    # Given a message template
+    template = message_template(id=slot('id'))
+
+    # When I render it with values that need escaping
+    data = template.render({'to': 'juliet@capulet/"balcony"', 'id': 'm&1', 'body': '<3 & kisses'})
+
+    # Then it renders bytes
+    data.should.be.a(bytes)
+
+    # And the XML can be parsed back
+    message = Node.from_element(ET.fromstring(data))
+    message.to.should.equal('juliet@capulet/"balcony"')
+    message.id.should.equal('m&1')
+    message.get_body().should.equal('<3 & kisses')
+
+
+def test_render_is_the_same_as_the_node():
+    ('a rendered template should serialize the same as the node it came from')
+
+    # Given a node with a few slots
+    skeleton = IQ.create(type='get', to=slot('to'), id=slot('id'))
+
+    # When I render a template of it
+    data = StanzaTemplate(skeleton).render(to='capulet', id='ping1')
+
+    # Then it matches the serialized node with the same values
+    iq = IQ.create(type='get', to='capulet', id='ping1')
+    data.decode('utf-8').should.equal(iq.to_xml())
+
+
+def test_render_defaults_and_missing_values():
+    ('StanzaTemplate should use its defaults and refuse missing values')
+
+    template = StanzaTemplate(IQ.create(type=slot('type'), id=slot('id')), type='get')
+
+    template.render(id='1').should.contain(b'type="get"')
+    template.render(id='1', type='set').should.contain(b'type="set"')
+    template.render.when.called_with(type='get').should.throw(
+        TypeError, 'missing the value of the template slot "id"')
+
+
+def test_presence_template():
+    ('presence_template() should have the shape of XMLStream.send_presence')
+
+    template = presence_template(delay=True, priority=5)
+
+    template.names.should.equal(frozenset(['from', 'to', 'stamp']))
+    presence = Node.from_element(ET.fromstring(template.render({
+        'from': 'romeo@monteque',
+        'to': 'juliet@capulet',
+        'stamp': '2017-01-01T00:00:00Z',
+    })))
+
+    presence.from_.should.equal('romeo@monteque')
+    presence.delay.should.equal('2017-01-01T00:00:00Z')
+    presence.priority.should.equal('5')
+
+
+def test_send_template():
+    ('XMLStream.send_template() should send the rendered bytes')
+
+    # Given a connection
+    connection = FakeConnection()
+
+    # And a XMLStream
+    stream = XMLStream(connection)
+
+    # When I send a template
+    stream.send_template(presence_template(), **{'from': 'juliet@capulet', 'to': 'romeo@monteque'})
+
+    # Then the bytes were sent
+    connection.output.should.have.length_of(1)
+    connection.output[0].should.be.a(bytes)
+    connection.output[0].should.contain(b'to="romeo@monteque"')
+    connection.output[0].should.contain(b'<priority>10</priority>')
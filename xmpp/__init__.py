@@ -37,6 +37,7 @@ from xmpp.models import (
 
 from xmpp.core import generate_id
 from xmpp.networking import XMPPConnection
+from xmpp.networking import XMPPReactor
 
 
 __all__ = [
@@ -55,5 +56,6 @@ __all__ = [
     'Message',
     'Presence',
     'XMPPConnection',
+    'XMPPReactor',
     'generate_id',
 ]
@@ -19,5 +19,6 @@
 
 from collections import OrderedDict
 
-_NODE_MAPPING = OrderedDict()
+# ``(name, namespace)`` -> Node subclass, see :py:class:`~xmpp.models.node.MetaNode`
+_NODE_MAPPING = {}
 _EXTENSION_MAPPING = OrderedDict()
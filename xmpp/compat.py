@@ -14,6 +14,30 @@ try:
 except ImportError:
     import Queue
 
+try:
+    from types import MappingProxyType
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+
+    class MappingProxyType(Mapping):
+        """read-only view of a dictionary, python 2 does not have one"""
+        __slots__ = ('_mapping',)
+
+        def __init__(self, mapping):
+            self._mapping = mapping
+
+        def __getitem__(self, key):
+            return self._mapping[key]
+
+        def __iter__(self):
+            return iter(self._mapping)
+
+        def __len__(self):
+            return len(self._mapping)
+
+        def __repr__(self):
+            return 'mappingproxy({0!r})'.format(self._mapping)
+
 
 def encode_b64(s):
     return cast_string(codecs.encode(cast_bytes(s), 'base64'))
@@ -47,6 +71,7 @@ __all__ = (
     'bytes',
     'unicode',
     'Queue',
+    'MappingProxyType',
     'string_types',
     'binary_type',
     'text_type',
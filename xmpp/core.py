@@ -19,10 +19,11 @@
 
 
 
-import re
 import uuid
+import hashlib
 import xml.etree.ElementTree as ET
 from collections import OrderedDict
+from six.moves import intern
 
 from xmpp.compat import text_type
 from xmpp.compat import cast_string
@@ -31,14 +32,46 @@ from xmpp.compat import cast_bytes
 from xmpp._registry import _NODE_MAPPING
 
 
+# the distinct ``{namespace}name`` strings of a session are few, they
+# are split once and then looked up. The table is bounded because
+# the names come from the peer.
+SPLIT_NAMES_LIMIT = 4096
+_SPLIT_NAMES = {}
+
+
 def split_tag_and_namespace(attribute):
-    found = re.search(r'^\s*([{](.*)[}])?\s*(\w+)\s*', attribute.strip()).groups()
-    _, ns, name = found
+    """splits a name in ``{namespace}name`` notation
 
-    if not ns:
+    :param attribute: the tag or attribute name
+    :returns: a ``(name, namespace)`` tuple, the namespace is an empty string for names without one
+    """
+    if '{' not in attribute:
         return attribute, ''
 
-    return name.strip(), ns.strip()
+    try:
+        return _SPLIT_NAMES[attribute]
+    except KeyError:
+        pass
+
+    found = attribute.strip()
+    ns, closed, name = found[1:].partition('}')
+    if not found.startswith('{') or not closed or not ns.strip():
+        return attribute, ''
+
+    result = intern_name(name.strip()), intern_name(ns.strip())
+    if len(_SPLIT_NAMES) >= SPLIT_NAMES_LIMIT:
+        _SPLIT_NAMES.clear()
+
+    _SPLIT_NAMES[attribute] = result
+    return result
+
+
+def intern_name(name):
+    try:
+        return intern(name)
+    except TypeError:
+        # python 2 can only intern byte strings
+        return name
 
 
 def fixup_unknown_element(element, uri_map=None):
@@ -56,7 +89,7 @@ def fixup_unknown_element(element, uri_map=None):
 
     element.set('xmlns', xmlns)
 
-    for child in element.getchildren():
+    for child in list(element):
         fixup_element(child, uri_map)
 
     return element
@@ -64,17 +97,22 @@ def fixup_unknown_element(element, uri_map=None):
 
 def fixup_element(original_elem, uri_map=None):
     if '{' not in original_elem.tag:
+        # elements without a namespace can still have children with one
+        for child in original_elem:
+            fixup_element(child, uri_map)
+
         return original_elem
 
     elem = original_elem
     uri_map = uri_map or {}
 
     # build uri map and add to root element
-    node = _NODE_MAPPING.get(elem.tag)
+    tag, ns = split_tag_and_namespace(elem.tag)
+    node = _NODE_MAPPING.get((tag, ns))
     if not node:
         return fixup_unknown_element(original_elem)
 
-    elem.tag = node.__tag__
+    elem.tag = node.__tag__ or tag
     for prefix, uri in OrderedDict(node.__namespaces__).items():
         uri_map[uri] = prefix
         if prefix:
@@ -82,14 +120,36 @@ def fixup_element(original_elem, uri_map=None):
         else:
             elem.set("xmlns", text_type(uri))
 
-    for elem in elem.getiterator():
-        fixup_element(elem, uri_map)
+    for child in elem:
+        fixup_element(child, uri_map)
 
     return original_elem
 
 
+def shallow_copy_element(element):
+    """:returns: a copy of the element that shares its children with the original"""
+    copied = ET.Element(element.tag, dict(element.attrib))
+    copied.text = element.text
+    copied.tail = element.tail
+    copied.extend(list(element))
+    return copied
+
+
 def copy_element(element, encoding='utf-8'):
-    return element
+    """:returns: a copy of the element and of every element of its subtree"""
+    copied = ET.Element(element.tag, dict(element.attrib))
+    copied.text = element.text
+    copied.tail = element.tail
+    copied.extend([copy_element(child) for child in element])
+    return copied
+
+
+def has_unfixed_namespaces(element):
+    for elem in element.iter():
+        if '{' in elem.tag:
+            return True
+
+    return False
 
 
 def raw_element_to_string(element, encoding='utf-8'):
@@ -97,13 +157,73 @@ def raw_element_to_string(element, encoding='utf-8'):
 
 
 def element_to_string(element, encoding='utf-8'):
-    fixup_element(element)
+    """serializes an element with its namespaces fixed up, the given
+    element is left untouched"""
+    if has_unfixed_namespaces(element):
+        element = fixup_element(copy_element(element))
+
     return raw_element_to_string(element, encoding)
 
 
+def element_to_record(element):
+    """serializes an element and its children into nested tuples of
+    ``(tag, attrib, text, tail, children)``, cheap to pickle and to turn
+    back into elements without parsing XML again."""
+    return (
+        element.tag,
+        element.attrib or None,
+        element.text,
+        element.tail,
+        tuple([element_to_record(child) for child in element]),
+    )
+
+
+def record_to_element(record):
+    """the inverse of :py:func:`~xmpp.core.element_to_record`"""
+    tag, attrib, text, tail, children = record
+    element = ET.Element(tag, attrib or {})
+    element.text = text
+    element.tail = tail
+    for child in children:
+        element.append(record_to_element(child))
+
+    return element
+
+
+def element_structure(element, namespace=''):
+    """:returns: nested tuples of ``(name, namespace, attributes, text,
+    children)`` that are the same before and after the namespaces of the
+    element are fixed up, the attributes are sorted and the ``xmlns``
+    declarations left out. Every child is a ``(structure, tail)`` pair,
+    the tail of the element itself is part of its parent.
+
+    :param element: the :py:class:`xml.etree.ElementTree.Element`
+    :param namespace: the namespace of the element when it has no ``xmlns`` attribute
+    """
+    name, ns = split_tag_and_namespace(element.tag)
+    namespace = ns or element.get('xmlns') or namespace
+    attributes = []
+    for attr, value in element.attrib.items():
+        if attr != 'xmlns' and not attr.startswith('xmlns:'):
+            attributes.append((split_tag_and_namespace(attr)[0], value))
+
+    return (
+        name,
+        namespace,
+        tuple(sorted(attributes)),
+        element.text or '',
+        tuple([(element_structure(child, namespace), child.tail or '') for child in element]),
+    )
+
+
+def element_fingerprint(element, namespace=''):
+    """:returns: the sha1 hex digest of the :py:func:`~xmpp.core.element_structure` of an element"""
+    structure = element_structure(element, namespace)
+    return hashlib.sha1(cast_bytes(repr(structure))).hexdigest()
+
+
 def node_to_string(node, encoding='utf-8'):
-    element = copy_element(node._element)
-    output = element_to_string(element, encoding)
+    output = element_to_string(node._element, encoding)
     return cast_string(output, encoding)
 
 
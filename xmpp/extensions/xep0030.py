@@ -25,20 +25,32 @@ from xmpp.extensions import Extension
 class QueryInfo(Node):
     __tag__ = 'query'
     __etag__ = '{http://jabber.org/protocol/disco#info}query'
+    __prefixes__ = {'disco-info': 'http://jabber.org/protocol/disco#info'}
     __namespaces__ = [
         ('', 'http://jabber.org/protocol/disco#info')
     ]
     __children_of__ = IQ
 
+    @property
+    def features(self):
+        """the ``var`` of every ``<feature />``"""
+        return self.query('disco-info:feature/@var')
+
 
 class QueryItems(Node):
     __tag__ = 'query'
     __etag__ = '{http://jabber.org/protocol/disco#items}query'
+    __prefixes__ = {'disco-items': 'http://jabber.org/protocol/disco#items'}
     __namespaces__ = [
         ('', 'http://jabber.org/protocol/disco#items')
     ]
     __children_of__ = IQ
 
+    @property
+    def jids(self):
+        """the ``jid`` of every ``<item />``"""
+        return self.query('disco-items:item/@jid')
+
 
 def colonize_kv(kv):
     k, v = kv
@@ -76,9 +88,9 @@ class Identity(Node):
 
     def to_string(self):
         return ':'.join(filter(bool, [
-            self.attr.get('category'),
-            self.attr.get('type'),
-            self.attr.get('name'),
+            self.get_attribute('category'),
+            self.type,
+            self.get_attribute('name'),
         ]))
 
     def __repr__(self):
@@ -96,7 +108,7 @@ class Feature(Node):
     def __repr__(self):
         return ":".join([
             "feature",
-            self.attr.get('var', self.value),
+            self.get_attribute('var', self.value),
         ])
 
 
@@ -43,10 +43,13 @@ class SecretHandshake(Node):
     __children_of__ = ComponentStream
 
 
-class SuccessHandshake(Node):
-    """``<handshake />``"""
-    __etag__ = 'handshake'
-    __children_of__ = ComponentStream
+class SuccessHandshake(SecretHandshake):
+    """``<handshake />``
+
+    the server answers with an empty handshake in the same namespace,
+    so it takes over the name of the
+    :py:class:`~xmpp.extensions.xep0114.SecretHandshake`
+    """
 
 
 class Component(Extension):
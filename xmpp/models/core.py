@@ -17,7 +17,6 @@
 
 import re
 
-from xmpp.core import ET
 from xmpp.core import cast_string
 from xmpp.compat import string_types
 
@@ -89,6 +88,7 @@ class JID(object):
 class Stream(Node):
     __tag__ = 'stream:stream'
     __etag__ = '{http://etherx.jabber.org/streams}stream'
+    __slots__ = ('_features',)
 
     __namespaces__ = [
         ('', 'jabber:client'),
@@ -98,14 +98,14 @@ class Stream(Node):
     def initialize(self):
         self._features = {}
 
-    def to_xml(self):
-        xml = super(Stream, self).to_xml()
+    def serialize(self):
+        xml = super(Stream, self).serialize()
 
-        END = '</stream:stream>'
+        END = b'</stream:stream>'
         if END in xml:
-            xml = xml.replace(END, '')
+            xml = xml.replace(END, b'')
         else:
-            xml = re.sub(r'\s*[/][>]\s*$', '>', xml)
+            xml = re.sub(br'\s*[/][>]\s*$', b'>', xml)
 
         return xml
 
@@ -179,6 +179,7 @@ class SASLMechanismSet(Feature):
     """``<mechanisms xmlns="urn:ietf:params:xml:ns:xmpp-sasl"></mechanisms>``"""
     __tag__ = 'mechanisms'
     __etag__ = '{urn:ietf:params:xml:ns:xmpp-sasl}mechanisms'
+    __prefixes__ = {'sasl': 'urn:ietf:params:xml:ns:xmpp-sasl'}
     __children_of__ = StreamFeatures
 
     __namespaces__ = [
@@ -215,6 +216,7 @@ class StartTLS(Node):
     __tag__ = 'starttls'
     __single__ = True
     __etag__ = '{urn:ietf:params:xml:ns:xmpp-tls}starttls'
+    __prefixes__ = {'tls': 'urn:ietf:params:xml:ns:xmpp-tls'}
     __children_of__ = StreamFeatures
     __namespaces__ = [
         ('', 'urn:ietf:params:xml:ns:xmpp-tls'),
@@ -294,7 +296,7 @@ class Presence(Node):
     def delay(self):
         delay = self.get('delay')
         if delay:
-            return delay.attr.get('stamp')
+            return delay.get_attribute('stamp')
 
     @property
     def show(self):
@@ -330,6 +332,7 @@ class IQ(Node):
 class ResourceBind(Node):
     __tag__ = 'bind'
     __etag__ = '{urn:ietf:params:xml:ns:xmpp-bind}bind'
+    __prefixes__ = {'bind': 'urn:ietf:params:xml:ns:xmpp-bind'}
     __namespaces__ = [
         ('', 'urn:ietf:params:xml:ns:xmpp-bind'),
     ]
@@ -339,9 +342,7 @@ class ResourceBind(Node):
     def with_resource(resource):
         node = ResourceBind.create()
         if resource:
-            echild = ET.Element('resource', {})
-            echild.text = resource.strip()
-            node._element.append(echild)
+            node.append(BoundResource.create(resource.strip()))
 
         return node
 
@@ -353,6 +354,13 @@ class BoundJid(Node):
     __children_of__ = ResourceBind
 
 
+class BoundResource(Node):
+    __tag__ = 'resource'
+    __etag__ = '{urn:ietf:params:xml:ns:xmpp-bind}resource'
+    __namespaces__ = []
+    __children_of__ = ResourceBind
+
+
 class BindRequired(Node):
     __tag__ = 'required'
     __etag__ = '{urn:ietf:params:xml:ns:xmpp-bind}required'
@@ -372,6 +380,7 @@ class BindOptional(Node):
 class Session(Node):
     __tag__ = 'session'
     __etag__ = '{urn:ietf:params:xml:ns:xmpp-session}session'
+    __prefixes__ = {'session': 'urn:ietf:params:xml:ns:xmpp-session'}
     __namespaces__ = [
         ('', 'urn:ietf:params:xml:ns:xmpp-session'),
     ]
@@ -545,6 +554,7 @@ class SASLResponse(Node):
 class EntityCapability(Node):
     __tag__ = 'c'
     __etag__ = '{http://jabber.org/protocol/caps}c'
+    __prefixes__ = {'caps': 'http://jabber.org/protocol/caps'}
     __single__ = True
     __namespaces__ = [
         ('', 'http://jabber.org/protocol/caps'),
@@ -562,6 +572,7 @@ class VCardUpdate(Node):
 class ChatStateComposing(Node):
     __tag__ = 'composing'
     __etag__ = '{http://jabber.org/protocol/chatstates}composing'
+    __prefixes__ = {'chatstates': 'http://jabber.org/protocol/chatstates'}
     __single__ = True
     __namespaces__ = [
         ('', 'http://jabber.org/protocol/chatstates')
@@ -594,6 +605,7 @@ class MessageBody(Node):
 class PresenceDelay(Node):
     __tag__ = 'delay'
     __etag__ = '{urn:xmpp:delay}delay'
+    __prefixes__ = {'delay': 'urn:xmpp:delay'}
     __single__ = True
     __namespaces__ = [
         ('', 'urn:xmpp:delay')
@@ -631,6 +643,7 @@ class Error(Node):
 class Text(Node):
     __tag__ = 'text'
     __etag__ = '{urn:ietf:params:xml:ns:xmpp-stanzas}text'
+    __prefixes__ = {'stanzas': 'urn:ietf:params:xml:ns:xmpp-stanzas'}
     __namespaces__ = [
         ('', 'urn:ietf:params:xml:ns:xmpp-stanzas')
     ]
@@ -638,7 +651,8 @@ class Text(Node):
 
 class StreamError(Error):
     __tag__ = 'stream:error'
-    __etag__ = 'error'
+    __etag__ = '{http://etherx.jabber.org/streams}error'
+    __prefixes__ = {'streams': 'urn:ietf:params:xml:ns:xmpp-streams'}
     __children_of__ = Stream
 
 
@@ -715,6 +729,24 @@ class UnsupportedStanzaType(Error):
     __children_of__ = StreamError
 
 
+class PolicyViolation(Error):
+    __tag__ = 'policy-violation'
+    __etag__ = '{urn:ietf:params:xml:ns:xmpp-streams}policy-violation'
+    __namespaces__ = [
+        ('', 'urn:ietf:params:xml:ns:xmpp-streams')
+    ]
+    __children_of__ = StreamError
+
+
+class StreamErrorText(Node):
+    __tag__ = 'text'
+    __etag__ = '{urn:ietf:params:xml:ns:xmpp-streams}text'
+    __namespaces__ = [
+        ('', 'urn:ietf:params:xml:ns:xmpp-streams')
+    ]
+    __children_of__ = StreamError
+
+
 # stanza errors
 
 class ServiceUnavailable(Error):
@@ -736,6 +768,7 @@ class BadRequest(Error):
 class VCard(Node):
     __tag__ = 'vCard'
     __etag__ = '{vcard-temp}vCard'
+    __prefixes__ = {'vcard': 'vcard-temp'}
     __namespaces__ = [
         ('', 'vcard-temp')
     ]
@@ -755,11 +788,17 @@ class PresenceShow(Node):
 class RosterQuery(Node):
     __tag__ = 'query'
     __etag__ = '{jabber:iq:roster}query'
+    __prefixes__ = {'roster': 'jabber:iq:roster'}
     __namespaces__ = [
         ('', 'jabber:iq:roster')
     ]
     __children_of__ = IQ
 
+    @property
+    def jids(self):
+        """the ``jid`` of every contact"""
+        return self.query('roster:item/@jid')
+
 
 class RosterItem(Node):
     __etag__ = 'item'
@@ -768,7 +807,7 @@ class RosterItem(Node):
 
 class RosterGroup(Node):
     __tag__ = 'group'
-    __etag__ = 'query'
+    __etag__ = '{jabber:iq:roster}group'
     __namespaces__ = [
         ('', 'jabber:iq:roster')
     ]
@@ -15,20 +15,202 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import weakref
 from collections import OrderedDict
 from six import with_metaclass
 
+from xmpp.compat import MappingProxyType
 from xmpp.core import ET
 from xmpp.core import cast_string
-from xmpp.core import node_to_string
+from xmpp.core import element_fingerprint
 from xmpp.core import split_tag_and_namespace
 from xmpp.core import fixup_element
+from xmpp.core import shallow_copy_element
+from xmpp.query import NAMESPACE_PREFIXES
+from xmpp.query import compile_query
+from xmpp.query import register_prefix
+from xmpp.serializer import node_to_bytes
 from xmpp._registry import _NODE_MAPPING
 
 # ET.register_namespace("stream", "http://etherx.jabber.org/streams")
 
 
+# namespaces in which the stanzas of a stream can arrive, nodes with
+# an unqualified ``__etag__`` are registered under every one of them
+STREAM_NAMESPACES = ('jabber:client', 'jabber:server', 'jabber:component:accept')
+STREAMS_NAMESPACE = 'http://etherx.jabber.org/streams'
+
+# how many distinct names of elements without a model are counted
+MISSED_NAMES_LIMIT = 256
+
+# copy-on-write states of the element of a node, see Node.clone()
+OWNED = 0  # only referenced by this node
+SHARED = 1  # shared with a clone, copied before it is modified
+COPIED = 2  # copied already, its descendants might still be shared
+
+
+class NodeDefinitionError(Exception):
+    pass
+
+
+class NodeStatistics(object):
+    """counts how :py:meth:`~xmpp.models.node.Node.from_element`
+    resolved the elements it wrapped"""
+    __slots__ = ('hits', 'misses', 'missed')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.missed = {}
+
+    def miss(self, key):
+        self.misses += 1
+        if key in self.missed or len(self.missed) < MISSED_NAMES_LIMIT:
+            self.missed[key] = self.missed.get(key, 0) + 1
+
+    def to_dict(self):
+        missed = sorted(self.missed.items(), key=lambda item: -item[1])
+        return OrderedDict([
+            ('registered', len(_NODE_MAPPING)),
+            ('lookups', self.hits + self.misses),
+            ('hits', self.hits),
+            ('misses', self.misses),
+            ('missed', [('{{{1}}}{0}'.format(*key) if key[1] else key[0], count) for key, count in missed]),
+        ])
+
+
+_NODE_STATISTICS = NodeStatistics()
+
+
+def inherited_namespaces(NodeClass):
+    """:returns: the namespaces in which a node with an unqualified
+    ``__etag__`` can appear: the one of its closest qualified parent or
+    the ones of the stream for stanzas"""
+    parent = NodeClass.__children_of__
+    while parent is not None:
+        if parent.__etag__:
+            _, ns = split_tag_and_namespace(parent.__etag__)
+        else:
+            ns = dict(parent.__namespaces__).get('')
+
+        if ns == STREAMS_NAMESPACE:
+            break
+        elif ns:
+            return (ns,)
+
+        parent = parent.__children_of__
+
+    return STREAM_NAMESPACES
+
+
+def get_default_namespace(NodeClass):
+    """:returns: the namespace of the elements of a node class that have no ``xmlns`` attribute"""
+    xmlns = dict(NodeClass.__namespaces__).get('')
+    name, ns = split_tag_and_namespace(NodeClass.__etag__)
+    if xmlns or ns or not name:
+        return xmlns or ns
+
+    namespaces = inherited_namespaces(NodeClass)
+    return len(namespaces) == 1 and namespaces[0] or ''
+
+
+def register_prefixes(NodeClass, prefixes):
+    for prefix, namespace in prefixes.items():
+        other = NAMESPACE_PREFIXES.get(prefix, namespace)
+        if other != namespace:
+            msg = '{0}.__prefixes__: the prefix {1} already stands for "{2}"'
+            raise NodeDefinitionError(msg.format(NodeClass.__name__, prefix, other))
+
+        register_prefix(prefix, namespace)
+
+
+def get_node_keys(NodeClass):
+    """:returns: the ``(name, namespace)`` keys a node class is registered under"""
+    keys = []
+    name, ns = split_tag_and_namespace(NodeClass.__etag__)
+    if ns:
+        keys.append((name, ns))
+    elif name:
+        keys.append((name, ''))
+        keys.extend((name, ns) for ns in inherited_namespaces(NodeClass))
+
+    # elements whose namespaces were already fixed up
+    xmlns = dict(NodeClass.__namespaces__).get('', None)
+    if NodeClass.__tag__ and xmlns:
+        keys.append((NodeClass.__tag__, xmlns))
+
+    return keys
+
+
+def register_node(NodeClass):
+    keys = get_node_keys(NodeClass)
+    for key in keys:
+        other = _NODE_MAPPING.get(key, NodeClass)
+        # subclasses can take over the names of their bases and
+        # reloaded modules can define their nodes again
+        redefined = (other.__module__, other.__name__) == (NodeClass.__module__, NodeClass.__name__)
+        if not issubclass(NodeClass, other) and not redefined:
+            msg = 'node {0} in the namespace "{1}" is already defined by {2}.{3}'
+            raise NodeDefinitionError(msg.format(key[0], key[1], other.__module__, other.__name__))
+
+    for key in keys:
+        _NODE_MAPPING[key] = NodeClass
+
+
+def get_known_nodes():
+    """:returns: the ``((name, namespace), NodeClass)`` items of every registered node"""
+    return _NODE_MAPPING.items()
+
+
+def get_node_statistics():
+    """:returns: an ``OrderedDict`` with how many elements were wrapped
+    by a registered node class and how many, and which ones, fell back
+    to :py:class:`~xmpp.models.node.Node`"""
+    return _NODE_STATISTICS.to_dict()
+
+
+def reset_node_statistics():
+    _NODE_STATISTICS.reset()
+
+
+def mark_shared(node):
+    node._shared = SHARED
+    for wrapper in (node._wrappers or {}).values():
+        mark_shared(wrapper)
+
+
+def find_element_path(root, element):
+    """:returns: the list of elements from the root to the given element, or ``None``"""
+    if root is element:
+        return [root]
+
+    for child in root:
+        path = find_element_path(child, element)
+        if path:
+            return [root] + path
+
+
+def replace_child(parent, child, replacement):
+    for index, existing in enumerate(parent):
+        if existing is child:
+            parent[index] = replacement
+            return
+
+
 class MetaNode(type):
+    def __new__(metaclass, name, bases, members):
+        # nodes are created for every parsed element, the ones of this
+        # package don't get a __dict__ unless they ask for it, while
+        # the ones defined by applications keep theirs
+        module = members.get('__module__', '')
+        if module == 'xmpp' or module.startswith('xmpp.'):
+            members.setdefault('__slots__', ())
+
+        return super(MetaNode, metaclass).__new__(metaclass, name, bases, members)
+
     def __init__(NodeClass, name, bases, members):
         if name == 'Node':
             return super(MetaNode, NodeClass).__init__(name, bases, members)
@@ -39,19 +221,16 @@ class MetaNode(type):
         etag = (members.get("__etag__") or getattr(NodeClass, '__etag__', tag) or '').strip()
         children_of = members.get("__children_of__") or getattr(NodeClass, '__children_of__', None)
 
-        xmlns = dict(namespaces).get('', None)
-
-        if etag and etag != tag:
-            _NODE_MAPPING[etag] = NodeClass
-
-        if tag and xmlns:
-            _NODE_MAPPING[(tag, xmlns)] = NodeClass
-
         NodeClass.__children__ = []
         NodeClass.__tag__ = tag.strip()
         NodeClass.__etag__ = etag.strip()
         NodeClass.__namespaces__ = namespaces
 
+        NodeClass.__xmlns__ = get_default_namespace(NodeClass)
+
+        register_node(NodeClass)
+        register_prefixes(NodeClass, members.get('__prefixes__') or {})
+
         if children_of:
             siblings = getattr(children_of, '__children__', [])
             siblings.append(NodeClass)
@@ -71,34 +250,197 @@ class Node(with_metaclass(MetaNode, object)):
     __etag__ = None
     __namespaces__ = []
     __prefixes__ = None
+    __xmlns__ = ''
     __single__ = False
     __children_of__ = None
-
-    def __init__(self, element, closed=False):
+    __slots__ = (
+        '_element',
+        '_closed',
+        '_tag',
+        '_namespaces',
+        '_attributes',
+        '_attr_view',
+        '_namespaces_view',
+        '_wrappers',
+        '_parent',
+        '_fingerprint',
+        '_xml',
+        '_bytes',
+        '_shared',
+        '__weakref__',
+    )
+
+    def __init__(self, element, closed=False, lazy=False):
         # self._original = element.copy()
-        self._element = fixup_element(element)
+        self._element = element
         self._closed = closed or self.__single__
+        self._tag = None
+        self._namespaces = None
+        self._attributes = None
+        self._attr_view = None
+        self._namespaces_view = None
+        self._wrappers = None
+        self._parent = None
+        self._fingerprint = None
+        self._xml = None
+        self._bytes = None
+        self._shared = OWNED
         # if not element.tag:
         #     raise TypeError('invalid element {0}'.format(element))
 
-        self._tag, self._namespaces = self.extract_namespace(element.tag)
-
-        self._attributes = OrderedDict()
-        for attr in element.attrib:
-            clean, namespace = self.extract_namespace(attr)
-            self._namespaces.update(namespace)
-            self._attributes[clean] = element.attrib[attr]
+        if not lazy:
+            self.materialize()
 
         self.initialize()
 
+    def materialize(self):
+        """fixes up the namespaces of the element subtree and extracts
+        its tag, namespaces and attributes.
+
+        Nodes created with ``lazy=True`` only do it the first time
+        one of those is accessed.
+        """
+        if self._attributes is not None:
+            return
+
+        element = fixup_element(self._element)
+        tag, ns = split_tag_and_namespace(element.tag)
+
+        # attributes and namespaces are kept as tuples of pairs, the
+        # dictionaries are only built when asked for
+        namespaces = ns and [(tag, ns)] or []
+        attributes = []
+        for attr, value in element.attrib.items():
+            clean, ns = split_tag_and_namespace(attr)
+            if ns:
+                namespaces.append((clean, ns))
+
+            attributes.append((clean, value))
+
+        self._tag = tag
+        self._namespaces = tuple(namespaces)
+        self._attributes = tuple(attributes)
+
+    @property
+    def is_materialized(self):
+        return self._attributes is not None
+
     def initialize(self):
         pass
 
+    @property
+    def fingerprint(self):
+        """sha1 hex digest of the tags, namespaces, attributes and texts
+        of the subtree, computed once and the same before and after the
+        namespaces are fixed up"""
+        if self._fingerprint is None:
+            if self._attributes is None:
+                self.materialize()
+
+            self._fingerprint = element_fingerprint(self._element, self.__xmlns__)
+
+        return self._fingerprint
+
+    def clone(self, **attributes):
+        """creates a node that shares the element tree of this one
+        until either of them is modified, only the elements on the way
+        to the modified one are copied then.
+
+        ::
+
+          for jid in recipients:
+              stream.send(stanza.clone(to=jid))
+
+        :param attributes: attributes to set in the clone
+        """
+        if self._attributes is None:
+            self.materialize()
+
+        clone = self.__class__(self._element, closed=self._closed, lazy=True)
+        clone._tag = self._tag
+        clone._namespaces = self._namespaces
+        clone._attributes = self._attributes
+        clone._attr_view = self._attr_view
+        clone._namespaces_view = self._namespaces_view
+        clone._fingerprint = self._fingerprint
+        clone._xml = self._xml
+        clone._bytes = self._bytes
+        clone._shared = SHARED
+        mark_shared(self)
+
+        for attr, value in attributes.items():
+            clone.set_attribute(attr, value)
+
+        return clone
+
+    @property
+    def is_shared(self):
+        """``True`` while the element of this node is shared with a clone"""
+        return self._shared == SHARED
+
+    def will_change(self):
+        """must be called before the element of this node is
+        modified, copies it when it is shared with a clone"""
+        if self._shared != SHARED:
+            return
+
+        original = self._element
+        element = shallow_copy_element(original)
+        parent = self._parent and self._parent()
+        if parent is not None:
+            parent.will_change()
+            parent.replace_element(original, element)
+
+        self._element = element
+        self._shared = COPIED
+
+    def replace_element(self, original, element):
+        # swaps an element of the subtree, the shared elements on the
+        # way to it are copied
+        path = find_element_path(self._element, original)
+        if not path:
+            return
+
+        wrappers = self._wrappers or {}
+        parent = path[0]
+        for step in path[1:-1]:
+            copied = shallow_copy_element(step)
+            replace_child(parent, step, copied)
+            wrapper = wrappers.pop(step, None)
+            if wrapper is not None:
+                wrapper._element = copied
+                wrapper._shared = COPIED
+                wrappers[copied] = wrapper
+
+            parent = copied
+
+        replace_child(parent, original, element)
+        wrapper = wrappers.pop(original, None)
+        if wrapper is not None:
+            wrappers[element] = wrapper
+
+    def changed(self):
+        """must be called after the element of this node was modified,
+        forgets the fingerprint and the serialized xml of this node
+        and of the nodes it was wrapped by"""
+        node = self
+        while node is not None:
+            node._fingerprint = None
+            node._xml = None
+            node._bytes = None
+            node = node._parent and node._parent()
+
     def __eq__(self, other):
-        if not isinstance(other, self.__class__):
+        if type(self) is not type(other):
             return False
 
-        return self.to_dict() == other.to_dict()
+        return self.fingerprint == other.fingerprint
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.fingerprint)
 
     def close(self):
         self._closed = True
@@ -150,43 +492,138 @@ class Node(with_metaclass(MetaNode, object)):
         return node
 
     def set_attribute(self, attr, value):
+        if self._attributes is None:
+            self.materialize()
+
+        self.will_change()
         self._element.attrib[attr] = value
-        self._attributes[attr] = value
+        attributes = OrderedDict(self._attributes)
+        attributes[attr] = value
+        self._attributes = tuple(attributes.items())
+        self._attr_view = None
+        self.changed()
 
     @property
     def tag(self):
+        if self._attributes is None:
+            self.materialize()
+
         return self._tag
 
     @property
     def attr(self):
-        return self._attributes.copy()
+        """read-only view of the attributes, built once per node"""
+        if self._attr_view is None:
+            if self._attributes is None:
+                self.materialize()
+
+            self._attr_view = MappingProxyType(OrderedDict(self._attributes))
+
+        return self._attr_view
 
     @property
     def namespaces(self):
-        return self._namespaces.copy()
+        """read-only view of the namespaces, built once per node"""
+        if self._namespaces_view is None:
+            if self._attributes is None:
+                self.materialize()
 
-    def query(self, xpath):
-        items = []
-        for element in self._element.findall(xpath):
-            items.append(Node.from_element(element, allow_fixedup=True))
+            self._namespaces_view = MappingProxyType(OrderedDict(self._namespaces))
 
-        return items
+        return self._namespaces_view
 
-    def get(self, xpath):
-        element = self._element.find(xpath)
-        if element is None:
-            return
+    def get_attribute(self, attr, default=None):
+        """reads a single attribute without building the
+        :py:attr:`~xmpp.models.node.Node.attr` view
 
-        return Node.from_element(element, allow_fixedup=True)
+        :param attr: the attribute name
+        :param default: returned when the node does not have the attribute
+        """
+        if self._attributes is None:
+            self.materialize()
+
+        for name, value in self._attributes:
+            if name == attr:
+                return value
+
+        return default
+
+    @property
+    def id(self):
+        return self.get_attribute('id')
+
+    @property
+    def type(self):
+        return self.get_attribute('type')
+
+    @property
+    def from_(self):
+        return self.get_attribute('from')
+
+    @property
+    def to(self):
+        return self.get_attribute('to')
+
+    def iterquery(self, path, namespaces=None):
+        """yields the nodes, attribute values or texts matched by a
+        path, see :py:mod:`xmpp.query`
+
+        :param path: the path
+        :param namespaces: ``dict`` of prefixes to namespaces, in addition to the ones declared by the nodes
+        """
+        if self._attributes is None:
+            self.materialize()
+
+        query = compile_query(path, namespaces)
+        matches = query.iterate(self._element, self.__xmlns__)
+        if not query.selects_elements:
+            return matches
+
+        return (self.wrap(element) for element in matches)
+
+    def query(self, path, namespaces=None):
+        """:returns: a list with everything matched by :py:meth:`~xmpp.models.node.Node.iterquery`"""
+        return list(self.iterquery(path, namespaces))
+
+    def get(self, path, namespaces=None):
+        """:returns: the first match of :py:meth:`~xmpp.models.node.Node.iterquery` or ``None``"""
+        return next(self.iterquery(path, namespaces), None)
 
     def get_children(self):
-        return [Node.from_element(e, allow_fixedup=True) for e in self._element.getchildren()]
+        if self._attributes is None:
+            self.materialize()
+
+        return [self.wrap(e) for e in self._element]
+
+    def wrap(self, element):
+        """wraps an element of the subtree of this node, the same
+        element always gets the same node
+
+        :param element: the :py:class:`xml.etree.ElementTree.Element`
+        """
+        wrappers = self._wrappers
+        if wrappers is None:
+            wrappers = self._wrappers = {}
+
+        node = wrappers.get(element)
+        if node is None:
+            # the children of a node that was not materialized yet are
+            # not either, they are fixed up along with it
+            lazy = self._attributes is None
+            node = wrappers[element] = Node.from_element(element, allow_fixedup=True, lazy=lazy)
+            node._parent = weakref.ref(self)
+            if self._shared != OWNED:
+                node._shared = SHARED
+
+        return node
 
     def get_value(self):
         return self._element.text or b''
 
     def set_value(self, value):
+        self.will_change()
         self._element.text = value
+        self.changed()
 
     value = property(fset=set_value, fget=get_value)
 
@@ -197,22 +634,60 @@ class Node(with_metaclass(MetaNode, object)):
         return Node.from_element(node)
 
     def add_text(self, text):
+        self.will_change()
         parts = filter(bool, (self._element.text, text))
         self._element.text = "".join(parts)
+        self.changed()
 
     def append(self, node):
         if self.is_closed:
             msg = 'Refused to append a child to the closed node: {0}'
             raise TypeError(msg.format(self.to_xml()))
 
+        self.will_change()
+        previous = node._parent and node._parent()
+        if previous is not None:
+            # like in lxml, an element has a single parent: appending
+            # it somewhere else moves it, so that changed() reaches
+            # every node that serializes it
+            previous._detach(node)
+
         self._element.append(node._element)
+        node._parent = weakref.ref(self)
+        # wrap() hands out the appended node for its element, so there
+        # is a single node with caches to forget
+        wrappers = self._wrappers
+        if wrappers is None:
+            wrappers = self._wrappers = {}
+
+        wrappers[node._element] = node
+        self.changed()
+
+    def _detach(self, node):
+        # removes a node that this one wrapped or had appended, the
+        # shared elements on the way to it are copied first
+        node.will_change()
+        path = find_element_path(self._element, node._element)
+        if path:
+            path[-2].remove(node._element)
+
+        wrappers = self._wrappers or {}
+        wrappers.pop(node._element, None)
+        for element in (path or [])[1:-1]:
+            wrapper = wrappers.get(element)
+            if wrapper is not None:
+                wrapper.changed()
+
+        node._parent = None
+        self.changed()
 
     def to_dict(self):
         data = {
             'tag': self.tag,
         }
         if not self.__single__:
-            data['nodes'] = [Node.from_element(c).to_dict() for c in self._element]
+            # ``self.tag`` already fixed up the whole subtree
+            data['nodes'] = [self.wrap(c).to_dict() for c in self._element]
 
         if self.value:
             data['value'] = self.value
@@ -222,33 +697,59 @@ class Node(with_metaclass(MetaNode, object)):
 
         return data
 
+    def serialize(self):
+        """:returns: the UTF-8 bytes of the node, see :py:func:`~xmpp.serializer.element_to_bytes`"""
+        return node_to_bytes(self)
+
+    def to_bytes(self):
+        """:returns: the bytes returned by :py:meth:`~xmpp.models.node.Node.serialize`,
+        which are kept until the node or one of its descendants changes"""
+        if self._bytes is None:
+            self._bytes = self.serialize()
+
+        return self._bytes
+
     def to_xml(self):
-        return node_to_string(self)
+        """:returns: the decoded :py:meth:`~xmpp.models.node.Node.to_bytes`"""
+        if self._xml is None:
+            self._xml = cast_string(self.to_bytes())
+
+        return self._xml
 
     def __str__(self):
         return self.to_xml()
 
     def __repr__(self):
         return '{3}(tag={0}, attributes={1}, namespaces={2})'.format(
-            self._element.tag,
-            self.attr,
-            self.namespaces,
+            self.tag,
+            OrderedDict(self.attr),
+            OrderedDict(self.namespaces),
             self.__class__.__name__
         )
 
     @staticmethod
-    def from_element(element, allow_fixedup=False):
-        NodeClass = _NODE_MAPPING.get(element.tag, None)
+    def from_element(element, allow_fixedup=False, lazy=False):
+        """wraps an element in the :py:class:`~xmpp.models.node.Node`
+        subclass registered for its tag
 
-        if allow_fixedup and NodeClass is None:
-            # element might be fixed up already, let's
-            # try to fetch its Node
-            key = element.tag, element.attrib.get('xmlns')
-            NodeClass = _NODE_MAPPING.get(key, None)
+        :param element: the :py:class:`xml.etree.ElementTree.Element`
+        :param allow_fixedup: kept for compatibility, elements whose namespaces were already fixed up are always looked up by their ``xmlns`` attribute
+        :param lazy: defer the namespace fixup and attribute extraction until first accessed, see :py:meth:`~xmpp.models.node.Node.materialize`
+        """
+        tag = element.tag
+        if '{' in tag:
+            key = split_tag_and_namespace(tag)
+        else:
+            # element might be fixed up already or have no namespace
+            key = tag, element.attrib.get('xmlns', '')
 
+        NodeClass = _NODE_MAPPING.get(key)
         if NodeClass is None:
             # could not find any specialized Node subclasses to
             # represent this `element` let's fallback to Node
+            _NODE_STATISTICS.miss(key)
             NodeClass = Node
+        else:
+            _NODE_STATISTICS.hits += 1
 
-        return NodeClass(element)
+        return NodeClass(element, lazy=lazy)
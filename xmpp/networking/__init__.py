@@ -16,8 +16,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from xmpp.networking.core import address_is_ip, XMPPConnection
+from xmpp.networking.reactor import XMPPReactor
 
 __all__ = [
     'address_is_ip',
     'XMPPConnection',
+    'XMPPReactor',
 ]
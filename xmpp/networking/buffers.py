@@ -0,0 +1,131 @@
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from collections import deque
+
+from xmpp.compat import Queue
+
+
+class BufferFull(Queue.Full):
+    """raised when bytes are added to a :py:class:`~xmpp.networking.buffers.ByteBuffer`
+    that already reached its high-water mark"""
+
+
+class BufferEmpty(Queue.Empty):
+    """raised when taking a chunk out of an empty :py:class:`~xmpp.networking.buffers.ByteBuffer`"""
+
+
+class ByteBuffer(object):
+    """a FIFO of byte chunks that counts how many bytes it holds.
+
+    It takes no locks and must only be used by the thread that runs
+    the connection loop.
+
+    :param high_water_mark: ``int``: how many bytes it holds before :py:attr:`is_full`, ``0`` means no limit
+    """
+    __slots__ = ('chunks', 'size', 'offset', 'high_water_mark')
+
+    def __init__(self, high_water_mark=0):
+        self.chunks = deque()
+        self.size = 0
+        # how much of the first chunk was consumed already
+        self.offset = 0
+        self.high_water_mark = int(high_water_mark)
+
+    @property
+    def is_full(self):
+        return bool(self.high_water_mark) and self.size >= self.high_water_mark
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    __nonzero__ = __bool__
+
+    def append(self, data, force=False):
+        """adds bytes to the end of the buffer
+
+        :param data: the bytes
+        :param force: add the bytes even when the buffer is full
+        :raises BufferFull: when the buffer had reached its high-water mark
+        """
+        if self.is_full and not force:
+            raise BufferFull('{0} bytes buffered'.format(self.size))
+
+        if data:
+            self.chunks.append(data)
+            self.size += len(data)
+
+    def popleft(self):
+        """:returns: the first chunk of the buffer
+
+        :raises BufferEmpty: when there are no chunks
+        """
+        if not self.chunks:
+            raise BufferEmpty()
+
+        chunk = self.chunks.popleft()
+        if self.offset:
+            chunk = chunk[self.offset:]
+            self.offset = 0
+
+        self.size -= len(chunk)
+        return chunk
+
+    def drain(self):
+        """:returns: a list with every chunk of the buffer, which is left empty"""
+        chunks = []
+        while self.chunks:
+            chunks.append(self.popleft())
+
+        return chunks
+
+    def view(self):
+        """:returns: a ``memoryview`` of the first bytes of the buffer.
+
+        The chunks are joined once so that a single ``send()`` can
+        write them, the chunks appended while the joined bytes are
+        being written are only joined after those were written.
+        """
+        chunks = self.chunks
+        if not chunks:
+            return memoryview(b'')
+
+        if len(chunks) > 1 and not self.offset:
+            joined = b''.join(chunks)
+            chunks.clear()
+            chunks.append(joined)
+
+        return memoryview(chunks[0])[self.offset:]
+
+    def consume(self, size):
+        """forgets the first bytes of the buffer, after they were written
+
+        :param size: how many bytes
+        """
+        chunks = self.chunks
+        self.size -= size
+        while size and chunks:
+            remaining = len(chunks[0]) - self.offset
+            if size < remaining:
+                self.offset += size
+                return
+
+            size -= remaining
+            chunks.popleft()
+            self.offset = 0
@@ -16,13 +16,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # import ssl
+import errno
 import random
 import socket
 import logging
-try:
-    import queue as Queue
-except ImportError:
-    import Queue
+from collections import deque
 
 import dns.resolver
 
@@ -30,14 +28,20 @@ from speakers import Speaker as Events
 # from xmpp import security
 from xmpp.compat import cast_bytes
 from xmpp.compat import cast_string
+from xmpp.networking.buffers import ByteBuffer
 from xmpp.networking.util import create_tcp_socket
 from xmpp.networking.util import address_is_ip
 from xmpp.networking.util import socket_ready
+from xmpp.networking.util import TimerHeap
+from xmpp.networking.util import Wakeup
 
 logger = logging.getLogger('xmpp.networking')
 
 DEFAULT_CIPHERS = "HIGH+kEDH:HIGH+kEECDH:HIGH:!PSK:!SRP:!3DES:!aNULL"
 
+# errors of a non-blocking socket that cannot take more bytes for now
+WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+
 
 def create_connection_events():
     return Events('connection', [
@@ -55,32 +59,46 @@ def create_connection_events():
 
         'write',              # the TCP/TLS connection has sent data
         'read',               # the TCP/TLS connection has received data
-        'ready_to_write',     # the TCP/TLS connection is ready to send data
+        'ready_to_write',     # there is pending output and the socket can send it
         'ready_to_read',      # the TCP/TLS connection is ready to receive data
+
+        'write_buffer_full',     # the bytes waiting to be sent reached ``hwm_out``
+        'write_buffer_drained',  # a full write buffer was sent, ``send()`` can be called again
     ])
 
 
 class XMPPConnection(object):
     """Event-based TCP/TLS connection.
 
-    It buffers up received messages and also the messages to be sent.
+    It buffers up received bytes and also the bytes to be sent, the
+    buffers take no locks and belong to the thread that calls
+    :py:meth:`loop_once`. Other threads hand bytes over with
+    :py:meth:`submit`. Many connections can share a single loop
+    with :py:class:`~xmpp.networking.reactor.XMPPReactor`.
 
     :param host: a string containing a domain or ip address. If a domain is given the name will be resolved before connecting.
     :param port: defaults to ``5222``. If you are using a component you might point to ``5347`` or something else.
     :param debug: ``bool`` defaults to ``False``: whether to print the XML traffic on stderr
-    :param queue_class: ``bool`` defaults to :py:class`Queue.Queue`
-    :param hwm_in: ``int`` defaults to 256: how many incomming messages to buffer before blocking
-    :param hwm_out: ``int`` defaults to 256: how many outcomming messages to buffer before blocking
+    :param queue_class: unused, kept for compatibility
+    :param hwm_in: ``int`` defaults to 4 MiB: how many received bytes to buffer before the socket is no longer read
+    :param hwm_out: ``int`` defaults to 4 MiB: how many bytes waiting to be sent before :py:meth:`send` raises :py:class:`~xmpp.networking.buffers.BufferFull`
     :param recv_chunk_size: ``int`` defaults to ``65536``: how many bytes to read at a time.
     """
     def __init__(self, host, port=5222, debug=False, auto_reconnect=False,
-                 queue_class=Queue.Queue, hwm_in=256, hwm_out=256, recv_chunk_size=65536):
+                 queue_class=None, hwm_in=4194304, hwm_out=4194304, recv_chunk_size=65536):
         self.socket = None
         self.tls_context = None
         self.host = cast_bytes(host)
         self.port = int(port)
-        self.read_queue = queue_class(hwm_in)
-        self.write_queue = queue_class(hwm_out)
+        self.read_buffer = ByteBuffer(hwm_in)
+        self.write_buffer = ByteBuffer(hwm_out)
+        # appending to a deque is atomic, other threads submit bytes here
+        self.submissions = deque()
+        # created by the first loop_once(), notified by submit()
+        self.wakeup = None
+        self.timers = TimerHeap()
+        # the XMPPReactor that runs the loop, if any
+        self.reactor = None
         self.recv_chunk_size = int(recv_chunk_size)
         self.__alive = False
         self.on = create_connection_events()
@@ -139,19 +157,37 @@ class XMPPConnection(object):
 
         :param timeout_in_seconds:
         """
-        try:
-            self.socket.shutdown(socket.SHUT_RDWR)
-        except socket.error:
-            logger.debug('connection closed')
+        self.close_socket("intentional")
 
-        try:
-            self.socket.close()
-        except (Exception, BaseException):
-            logger.exception("failed to close")
+    def close_socket(self, reason):
+        """closes the socket and publishes ``tcp_disconnect(reason)``
+
+        :param reason: why the connection is closed
+        """
+        if self.reactor is not None:
+            # before the socket is closed, its file descriptor can be
+            # reused by the next socket registered in the reactor
+            self.reactor.unregister(self)
+
+        if self.socket is not None:
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                logger.debug('connection closed')
+
+            try:
+                self.socket.close()
+            except (Exception, BaseException):
+                logger.exception("failed to close")
 
         self.__alive = False
         self.socket = None
-        self.on.tcp_disconnect.shout("intentional")
+        if self.wakeup is not None and self.reactor is None:
+            # the wakeup of a reactor is shared by its connections
+            self.wakeup.close()
+            self.wakeup = None
+
+        self.on.tcp_disconnect.shout(reason)
 
     def connect(self, timeout_in_seconds=3):
         """connects
@@ -192,6 +228,10 @@ class XMPPConnection(object):
 
         :param timeout_in_seconds:
         """
+        if self.has_pending_output():
+            # the pending bytes keep the connection alive already and
+            # a space could end up in the middle of a stanza
+            return True
 
         connection = socket_ready(self.socket, timeout)
         if connection.write:
@@ -209,75 +249,192 @@ class XMPPConnection(object):
         """
         return self.__alive
 
+    def has_pending_output(self):
+        """
+        :returns: ``True`` if there are bytes waiting to be written
+        """
+        return bool(self.write_buffer) or bool(self.submissions)
+
+    def accept_submissions(self):
+        # moves the bytes submitted by other threads to the write buffer
+        submissions = self.submissions
+        while submissions:
+            self.write_buffer.append(submissions.popleft(), force=True)
+
     def perform_write(self, connection):
         """
-        consumes the write queue and writes to the given socket
+        writes as much of the write buffer as the given socket accepts
+        without blocking, what was not sent is written the next time
+        the socket is ready
 
         :param connection: a socket that is ready to write
         """
         self.on.ready_to_write.shout(self)
-        try:
-            data = self.write_queue.get(block=False, timeout=3)
-        except Queue.Empty:
-            return
+        if self.submissions:
+            self.accept_submissions()
 
-        try:
-            connection.sendall(data)
-            self.on.write.shout(data)
-        except socket.error as e:
-            self.write_queue.put(data, block=False)
-            self.on.tcp_disconnect.shout(str(e))
-            logger.warning('failed to write data (%s): %s', str(e), data)
+        buffer = self.write_buffer
+        was_full = buffer.is_full
+        while buffer:
+            data = buffer.view()
+            try:
+                sent = connection.send(data)
+            except socket.error as e:
+                if e.errno not in WOULD_BLOCK:
+                    logger.warning('failed to write data (%s): %s', str(e), data.tobytes())
+                    self.close_socket(str(e))
+
+                break
+
+            self.on.write.shout(data[:sent].tobytes())
+            buffer.consume(sent)
+            if sent < len(data):
+                # the socket buffer is full
+                break
+
+        if was_full and not buffer.is_full:
+            self.on.write_buffer_drained.shout(self)
 
     def perform_read(self, connection):
         """
         reads from the socket and populates the read queue
         :param connection: a socket that is ready to write
+        :returns: the bytes read, empty when the peer closed the connection or ``None`` when nothing could be read
+
+        The socket is closed when the peer closed the connection or it
+        failed, publishing ``tcp_disconnect``, otherwise it would stay
+        readable forever.
         """
         data = None
         try:
             data = connection.recv(self.recv_chunk_size)
         except socket.error as e:
-            self.on.tcp_disconnect.shout(str(e))
+            if e.errno in WOULD_BLOCK:
+                return
+
             logger.warning('failed to read data of chunk size: %s', self.recv_chunk_size)
+            self.close_socket(str(e))
             return
 
         if not data:
-            return
+            self.close_socket("closed by the peer")
+            return data
 
         self.on.read.shout(data)
-        self.read_queue.put(data, block=False, timeout=3)
+        self.read_buffer.append(data, force=True)
         self.on.ready_to_read.shout(self)
+        return data
 
     def send(self, data, timeout=3):
-        """adds bytes to the be sent in the next time the socket is ready
+        """adds bytes to the be sent in the next time the socket is
+        ready, must be called by the thread that runs the loop
+
+        :param data: the data to be sent
+        :param timeout: unused, kept for compatibility
+        :raises ~xmpp.networking.buffers.BufferFull: when ``hwm_out`` bytes are already waiting, wait for the ``write_buffer_drained`` event
+        """
+        buffer = self.write_buffer
+        was_empty = not buffer
+        buffer.append(cast_bytes(data))
+        if was_empty and self.reactor is not None:
+            self.reactor.output_pending(self)
+
+        if buffer.is_full:
+            self.on.write_buffer_full.shout(self)
+
+    def submit(self, data):
+        """adds bytes to be sent from any thread, they are moved to the
+        write buffer by the thread that runs the loop
 
         :param data: the data to be sent
-        :param timeout: ``int`` in seconds
         """
-        self.write_queue.put(data, block=False, timeout=timeout)
+        self.submissions.append(cast_bytes(data))
+        if self.reactor is not None:
+            self.reactor.output_pending(self)
+
+        wakeup = self.wakeup
+        if wakeup is not None:
+            wakeup.notify()
 
     def receive(self, timeout=3):
-        """retrieves a message from the queue, returns ``None`` if there are
-        no messages.
+        """retrieves a chunk of received bytes
+
+        :param timeout: unused, kept for compatibility
+        :raises ~xmpp.networking.buffers.BufferEmpty: when nothing was received
+        """
+        return self.read_buffer.popleft()
 
-        :param timeout: ``int`` in seconds
+    def receive_all(self):
+        """drains the read buffer, returns a list with every buffered
+        chunk in the order they were received, it might be empty.
         """
-        return self.read_queue.get(block=False, timeout=timeout)
+        return self.read_buffer.drain()
+
+    def call_later(self, delay, callback, *args):
+        """schedules a callback to be called by :py:meth:`loop_once`, or
+        by the :py:class:`~xmpp.networking.reactor.XMPPReactor` the
+        connection is registered with, must be called by the thread
+        that runs the loop
+
+        ::
+
+          def keep_alive():
+              connection.send_whitespace_keepalive()
+              connection.call_later(60, keep_alive)
+
+          connection.call_later(60, keep_alive)
+
+        :param delay: in how many seconds
+        :param callback: the callable
+        :param args: the arguments of the callable
+        :returns: a :py:class:`~xmpp.networking.util.Timer` that can be cancelled
+        """
+        return self.timers.call_later(delay, callback, *args)
+
+    def next_timeout(self, timeout):
+        # seconds until the earliest timer is due, if sooner than the timeout
+        return self.timers.next_timeout(timeout)
+
+    def run_timers(self):
+        self.timers.run()
 
     def loop_once(self, timeout=3):
         """entrypoint for any mainloop.
 
-        basically call this continuously to keep the connection up
+        basically call this continuously to keep the connection up.
+
+        It sleeps until the socket has data to be read, can take the
+        pending output, the next timer of :py:meth:`call_later` is due
+        or another thread calls :py:meth:`submit`.
+
+        :param timeout: the most seconds to wait, ``None`` waits until one of the above happens
         """
-        self.socket.setblocking(False)
-        socket = socket_ready(self.socket, timeout)
+        if self.wakeup is None:
+            self.wakeup = Wakeup()
+
+        connected = self.socket is not None
+        if connected:
+            self.socket.setblocking(False)
+
+        # a full read buffer stops reading until it is consumed, so
+        # the peer is slowed down by TCP. Once disconnected only the
+        # timers and the wakeup are waited for.
+        socket = socket_ready(
+            self.socket, self.next_timeout(timeout),
+            to_read=connected and not self.read_buffer.is_full,
+            to_write=connected and self.has_pending_output(),
+            wakeup=self.wakeup,
+        )
         if socket.read:
             self.perform_read(socket.read)
 
-        if socket.write:
+        # the read might have found out that the peer closed the socket
+        if socket.write and self.socket is not None:
             self.perform_write(socket.write)
 
+        if self.timers:
+            self.run_timers()
+
     # def downgrade_to_tcp(self, reconnect_timeout_in_seconds=3):
     #     if not self.tls_context:
     #         logger.warning("already downgraded to TCP")
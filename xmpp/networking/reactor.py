@@ -0,0 +1,241 @@
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""runs the loop of many connections in a single thread.
+
+::
+
+  reactor = XMPPReactor()
+  for account in accounts:
+      connection = XMPPConnection(account.host)
+      stream = XMLStream(connection)
+      connection.connect()
+      reactor.register(connection)
+
+  while reactor.connections:
+      reactor.loop_once()
+"""
+from collections import deque
+
+try:
+    import selectors
+except ImportError:  # pragma: no cover
+    selectors = None
+
+from xmpp.networking.util import TimerHeap
+from xmpp.networking.util import Wakeup
+
+
+class XMPPReactor(object):
+    """waits for the sockets of many
+    :py:class:`~xmpp.networking.core.XMPPConnection` with a single
+    :py:class:`selectors.DefaultSelector`, which is ``epoll`` on Linux
+    and ``kqueue`` on BSD and OS X, then reads and writes the ones that
+    are ready.
+
+    The registered connections must not call their own
+    :py:meth:`~xmpp.networking.core.XMPPConnection.loop_once`, their
+    timers, :py:meth:`~xmpp.networking.core.XMPPConnection.submit` and
+    the events of their :py:class:`~xmpp.stream.XMLStream` go through
+    :py:meth:`loop_once` of the reactor instead.
+
+    A socket is only waited for writing while its connection has
+    pending output and only for reading while its read buffer is below
+    ``hwm_in``, so the work of each loop grows with the connections that
+    are active, not with the connections that are registered.
+
+    :param selector_class: defaults to :py:class:`selectors.DefaultSelector`
+    """
+    def __init__(self, selector_class=None):
+        if selectors is None:
+            raise RuntimeError('XMPPReactor needs the selectors module of python 3.4 or newer')
+
+        self.selector = (selector_class or selectors.DefaultSelector)()
+        # connection -> [the registered socket, the registered events]
+        self.connections = {}
+        # connections that might have to be written, filled by send()
+        # and submit(), appending to a deque is atomic
+        self.pending = deque()
+        # connections that are not read until their read buffer is consumed
+        self.throttled = set()
+        self.timers = TimerHeap()
+        self.wakeup = Wakeup()
+        self.selector.register(self.wakeup, selectors.EVENT_READ, None)
+
+    def __len__(self):
+        return len(self.connections)
+
+    def register(self, connection):
+        """adds a connected :py:class:`~xmpp.networking.core.XMPPConnection` to the loop
+
+        :param connection: the connection, its socket is made non-blocking
+        """
+        if connection in self.connections:
+            return
+
+        if connection.wakeup is not None and connection.wakeup is not self.wakeup:
+            connection.wakeup.close()
+
+        # the timers scheduled before go to the reactor, call_later()
+        # adds the next ones to the heap of the reactor directly
+        for timer in connection.timers:
+            self.timers.push(timer)
+
+        connection.timers = self.timers
+        connection.wakeup = self.wakeup
+        connection.reactor = self
+        self.connections[connection] = [None, 0]
+        self.update(connection)
+
+    def unregister(self, connection):
+        """removes a connection from the loop, its socket is left open
+
+        :param connection: the :py:class:`~xmpp.networking.core.XMPPConnection`
+        """
+        state = self.connections.pop(connection, None)
+        if state is None:
+            return
+
+        sock, events = state
+        if events:
+            self.selector.unregister(sock)
+
+        self.throttled.discard(connection)
+        connection.reactor = None
+        connection.wakeup = None
+        # timers scheduled already still run in the reactor
+        connection.timers = TimerHeap()
+
+    def output_pending(self, connection):
+        """called by :py:meth:`~xmpp.networking.core.XMPPConnection.send`
+        and :py:meth:`~xmpp.networking.core.XMPPConnection.submit` when
+        a connection has bytes to write, from any thread
+
+        :param connection: the :py:class:`~xmpp.networking.core.XMPPConnection`
+        """
+        self.pending.append(connection)
+
+    def update(self, connection):
+        # waits for the readiness that the connection can handle now
+        state = self.connections.get(connection)
+        if state is None:
+            return
+
+        registered, current = state
+        sock = connection.socket
+        if sock is not registered:
+            # disconnected or reconnected
+            if current:
+                self.selector.unregister(registered)
+
+            if sock is None:
+                state[1] = 0
+                self.unregister(connection)
+                return
+
+            sock.setblocking(False)
+            state[:] = registered, current = [sock, 0]
+
+        events = 0
+        if connection.read_buffer.is_full:
+            self.throttled.add(connection)
+        else:
+            self.throttled.discard(connection)
+            events |= selectors.EVENT_READ
+
+        if connection.has_pending_output():
+            events |= selectors.EVENT_WRITE
+
+        if events == current:
+            return
+
+        if not events:
+            self.selector.unregister(sock)
+        elif not current:
+            self.selector.register(sock, events, connection)
+        else:
+            self.selector.modify(sock, events, connection)
+
+        state[1] = events
+
+    def update_pending(self):
+        pending = self.pending
+        while pending:
+            self.update(pending.popleft())
+
+        if self.throttled:
+            for connection in list(self.throttled):
+                self.update(connection)
+
+    def dispatch(self, connection, sock, events):
+        if events & selectors.EVENT_READ:
+            # closes the socket and publishes tcp_disconnect when the
+            # peer closed the connection or it failed, update() then
+            # unregisters the connection
+            connection.perform_read(sock)
+
+        if events & selectors.EVENT_WRITE and connection.socket is sock:
+            connection.perform_write(sock)
+
+        self.update(connection)
+
+    def next_timeout(self, timeout):
+        if self.pending:
+            # submitted from another thread after update_pending()
+            return 0
+
+        return self.timers.next_timeout(timeout)
+
+    def loop_once(self, timeout=3):
+        """waits until one of the registered sockets is ready, a timer
+        is due or a connection submits bytes from another thread, then
+        performs the reads and writes of every socket that is ready.
+
+        :param timeout: the most seconds to wait, ``None`` waits until one of the above happens
+        :returns: how many sockets were ready
+        """
+        self.update_pending()
+        timeout = self.next_timeout(timeout)
+        if timeout is not None:
+            timeout = max(float(timeout), 0)
+
+        ready = self.selector.select(timeout)
+        for key, events in ready:
+            connection = key.data
+            if connection is None:
+                self.wakeup.drain()
+                continue
+
+            if connection in self.connections:
+                self.dispatch(connection, key.fileobj, events)
+
+        if self.timers:
+            self.timers.run()
+
+        return len(ready)
+
+    def close(self):
+        """unregisters every connection, their sockets are left open"""
+        for connection in list(self.connections):
+            self.unregister(connection)
+
+        self.selector.close()
+        self.wakeup.close()
+
+
+__all__ = [
+    'XMPPReactor',
+]
@@ -17,6 +17,8 @@
 
 import os
 import re
+import time
+import heapq
 import socket
 import select
 from collections import namedtuple
@@ -26,6 +28,9 @@ IP_REGEX = re.compile(r'^(\d{1,3}[.]){3}\d{1,3}$')
 
 SocketStatePair = namedtuple('SocketStatePair', ['read', 'write'])
 
+# timers must not move when the clock of the system is changed
+monotonic = getattr(time, 'monotonic', time.time)
+
 
 def create_tcp_socket(keep_alive_seconds=3, max_fails=5):
     result = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -72,18 +77,142 @@ def set_keepalive_osx(sock, interval_sec=3, after_idle_sec=None, max_fails=None)
     sock.setsockopt(socket.IPPROTO_TCP, TCP_KEEPALIVE, interval_sec)
 
 
-def socket_ready(socket, timeout, to_read=True, to_write=True):
+def socket_ready(socket, timeout, to_read=True, to_write=True, wakeup=None):
+    """waits until the socket can be read or written
+
+    :param socket: the socket
+    :param timeout: how many seconds to wait, ``None`` waits until the socket is ready
+    :param to_read: whether to wait for the socket to be readable
+    :param to_write: whether to wait for the socket to be writable
+    :param wakeup: a :py:class:`~xmpp.networking.util.Wakeup` that stops the wait when notified
+    :returns: a :py:class:`SocketStatePair` with the socket in the ready side, or ``None``
+    """
     for_reads = to_read and [socket] or []
     for_writes = to_write and [socket] or []
+    if wakeup is not None:
+        for_reads.append(wakeup)
+
+    if timeout is not None:
+        timeout = max(float(timeout), 0)
 
-    sockets = select.select(for_reads, for_writes, [], float(timeout) / 1000)
+    sockets = select.select(for_reads, for_writes, [], timeout)
     reads, writes, exceptions = sockets
     read_socket = None
     write_socket = None
 
-    if reads:
-        read_socket = reads[0]
+    for ready in reads:
+        if ready is wakeup:
+            wakeup.drain()
+        else:
+            read_socket = ready
+
     if writes:
         write_socket = writes[0]
 
     return SocketStatePair(read_socket, write_socket)
+
+
+class Wakeup(object):
+    """a pair of connected sockets that another thread writes to in
+    order to stop the :py:func:`~xmpp.networking.util.socket_ready`
+    of the loop"""
+
+    def __init__(self):
+        self.reader, self.writer = socket.socketpair()
+        self.reader.setblocking(False)
+        self.writer.setblocking(False)
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def notify(self):
+        try:
+            self.writer.send(b'\0')
+        except socket.error:
+            # the buffer is full, so the loop has a wakeup pending
+            # already, or the wakeup was closed
+            pass
+
+    def drain(self):
+        try:
+            while self.reader.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
+
+
+class Timer(object):
+    """a callback scheduled by :py:meth:`~xmpp.networking.core.XMPPConnection.call_later`"""
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """the callback will not be called"""
+        self.cancelled = True
+
+    def __lt__(self, other):
+        return self.deadline < other.deadline
+
+
+class TimerHeap(object):
+    """the :py:class:`~xmpp.networking.util.Timer` of a loop, the
+    earliest deadline first"""
+    __slots__ = ('timers',)
+
+    def __init__(self):
+        self.timers = []
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __iter__(self):
+        return iter(self.timers)
+
+    def push(self, timer):
+        heapq.heappush(self.timers, timer)
+
+    def call_later(self, delay, callback, *args):
+        """:returns: a :py:class:`~xmpp.networking.util.Timer` that calls the callback in ``delay`` seconds"""
+        timer = Timer(monotonic() + delay, callback, args)
+        self.push(timer)
+        return timer
+
+    def next_timeout(self, timeout):
+        """:returns: the seconds until the earliest timer is due, if sooner than the given timeout
+
+        :param timeout: the most seconds to wait, ``None`` means no limit
+        """
+        timers = self.timers
+        while timers and timers[0].cancelled:
+            heapq.heappop(timers)
+
+        if not timers:
+            return timeout
+
+        remaining = max(timers[0].deadline - monotonic(), 0)
+        if timeout is None:
+            return remaining
+
+        return min(timeout, remaining)
+
+    def run(self):
+        """calls the timers that are due, the ones they schedule run
+        in the next loop"""
+        timers = self.timers
+        now = monotonic()
+        due = []
+        while timers and timers[0].deadline <= now:
+            due.append(heapq.heappop(timers))
+
+        for timer in due:
+            if not timer.cancelled:
+                timer.callback(*timer.args)
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+#
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import itertools
+import multiprocessing
+
+from xmpp.compat import Queue
+from xmpp.compat import text_type
+from xmpp.core import ET
+from xmpp.core import element_to_record
+from xmpp.models.core import Stream
+from xmpp.parser import IncrementalParser
+from xmpp.parser import ParserLimits
+from xmpp.parser import StanzaLimitExceeded
+from xmpp.stream import NodeHandler
+
+
+logger = logging.getLogger('xmpp.offload')
+
+
+def element_paths(root, elements):
+    """:returns: a tuple with the path of child indexes from the root
+    to each one of the given elements of its subtree, in the same order"""
+    wanted = set(elements)
+    found = {}
+    pending = [(root, ())]
+    while pending and len(found) < len(wanted):
+        element, path = pending.pop()
+        for index, child in enumerate(element):
+            child_path = path + (index,)
+            if child in wanted:
+                found[child] = child_path
+
+            pending.append((child, child_path))
+
+    # children of single nodes are never appended to them
+    return tuple(found[element] for element in elements if element in found)
+
+
+class RecordingStream(object):
+    """stands in for the :py:class:`~xmpp.stream.XMLStream` parent of
+    the :py:class:`~xmpp.stream.NodeHandler` inside of a worker
+    process, each notification becomes a ``(method, record)`` tuple to
+    be replayed by :py:meth:`~xmpp.stream.XMLStream.feed_records`.
+
+    Every top-level stanza becomes a single record, the children that
+    closed before it are recorded as their paths inside of the stanza
+    instead of being serialized once more.
+    """
+    # the worker never touches the nodes, so their elements are
+    # recorded exactly as parsed
+    lazy_nodes = True
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.records = []
+        self.children = []
+
+    def node_did_open(self, node):
+        if isinstance(node, Stream):
+            self.records.append(('node_did_open', element_to_record(node._element)))
+
+    def node_did_close(self, node):
+        if isinstance(node, Stream):
+            self.records.append(('node_did_close', element_to_record(node._element)))
+        else:
+            self.children.append(node._element)
+
+    def stanza_did_close(self, node):
+        element = node._element
+        children, self.children = self.children, []
+        record = element_to_record(element), element_paths(element, children)
+        self.records.append(('stanza_did_close', record))
+
+
+class StreamParser(object):
+    """parses the XML of a single stream inside of a worker process
+
+    :param backend: the :py:class:`~xmpp.parser.ParserBackend` of the stream
+    :param limits: the :py:class:`~xmpp.parser.ParserLimits` of the stream
+    """
+    def __init__(self, backend=None, limits=None):
+        self.recorder = RecordingStream(limits or ParserLimits())
+        self.target = NodeHandler(self.recorder)
+        self.parser = IncrementalParser(self.target, backend)
+        self.failed = False
+
+    def feed(self, data):
+        """:returns: the list of records produced by the given chunk,
+        nothing is parsed after a limit or a parse error, the stream
+        fails and is opened again by :py:meth:`~xmpp.stream.XMLStream.reset`
+        """
+        if self.failed:
+            return []
+
+        self.recorder.records = records = []
+        try:
+            self.parser.feed(data)
+        except StanzaLimitExceeded as e:
+            self.failed = True
+            self.parser = self.target = None
+            records.append(('limit_exceeded', str(e)))
+        except ET.ParseError as e:
+            self.failed = True
+            self.parser = self.target = None
+            records.append(('unhandled_xml', data))
+            records.append(('bad_format', str(e)))
+
+        self.recorder.records = []
+        return records
+
+
+def parsing_worker(requests, results):
+    """main loop of the worker processes of a :py:class:`~xmpp.offload.ParsingPool`"""
+    parsers = {}
+    for command, key, argument in iter(requests.get, None):
+        if command == 'feed':
+            parser = parsers.get(key)
+            records = parser and parser.feed(argument)
+            if records:
+                results.put((key, records))
+
+        elif command == 'open':
+            parsers[key] = StreamParser(*argument)
+
+        elif command == 'close':
+            parsers.pop(key, None)
+            # tells the pool that no more records will come
+            results.put((key, None))
+
+
+class OffloadedParser(object):
+    """stands in for the :py:class:`~xmpp.parser.IncrementalParser` of
+    a :py:class:`~xmpp.stream.XMLStream` whose XML is parsed by a
+    :py:class:`~xmpp.offload.ParsingPool`.
+
+    :param pool: the :py:class:`~xmpp.offload.ParsingPool`
+    :param key: ``int`` identifying the stream in the pool
+    :param worker: ``int`` index of the worker the stream is pinned to
+    """
+    def __init__(self, pool, key, worker):
+        self.pool = pool
+        self.key = key
+        self.worker = worker
+
+    def feed(self, data):
+        if isinstance(data, text_type):
+            data = data.encode('utf-8')
+
+        self.pool.submit(self, bytes(data))
+
+    def reset(self):
+        self.pool.submit_command(self, 'open')
+
+
+class ParsingPool(object):
+    """Parses the inbound XML of many
+    :py:class:`~xmpp.stream.XMLStream` objects in a pool of worker
+    processes, while the connections are still read and written by a
+    single I/O loop.
+
+    Every stream is pinned to the worker with the least streams when
+    it is created, so its chunks are parsed in the order they were fed.
+    The workers send back compact stanza records which are turned into
+    nodes and dispatched by :py:meth:`~xmpp.offload.ParsingPool.dispatch`,
+    that should be called from the I/O loop.
+
+    ::
+
+      pool = ParsingPool(processes=4)
+      stream = XMLStream(connection, parsing_pool=pool)
+
+      while True:
+          connection.loop_once()
+          pool.dispatch()
+
+    :param processes: ``int`` how many worker processes, defaults to the number of CPUs
+    """
+    def __init__(self, processes=None):
+        self.processes = int(processes or multiprocessing.cpu_count())
+        self.results = multiprocessing.Queue()
+        self.streams = {}
+        self.load = [0] * self.processes
+        self.workers = []
+        self._keys = itertools.count()
+
+        for index in range(self.processes):
+            requests = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=parsing_worker,
+                args=(requests, self.results),
+                name='xmpp-parsing-worker-{0}'.format(index),
+            )
+            process.daemon = True
+            process.start()
+            self.workers.append((process, requests))
+
+    def register(self, stream):
+        """pins the given stream to the least loaded worker
+
+        :param stream: the :py:class:`~xmpp.stream.XMLStream`
+        :returns: a :py:class:`~xmpp.offload.OffloadedParser`
+        """
+        key = next(self._keys)
+        worker = self.load.index(min(self.load))
+        self.load[worker] += 1
+        self.streams[key] = stream
+
+        parser = OffloadedParser(self, key, worker)
+        self.submit_command(parser, 'open')
+        return parser
+
+    def unregister(self, parser):
+        """stops parsing the XML of a stream, the records already on
+        their way are still dispatched"""
+        self.load[parser.worker] -= 1
+        self.submit_command(parser, 'close')
+
+    def submit(self, parser, data):
+        _, requests = self.workers[parser.worker]
+        requests.put(('feed', parser.key, data))
+
+    def submit_command(self, parser, command):
+        stream = self.streams[parser.key]
+        argument = command == 'open' and (stream.parser_backend, stream.limits) or None
+        _, requests = self.workers[parser.worker]
+        requests.put((command, parser.key, argument))
+
+    def dispatch(self, timeout=0):
+        """dispatches every record parsed so far through the stream it
+        came from, see :py:meth:`~xmpp.stream.XMLStream.feed_records`
+
+        :param timeout: seconds to wait for the first record, ``None`` blocks until there is one
+        :returns: how many top-level stanzas were dispatched
+        """
+        dispatched = 0
+        block = timeout is None or timeout > 0
+        while True:
+            try:
+                key, records = self.results.get(block, timeout)
+            except Queue.Empty:
+                return dispatched
+
+            block = False
+            if records is None:
+                self.streams.pop(key, None)
+                continue
+
+            stream = self.streams.get(key)
+            if stream is None:
+                logger.warning("dropping records of unknown stream %s", key)
+                continue
+
+            dispatched += len(stream.feed_records(records))
+
+    def close(self):
+        """stops every worker process, the records that were not
+        dispatched yet are discarded"""
+        for process, requests in self.workers:
+            requests.put(None)
+
+        # a worker only exits once the records it put in the results
+        # queue were read, so the queue is drained while waiting
+        for process, requests in self.workers:
+            while process.is_alive():
+                try:
+                    self.results.get(True, 0.05)
+                except Queue.Empty:
+                    process.join(0.05)
+
+        self.workers = []
+        self.streams = {}
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+#
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import logging
+from collections import OrderedDict
+from xml.parsers import expat
+
+from xmpp.compat import PY3
+from xmpp.compat import text_type
+from xmpp.core import ET
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:  # pragma: no cover
+    lxml_etree = None
+
+
+logger = logging.getLogger('xmpp.parser')
+
+
+# every parser is primed with an envelope that is never closed, so
+# that streams, stream restarts and standalone stanzas are all just
+# children of one endless document and the parser never needs to be
+# rebuilt between them.
+ENVELOPE = b'<xmpp-envelope xmlns:stream="http://etherx.jabber.org/streams">'
+
+# the xml declaration is only valid at the beginning of a document, but
+# XMPP peers send a new one whenever the stream restarts, so the ones
+# right before a <stream:stream> are skipped before reaching the
+# parser. Declarations anywhere else, like inside a CDATA section, and
+# processing instructions like <?xml-stylesheet?> are left alone. The
+# patterns work with bytes, bytearray and memoryview without copying.
+XML_DECLARATION = re.compile(br'<[?]xml\s(?:[^?>]|[?](?!>))*[?]>\s*(?=<stream:stream[\s>])')
+
+
+def partial_pattern(atoms):
+    # matches any prefix of the sequence of atoms at the end of the input
+    pattern = atoms[-1]
+    for atom in reversed(atoms[:-1]):
+        pattern = atom + b'(?:' + pattern + b')?'
+
+    return re.compile(pattern + br'\Z')
+
+
+# a chunk ending with one of these is held back until the next chunk
+# tells whether it is a declaration before a <stream:stream>. Real
+# declarations are short, a longer one goes to the parser, where it
+# counts towards ParserLimits.max_stanza_size like any other input.
+XML_DECLARATION_PARTIAL = partial_pattern(
+    [b'<', br'[?]', b'x', b'm', b'l', br'\s(?:[^?>]|[?](?!>)){0,256}', br'[?]', b'>', br'\s*', b'<'] +
+    [re.escape(char).encode('ascii') for char in 'stream:stream']
+)
+
+# the input is fed to the parser in slices that end right after a
+# ``>``, see IncrementalParser.feed_parser
+TAG_END = re.compile(b'>')
+
+
+class StanzaLimitExceeded(Exception):
+    """raised while parsing a stanza that exceeds one of the
+    :py:class:`~xmpp.parser.ParserLimits`"""
+
+
+class ParserLimits(object):
+    """Limits enforced on every top-level stanza while it is being
+    parsed, ``None`` disables a limit. A stanza that exceeds one of
+    them fails the stream with a ``policy-violation`` error, see
+    :py:meth:`~xmpp.stream.XMLStream.fail`.
+
+    :param max_stanza_size: ``int`` defaults to 1 MiB: how many bytes a single stanza can take
+    :param max_depth: ``int`` defaults to ``64``: how deep elements can be nested inside of a stanza
+    :param max_attributes: ``int`` defaults to ``64``: how many attributes a single element can have
+    :param max_text_length: ``int`` defaults to 1 MiB: how many characters of text a single stanza can have
+    :param max_stanza_rate: ``int`` defaults to ``None``: how many stanzas can be received per second
+    """
+    def __init__(self, max_stanza_size=1048576, max_depth=64, max_attributes=64,
+                 max_text_length=1048576, max_stanza_rate=None):
+        self.max_stanza_size = max_stanza_size
+        self.max_depth = max_depth
+        self.max_attributes = max_attributes
+        self.max_text_length = max_text_length
+        self.max_stanza_rate = max_stanza_rate
+
+
+def xml_tree_builder(target):
+    if PY3:
+        return ET.XMLParser(target=target)
+
+    return ET.XMLTreeBuilder(target=target)
+
+
+class ParserBackend(object):
+    """Base class for the XML parsers that can be plugged into the
+    :py:class:`~xmpp.parser.IncrementalParser`.
+
+    A backend feeds the ``target`` with the same events as the
+    ``target`` of :py:class:`xml.etree.ElementTree.XMLParser`, that
+    is ``start(tag, attrib)``, ``end(tag)`` and ``data(text)`` with
+    tags and attributes in ``{namespace}name`` notation.
+
+    :param target: the object that receives the parser events
+    """
+    name = None
+
+    def __init__(self, target):
+        self.target = target
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def feed(self, data):
+        """feeds a chunk of XML
+
+        :raises ParseError: when the XML is malformed
+        """
+        raise NotImplementedError
+
+
+class ElementTreeBackend(ParserBackend):
+    """uses the :py:class:`xml.etree.ElementTree.XMLParser` from the
+    standard library, always available."""
+    name = 'etree'
+
+    def __init__(self, target):
+        super(ElementTreeBackend, self).__init__(target)
+        self._parser = xml_tree_builder(target)
+
+    def feed(self, data):
+        self._parser.feed(data)
+
+
+class ExpatBackend(ParserBackend):
+    """drives :py:mod:`xml.parsers.expat` directly, without the
+    ElementTree layer in between, adjacent text is delivered to the
+    target in a single ``data()`` call."""
+    name = 'expat'
+
+    def __init__(self, target):
+        super(ExpatBackend, self).__init__(target)
+        self._names = {}
+        self._parser = expat.ParserCreate(namespace_separator='}')
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self.handle_start
+        self._parser.EndElementHandler = self.handle_end
+        self._parser.CharacterDataHandler = target.data
+
+    def fixname(self, name):
+        try:
+            return self._names[name]
+        except KeyError:
+            fixed = '}' in name and '{' + name or name
+            self._names[name] = fixed
+            return fixed
+
+    def handle_start(self, name, attrs):
+        fixname = self.fixname
+        attrib = {}
+        for key in attrs:
+            attrib[fixname(key)] = attrs[key]
+
+        self.target.start(fixname(name), attrib)
+
+    def handle_end(self, name):
+        self.target.end(self.fixname(name))
+
+    def feed(self, data):
+        try:
+            self._parser.Parse(data, False)
+        except expat.ExpatError as e:
+            raise ET.ParseError(str(e))
+
+
+class LXMLTarget(object):
+    """forwards the events of lxml to the target of a
+    :py:class:`~xmpp.parser.LXMLBackend`, lxml passes the attributes
+    of elements without any as an immutable mapping instead of a
+    ``dict``"""
+
+    def __init__(self, target):
+        self.target = target
+        self.end = target.end
+        self.data = target.data
+
+    def start(self, tag, attrib):
+        self.target.start(tag, dict(attrib))
+
+    def close(self):
+        close = getattr(self.target, 'close', None)
+        return close and close()
+
+
+class LXMLBackend(ParserBackend):
+    """uses the feed interface of :py:class:`lxml.etree.XMLParser`
+    with a parser target, only available when lxml is installed."""
+    name = 'lxml'
+
+    def __init__(self, target):
+        super(LXMLBackend, self).__init__(target)
+        self._parser = lxml_etree.XMLParser(target=LXMLTarget(target), resolve_entities=False)
+
+    @classmethod
+    def is_available(cls):
+        return lxml_etree is not None
+
+    def feed(self, data):
+        if not isinstance(data, bytes):
+            data = bytes(data)
+
+        try:
+            self._parser.feed(data)
+        except lxml_etree.XMLSyntaxError as e:
+            raise ET.ParseError(str(e))
+
+
+PARSER_BACKENDS = OrderedDict([
+    (ExpatBackend.name, ExpatBackend),
+    (LXMLBackend.name, LXMLBackend),
+    (ElementTreeBackend.name, ElementTreeBackend),
+])
+
+DEFAULT_PARSER_BACKEND = ElementTreeBackend
+
+
+def get_parser_backend(backend=None):
+    """resolves a parser backend, falls back to the
+    :py:class:`~xmpp.parser.ElementTreeBackend` when the requested one
+    is not available in this host.
+
+    :param backend: ``None``, the name of a backend (``"expat"``, ``"lxml"`` or ``"etree"``) or a :py:class:`~xmpp.parser.ParserBackend` subclass
+    """
+    if backend is None:
+        return DEFAULT_PARSER_BACKEND
+
+    if not isinstance(backend, type):
+        if backend not in PARSER_BACKENDS:
+            msg = 'unknown parser backend: {0}'.format(backend)
+            raise ValueError(msg)
+
+        backend = PARSER_BACKENDS[backend]
+
+    if not backend.is_available():
+        logger.warning("parser backend %s is not available, falling back to %s",
+                       backend.name, DEFAULT_PARSER_BACKEND.name)
+        return DEFAULT_PARSER_BACKEND
+
+    return backend
+
+
+def available_parser_backends():
+    """:returns: a list with the parser backends available in this host"""
+    return [b for b in PARSER_BACKENDS.values() if b.is_available()]
+
+
+class IncrementalParser(object):
+    """Long-lived incremental XML parser, there is only one per
+    :py:class:`~xmpp.stream.XMLStream` session.
+
+    Chunks of any size can be fed, the ``target`` is notified of each
+    tag as soon as it is complete.
+
+    A target with a ``will_feed(size)`` method is told the size of
+    every slice of input before the slice is parsed. Each slice ends
+    right after a ``>``, so the events fired while parsing it belong
+    to its bytes, which is how :py:class:`~xmpp.stream.NodeHandler`
+    measures stanzas.
+
+    :param target: an object with the methods ``reset()``, ``start(tag, attrib)``, ``end(tag)`` and ``data(text)``
+    :param backend: the :py:class:`~xmpp.parser.ParserBackend` (or its name) to parse with, see :py:func:`~xmpp.parser.get_parser_backend`
+    """
+
+    def __init__(self, target, backend=None):
+        self.target = target
+        self.backend = get_parser_backend(backend)
+        self.reset()
+
+    def reset(self):
+        """discards any partially parsed XML and primes a fresh parser"""
+        self.target.reset()
+        self._will_feed = getattr(self.target, 'will_feed', None)
+        self._pending = b''
+        self._parser = self.backend(self.target)
+        self._parser.feed(ENVELOPE)
+
+    def feed_parser(self, data):
+        will_feed = self._will_feed
+        if will_feed is None:
+            self._parser.feed(data)
+            return
+
+        position = 0
+        for found in TAG_END.finditer(data):
+            end = found.end()
+            will_feed(end - position)
+            self._parser.feed(data[position:end])
+            position = end
+
+        size = len(data)
+        if position < size:
+            will_feed(size - position)
+            self._parser.feed(data[position:] if position else data)
+
+    def feed(self, data):
+        """feeds a chunk of XML to the parser.
+
+        ``bytes``, ``bytearray`` and ``memoryview`` chunks are handed
+        to the underlying parser as they are, only the slices around
+        the xml declaration of a ``<stream:stream>`` are skipped.
+
+        :param data: the XML chunk
+        :raises ParseError: when the XML is malformed, in which case :py:meth:`reset` must be called
+        """
+        if isinstance(data, text_type):
+            data = data.encode('utf-8')
+
+        if self._pending:
+            # the previous chunk ended in the middle of what might be
+            # an xml declaration
+            data = self._pending + bytes(data)
+            self._pending = b''
+
+        position = 0
+        size = len(data)
+        while True:
+            found = XML_DECLARATION.search(data, position)
+            if found is None:
+                break
+
+            if found.start() > position:
+                self.feed_parser(data[position:found.start()])
+
+            position = found.end()
+
+        partial = XML_DECLARATION_PARTIAL.search(data, position)
+        tail = size if partial is None else partial.start()
+        if tail > position:
+            self.feed_parser(data if position == 0 and tail == size else data[position:tail])
+
+        if tail < size:
+            self._pending = bytes(data[tail:size])
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+#
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""the path language of :py:meth:`~xmpp.models.node.Node.query`
+
+A path is a sequence of steps separated by ``/``, matched against the
+children of the previous step, or against all of its descendants when
+separated by ``//``:
+
+* ``name`` matches the elements with that tag in any namespace
+* ``prefix:name`` matches the elements with that tag in the namespace
+  of the prefix, see :py:func:`~xmpp.query.register_prefix`
+* ``{namespace}name`` matches the elements with that tag in the given namespace
+* ``*`` matches any element and ``.`` the current one
+* ``[@attr]`` and ``[@attr="value"]`` filter the elements of a step
+
+A path can end in ``@attr`` or ``text()`` to select the attribute
+values or the text of the matched elements instead of the elements.
+
+::
+
+  iq.query('roster:query/roster:item[@subscription="both"]/@jid')
+"""
+import re
+from collections import OrderedDict
+
+from xmpp.core import split_tag_and_namespace
+
+
+# how many compiled paths are kept around
+QUERY_CACHE_SIZE = 256
+
+# prefix -> namespace, declared in the ``__prefixes__`` of the nodes
+NAMESPACE_PREFIXES = {}
+
+_COMPILED_QUERIES = OrderedDict()
+
+STEP = re.compile(r'^(?P<name>\{[^}]+\}[^\[]+|[^\[{]+)(?P<predicates>(\[.*\])*)$')
+PREDICATE = re.compile(r'''\[\s*@(?P<attr>[^=\]\s]+)\s*(?:=\s*(?P<quote>['"])(?P<value>.*?)(?P=quote))?\s*\]''')
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+def register_prefix(prefix, namespace):
+    """makes a namespace prefix available to every query
+
+    :param prefix: the prefix, as in ``prefix:name``
+    :param namespace: the namespace uri
+    """
+    NAMESPACE_PREFIXES[prefix] = namespace
+    # the prefixes are resolved when a path is compiled
+    _COMPILED_QUERIES.clear()
+
+
+def split_steps(path):
+    steps = []
+    current = []
+    nesting = None
+    for char in path:
+        if nesting:
+            current.append(char)
+            if char == nesting:
+                nesting = None
+            continue
+
+        if char == '/':
+            steps.append(''.join(current).strip())
+            current = []
+            continue
+
+        current.append(char)
+        if char == '[':
+            nesting = ']'
+        elif char == '{':
+            nesting = '}'
+
+    steps.append(''.join(current).strip())
+    return steps
+
+
+class Step(object):
+    """matches the elements of a single step of a path"""
+    __slots__ = ('descendants', 'name', 'namespace', 'predicates')
+
+    def __init__(self, descendants, name, namespace, predicates):
+        self.descendants = descendants
+        self.name = name
+        self.namespace = namespace
+        self.predicates = predicates
+
+    def matches(self, element, namespace):
+        if self.name != '*' and element.tag != self.name:
+            return False
+
+        if self.namespace is not None and namespace != self.namespace:
+            return False
+
+        for attr, value in self.predicates:
+            found = element.get(attr)
+            if found is None or (value is not None and found != value):
+                return False
+
+        return True
+
+    def select(self, matches):
+        seen = set()
+        for element, namespace in matches:
+            if self.name == '.':
+                yield element, namespace
+                continue
+
+            candidates = self.descendants and iter_descendants(element, namespace) or iter_children(element, namespace)
+            for candidate, candidate_namespace in candidates:
+                if self.matches(candidate, candidate_namespace):
+                    if self.descendants:
+                        # nested matches of a previous step would yield
+                        # the same descendants again
+                        if id(candidate) in seen:
+                            continue
+                        seen.add(id(candidate))
+
+                    yield candidate, candidate_namespace
+
+
+def iter_children(element, namespace):
+    for child in element:
+        yield child, child.get('xmlns') or namespace
+
+
+def iter_descendants(element, namespace):
+    for child in element:
+        child_namespace = child.get('xmlns') or namespace
+        yield child, child_namespace
+        for item in iter_descendants(child, child_namespace):
+            yield item
+
+
+class Query(object):
+    """a compiled path, see :py:func:`~xmpp.query.compile_query`"""
+
+    def __init__(self, path, namespaces=None):
+        self.path = path
+        self.steps = []
+        self.attribute = None
+        self.text = False
+
+        prefixes = dict(NAMESPACE_PREFIXES)
+        prefixes.update(namespaces or {})
+
+        if path.strip().startswith('/'):
+            self.fail('cannot use an absolute path on a node')
+
+        steps = split_steps(path.strip())
+        last = len(steps) - 1
+        descendants = False
+        for index, text in enumerate(steps):
+            if not text:
+                if index in (0, last) or descendants:
+                    self.fail('empty step')
+
+                descendants = True
+                continue
+
+            if index == last and text.startswith('@'):
+                self.attribute = text[1:]
+            elif index == last and text == 'text()':
+                self.text = True
+            else:
+                self.steps.append(self.compile_step(text, descendants, prefixes))
+
+            descendants = False
+
+    def fail(self, reason):
+        raise QuerySyntaxError('invalid query "{0}": {1}'.format(self.path, reason))
+
+    def compile_step(self, text, descendants, prefixes):
+        found = STEP.match(text)
+        if not found:
+            self.fail('invalid step {0}'.format(text))
+
+        name = found.group('name').strip()
+        namespace = None
+        if name.startswith('{'):
+            name, namespace = split_tag_and_namespace(name)
+        elif ':' in name:
+            prefix, local = name.split(':', 1)
+            if prefix in prefixes:
+                name, namespace = local, prefixes[prefix]
+
+        predicates = []
+        remaining = found.group('predicates')
+        for predicate in PREDICATE.finditer(remaining):
+            predicates.append((predicate.group('attr'), predicate.group('value')))
+
+        if PREDICATE.sub('', remaining).strip():
+            self.fail('unsupported predicate in {0}'.format(text))
+
+        return Step(descendants, name, namespace, tuple(predicates))
+
+    def iterate(self, element, namespace=''):
+        """yields the elements, attribute values or texts matched under the given element
+
+        :param element: the :py:class:`xml.etree.ElementTree.Element` to start from
+        :param namespace: the namespace of the element, when it has no ``xmlns`` attribute
+        """
+        matches = iter([(element, element.get('xmlns') or namespace)])
+        for step in self.steps:
+            matches = step.select(matches)
+
+        for matched, _ in matches:
+            if self.text:
+                yield matched.text or ''
+            elif self.attribute:
+                value = matched.get(self.attribute)
+                if value is not None:
+                    yield value
+            else:
+                yield matched
+
+    @property
+    def selects_elements(self):
+        return not self.text and not self.attribute
+
+
+def compile_query(path, namespaces=None):
+    """compiles a path, the last compiled paths are cached
+
+    :param path: the path, see :py:mod:`xmpp.query`
+    :param namespaces: ``dict`` of extra prefixes
+    :returns: a :py:class:`~xmpp.query.Query`
+    """
+    key = namespaces and (path, tuple(sorted(namespaces.items()))) or path
+    query = _COMPILED_QUERIES.pop(key, None)
+    if query is None:
+        query = Query(path, namespaces)
+        if len(_COMPILED_QUERIES) >= QUERY_CACHE_SIZE:
+            _COMPILED_QUERIES.popitem(last=False)
+
+    # the most recently used paths are at the end
+    _COMPILED_QUERIES[key] = query
+    return query
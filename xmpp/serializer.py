@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""writes element trees straight to UTF-8 bytes.
+
+The output is the same as :py:func:`~xmpp.core.element_to_string`,
+but the namespaces are resolved while writing instead of fixing up a
+copy of the tree, and there is no round trip through the generic
+serializer of :py:mod:`xml.etree.ElementTree`.
+"""
+import re
+from collections import OrderedDict
+
+from xmpp.core import copy_element
+from xmpp.core import fixup_element
+from xmpp.core import raw_element_to_string
+from xmpp.core import split_tag_and_namespace
+from xmpp.compat import string_types
+from xmpp._registry import _NODE_MAPPING
+
+
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
+
+TEXT_ESCAPES = {
+    ord(u'&'): u'&amp;',
+    ord(u'<'): u'&lt;',
+    ord(u'>'): u'&gt;',
+}
+ATTRIBUTE_ESCAPES = dict(TEXT_ESCAPES)
+ATTRIBUTE_ESCAPES.update({
+    ord(u'"'): u'&quot;',
+    ord(u'\r'): u'&#13;',
+    ord(u'\n'): u'&#10;',
+    ord(u'\t'): u'&#09;',
+})
+
+# most values have nothing to escape, searching is cheaper than translating
+NEEDS_TEXT_ESCAPE = re.compile(u'[&<>]')
+NEEDS_ATTRIBUTE_ESCAPE = re.compile(u'[&<>"\r\n\t]')
+
+# model class -> the namespace declarations added by fixup_element
+_DECLARATIONS = {}
+
+
+class UnsupportedElement(Exception):
+    """raised for trees that only :py:mod:`xml.etree.ElementTree` can
+    write, like attributes in arbitrary namespaces"""
+
+
+def escape_text(value):
+    if not isinstance(value, string_types):
+        raise UnsupportedElement(value)
+
+    if NEEDS_TEXT_ESCAPE.search(value):
+        return value.translate(TEXT_ESCAPES)
+
+    return value
+
+
+def escape_attribute(value):
+    if not isinstance(value, string_types):
+        raise UnsupportedElement(value)
+
+    if NEEDS_ATTRIBUTE_ESCAPE.search(value):
+        return value.translate(ATTRIBUTE_ESCAPES)
+
+    return value
+
+
+def namespace_declarations(NodeClass):
+    """:returns: a tuple of ``(attribute, uri)`` with the namespaces
+    declared by a model, computed once per class
+
+    :param NodeClass: a :py:class:`~xmpp.models.node.Node` subclass
+    """
+    try:
+        return _DECLARATIONS[NodeClass]
+    except KeyError:
+        pass
+
+    declarations = []
+    for prefix, uri in OrderedDict(NodeClass.__namespaces__).items():
+        attr = prefix and u'xmlns:{0}'.format(prefix) or u'xmlns'
+        declarations.append((attr, uri))
+
+    _DECLARATIONS[NodeClass] = declarations = tuple(declarations)
+    return declarations
+
+
+def attribute_name(name):
+    if '{' not in name:
+        return name
+
+    local, ns = split_tag_and_namespace(name)
+    if ns == XML_NAMESPACE:
+        return u'xml:' + local
+
+    raise UnsupportedElement(name)
+
+
+def write_element(write, element):
+    tag = element.tag
+    if not isinstance(tag, string_types):
+        # comments and processing instructions
+        raise UnsupportedElement(tag)
+
+    # the same steps as xmpp.core.fixup_element
+    if '{' in tag:
+        name, ns = split_tag_and_namespace(tag)
+        NodeClass = _NODE_MAPPING.get((name, ns))
+        if NodeClass is None:
+            # unknown elements lose the namespaces of their attributes
+            # and declare their own, their subtree is fixed up as well
+            attributes = OrderedDict()
+            for attr, value in element.attrib.items():
+                attributes[split_tag_and_namespace(attr)[0]] = value
+
+            attributes['xmlns'] = ns
+            items = attributes.items()
+        else:
+            name = NodeClass.__tag__ or name
+            items = element.attrib.items()
+            declarations = namespace_declarations(NodeClass)
+            if declarations:
+                attributes = OrderedDict(items)
+                attributes.update(declarations)
+                items = attributes.items()
+    else:
+        name = tag
+        items = element.attrib.items()
+
+    write(u'<')
+    write(name)
+    for attr, value in items:
+        write(u' ')
+        write(attribute_name(attr))
+        write(u'="')
+        write(escape_attribute(value))
+        write(u'"')
+
+    text = element.text
+    if text or len(element):
+        write(u'>')
+        if text:
+            write(escape_text(text))
+
+        for child in element:
+            write_element(write, child)
+
+        write(u'</')
+        write(name)
+        write(u'>')
+    else:
+        write(u' />')
+
+    if element.tail:
+        write(escape_text(element.tail))
+
+
+def element_to_bytes(element):
+    """serializes an element and its subtree to UTF-8 bytes, the given
+    element is left untouched
+
+    :param element: the :py:class:`xml.etree.ElementTree.Element`
+    """
+    parts = []
+    try:
+        write_element(parts.append, element)
+    except UnsupportedElement:
+        return raw_element_to_string(fixup_element(copy_element(element)), 'utf-8')
+
+    return u''.join(parts).encode('utf-8')
+
+
+def node_to_bytes(node):
+    """:returns: the UTF-8 bytes of the element of a :py:class:`~xmpp.models.node.Node`"""
+    return element_to_bytes(node._element)
+
+
+__all__ = [
+    'element_to_bytes',
+    'node_to_bytes',
+    'namespace_declarations',
+    'escape_text',
+    'escape_attribute',
+]
@@ -17,12 +17,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import re
+import time
 import uuid
 import logging
-from xmpp.compat import PY3
+from collections import deque
+from contextlib import contextmanager
 from xmpp.compat import string_types
 from xmpp.core import ET
+from xmpp.core import record_to_element
+from xmpp.parser import IncrementalParser
+from xmpp.parser import get_parser_backend
+from xmpp.parser import ParserLimits
+from xmpp.parser import StanzaLimitExceeded
+from xmpp.parser import xml_tree_builder  # noqa
 
 from speakers import Speaker as Events
 from xmpp.core import generate_id
@@ -34,6 +41,10 @@ from xmpp.models import (
     PresencePriority,
     Stream,
     StreamError,
+    StreamErrorText,
+    StreamFeatures,
+    BadFormat,
+    PolicyViolation,
     ProceedTLS,
     SASLAuth,
     SASLChallenge,
@@ -75,26 +86,6 @@ class STREAM_STATES(object):
         return state in cls.keys()
 
 
-xml_cleanup_regex1 = re.compile(r'^[<][?]xml[^?]+[^>]+[>]')
-
-
-def xml_tree_builder(target):
-    if PY3:
-        return ET.XMLParser(target=target)
-
-    return ET.XMLTreeBuilder(target=target)
-
-
-def sanitize_feed(data):
-    data = xml_cleanup_regex1.sub('', data)
-    return data.lstrip()
-
-
-def create_spool(data):
-    treated = data.replace('><', '>\n<')
-    return treated.splitlines()
-
-
 def create_stream_events():
     return Events('stream', [
         'feed',                 # the XMLStream has just been fed with xml
@@ -103,6 +94,7 @@ def create_stream_events():
         'error',                # received a <stream:error></stream:error> from the server
         'unhandled_xml',        # the XMLStream failed to feed the incremental XML parser with the given value
         'node',                 # a new xmpp.Node was just parsed by the stream and is available to use
+        'nodes',                # a list with every top-level xmpp.Node parsed from a single read of the connection
         'iq',                   # a new xmpp.IQ was node was received
         'message',              # a new xmpp.Message node was received
         'presence',             # a new xmpp.Presence node was received
@@ -129,12 +121,24 @@ class XMLStream(object):
 
     :param connection: a :py:class:`~xmpp.networking.core.XMPPConnection` instance
     :param debug: whether to print errors to the stderr
+    :param parser_backend: the name of the XML parser backend: ``"etree"`` (default), ``"expat"`` or ``"lxml"``, see :py:func:`~xmpp.parser.get_parser_backend`
+    :param history_size: how many of the last dispatched top-level stanzas to keep in :py:attr:`nodes`, defaults to ``0``: stanzas are released as soon as they are dispatched
+    :param limits: a :py:class:`~xmpp.parser.ParserLimits` enforced on incoming stanzas, the defaults are used when ``None``
+    :param lazy_nodes: whether incoming nodes defer their namespace fixup and attribute extraction until a handler touches them, see :py:meth:`~xmpp.models.node.Node.materialize`
+    :param parsing_pool: a :py:class:`~xmpp.offload.ParsingPool` to parse the incoming XML in a worker process, stanzas are then dispatched by :py:meth:`~xmpp.offload.ParsingPool.dispatch` instead of :py:meth:`feed`
     """
 
-    def __init__(self, connection, debug=False):
+    def __init__(self, connection, debug=False, parser_backend=None, history_size=0, limits=None, lazy_nodes=False, parsing_pool=None):
         self._state = STREAM_STATES.IDLE
+        self.parser_backend = get_parser_backend(parser_backend)
+        self.history_size = int(history_size)
+        self.limits = limits or ParserLimits()
+        self.lazy_nodes = bool(lazy_nodes)
+        self.parsing_pool = parsing_pool
+        self.parser = None
         self._connection = connection
         self._tls_connection = None
+        self._batch = None
         self._connection.on.ready_to_write(self.ready_to_write)
         self._connection.on.ready_to_read(self.ready_to_read)
         self.extension = {}
@@ -164,17 +168,25 @@ class XMLStream(object):
         * attributes of the <stream> sent by the server during negotiation, used by :py:meth:`~xmpp.stream.XMLStream.id`
         * a bound JID sent by the server
         * a successful sasl result node to leverage :py:meth:`~xmpp.stream.XMLStream.has_gone_through_sasl`
+
+        The parser is replaced by a fresh one.
         """
-        self._buffer = []
+        self._clear_state()
+        self.release_parser()
+        self.parser = self.make_parser()
+        self.load_extensions()
+
+    def _clear_state(self):
         # minimal state:
         self.__sasl_result = None
         self.__bound_jid = None
 
         self.resource_name = 'xmpp-{0}'.format(uuid.uuid4())
-        self.nodes = []
+        self.nodes = deque(maxlen=self.history_size)
         self.stream_node = None
-        self.parser = self.make_parser()
-        self.load_extensions()
+        self.last_stanza = None
+        self._completed = []
+        self._failed = False
 
     def load_extensions(self):
         """reloads all the available extensions bound to this stream"""
@@ -194,7 +206,7 @@ class XMLStream(object):
         self.on.presence.shout(node)
 
     def handle_iq(self, node):
-        iq_type = node.attr.get('type')
+        iq_type = node.type
         ROUTES = {
             'get': self.on.iq_get,
             'set': self.on.iq_set,
@@ -215,7 +227,6 @@ class XMLStream(object):
             ResourceBind: self.on.bind_support,
             SASLMechanismSet: self.on.sasl_support,
             IQRegister: self.on.user_registration,
-            StreamError: self.on.error,
             # internal affairs when handling node before shouting it
             # through event handlers
             IQ: self.handle_iq,
@@ -251,40 +262,30 @@ class XMLStream(object):
         if self.stream_node is None:
             return
 
-        return self.stream_node.attr.get('id')
+        return self.stream_node.id
 
     def parse(self):
-        """attempts to parse whatever is in the buffer of the incremental XML
-        parser and creates a new parser."""
-        try:
-            if self._buffer and self._buffer[-1].endswith('>'):
-                element = self.parser.close()
-                self.parser = self.make_parser()
-            else:
-                element = None
-
-        except ET.ParseError:
-            return
-
-        if element is None and len(self.nodes) > 0:
-            return self.nodes[-1]
-        elif element is None:
-            return
-
-        return Node.from_element(element, allow_fixedup=True)
+        """returns the last top-level stanza completed by the incremental
+        parser, or ``None`` if no stanza was completed yet."""
+        return self.last_stanza
 
     def ready_to_read(self, _, connection):
         """event handler for the ``on.ready_to_read`` event of a XMPP Connection.
 
         You should probably never have to call this by hand, use
         :py:meth:`~xmpp.stream.XMLStream.bind` instead
-        """
 
-        self.feed(connection.receive())
+        Drains every chunk buffered by the connection, each complete
+        stanza is dispatched through ``on.node`` in the order it was
+        received and then the whole batch is dispatched at once through
+        ``on.nodes``.
+        """
+        batch = []
+        for data in connection.receive_all():
+            batch.extend(self.feed(data))
 
-        node = self.parse()
-        if node:
-            self.on.node.shout(node)
+        if batch:
+            self.on.nodes.shout(batch)
 
     def ready_to_write(self, _, connection):
         """even handler for the ``on.ready_to_write`` event of a XMPP
@@ -305,27 +306,84 @@ class XMLStream(object):
             self.stream_node = node
             self.on.open.shout(node)
 
-        self.append_node(node)
+    def write(self, data):
+        """sends bytes through the bound XMPP connection, or keeps them
+        until the end of the current :py:meth:`~xmpp.stream.XMLStream.batch`
+
+        :param data: the bytes
+        """
+        if self._batch is None:
+            self._connection.send(data)
+        else:
+            self._batch.append(data)
 
     def send(self, node):
         """sends a XML serialized Node through the bound XMPP connection
 
         :param node: the :py:class:`~xmpp.models.node.Node`
         """
-        self._connection.send(node.to_xml())
+        self.write(node.to_bytes())
+
+    def send_many(self, nodes):
+        """sends several nodes in a single write to the connection
+
+        ::
+
+          stream.send_many(stanza.clone(to=jid) for jid in recipients)
+
+        :param nodes: an iterable of :py:class:`~xmpp.models.node.Node`
+        """
+        with self.batch():
+            for node in nodes:
+                self.send(node)
+
+    @contextmanager
+    def batch(self):
+        """joins everything sent inside the block into a single buffer
+        that is handed to the connection at the end of it, nested
+        blocks are part of the outermost one.
+
+        ::
+
+          with stream.batch():
+              stream.send_presence(to='juliet@capulet')
+              stream.send_message('hello', to='juliet@capulet')
+        """
+        if self._batch is not None:
+            yield self
+            return
+
+        self._batch = []
+        try:
+            yield self
+        finally:
+            self.flush()
+
+    def flush(self):
+        """sends what was kept by the current :py:meth:`~xmpp.stream.XMLStream.batch` and ends it"""
+        batch, self._batch = self._batch, None
+        if batch:
+            self._connection.send(b''.join(batch))
 
     def close(self, disconnect=True):
         """sends a final ``</stream:stream>`` to the server then immediately
         closes the bound TCP connection,disposes it and resets the
         minimum state kept by the stream, so it can be reutilized right away.
+
+        The parser is released, a new one is made by the next :py:meth:`feed`.
         """
-        self._connection.send(b'</stream:stream>')
+        self.write(b'</stream:stream>')
+        self.flush()
         self._state = STREAM_STATES.IDLE
 
         if disconnect:
             self._connection.disconnect()
 
-        self.reset()
+        # the parser is released without making a new one, which
+        # would register the stream in the parsing pool again
+        self._clear_state()
+        self.release_parser()
+        self.load_extensions()
         self._connection = None
 
     def open_client(self, domain):
@@ -339,11 +397,18 @@ class XMLStream(object):
         self.send(initial)
 
     def node_did_close(self, node):
-        if node.__tag__ == 'stream:stream':
+        if isinstance(node, Stream):
             self.set_state(STREAM_STATES.CLOSED)
+            self.on.closed.shout(node)
         else:
             self.on.node.shout(node)
 
+    def stanza_did_close(self, node):
+        self.last_stanza = node
+        self._completed.append(node)
+        self.on.node.shout(node)
+        self.append_node(node)
+
     @property
     def state(self):
         return self._state
@@ -357,46 +422,137 @@ class XMLStream(object):
 
     def make_parser(self):
         self.target = NodeHandler(self)
-        return xml_tree_builder(self.target)
+        if self.parsing_pool is not None:
+            return self.parsing_pool.register(self)
+
+        return IncrementalParser(self.target, self.parser_backend)
 
-    def matches_closed_stream(self, string):
-        return string.rstrip().endswith('</stream:stream>')
+    def release_parser(self):
+        if self.parser is not None and self.parsing_pool is not None:
+            self.parsing_pool.unregister(self.parser)
 
-    def feed(self, data, attempt=1):
+        self.parser = None
+
+    def feed(self, data):
         """feeds the stream with incoming data from the XMPP server.
         This is the basic entrypoint for usage with the XML received
         from the :py:class:`~xmpp.networking.core.XMPPConnection`
 
-        :param data: the XML string
+        The same incremental parser is used throughout the whole
+        session, every top-level stanza is dispatched through the
+        ``on.node`` event as soon as its end tag arrives, regardless
+        of how the XML was fragmented.
 
+        :param data: ``bytes``, ``bytearray`` or ``memoryview`` as read from the socket, ``str`` is also accepted
+        :returns: a list with the top-level stanzas completed by this chunk
         """
-        self.on.feed.shout(data)
-        data = sanitize_feed(data)
-        spool = create_spool(data)
-
-        if not self.matches_closed_stream(data):
-            if len(spool) > 1:
-                for item in spool:
-                    self.feed_from_spool(item)
-            else:
-                self.feed_from_spool(data)
+        self._completed = completed = []
+        if self._failed:
+            # the stream was closed because of an error, nothing
+            # else is parsed until reset()
+            return completed
+
+        if self.parser is None:
+            # released by close(), the stream is being reused
+            self.parser = self.make_parser()
 
-        else:
-            self.set_state(STREAM_STATES.CLOSED)
-            if self.stream_node:
-                self.on.closed.shout(self.stream_node)
+        self.on.feed.shout(data)
 
-    def feed_from_spool(self, item, attempt=0):
         try:
-            self.parser.feed(item)
-            self._buffer.append(item)
-        except ET.ParseError:
-            if attempt > 1:
-                self.on.unhandled_xml.shout(item)
-                return
+            self.parser.feed(data)
+        except StanzaLimitExceeded as e:
+            self.fail(PolicyViolation, e)
+        except ET.ParseError as e:
+            self.on.unhandled_xml.shout(data)
+            self.fail(BadFormat, e)
+
+        self._completed = []
+        return completed
+
+    def feed_records(self, records):
+        """dispatches the records parsed by a worker of the
+        :py:class:`~xmpp.offload.ParsingPool`, exactly as :py:meth:`feed`
+        would have dispatched the chunks they were parsed from.
+
+        :param records: a list of ``(kind, value)`` tuples, see :py:class:`~xmpp.offload.RecordingStream`
+        :returns: a list with the top-level stanzas completed by these records
+        """
+        self._completed = completed = []
+        for kind, value in records:
+            if self._failed:
+                break
+
+            if kind == 'limit_exceeded':
+                self.fail(PolicyViolation, value)
+                continue
+            elif kind == 'bad_format':
+                self.fail(BadFormat, value)
+                continue
+            elif kind == 'unhandled_xml':
+                self.on.unhandled_xml.shout(value)
+                continue
+
+            if kind != 'stanza_did_close':
+                node = Node.from_element(record_to_element(value), lazy=self.lazy_nodes)
+                if kind == 'node_did_open':
+                    self.node_did_open(node)
+                else:
+                    self.node_did_close(node)
+
+                continue
+
+            # the nodes are lazy regardless of ``lazy_nodes``, most of
+            # the children are only routed by their class
+            record, paths = value
+            node = Node.from_element(record_to_element(record), lazy=True)
+            if isinstance(node, StreamFeatures) and self.stream_node is not None:
+                # the NodeHandler of the worker appended them to its
+                # own copy of the stream
+                self.stream_node.append(node)
+
+            for path in paths:
+                child = node
+                for index in path:
+                    child = child.wrap(child._element[index])
+
+                self.node_did_close(child)
+
+            self.stanza_did_close(node)
+
+        self._completed = []
+        if completed:
+            self.on.nodes.shout(completed)
+
+        return completed
+
+    def create_stream_error(self, condition, text):
+        node = StreamError.create()
+        node.append(condition.create())
+        node.append(StreamErrorText.create(str(text)))
+        return node
 
-            self.parser = self.make_parser()
-            return self.feed_from_spool(item, attempt + 1)
+    def fail(self, condition, text):
+        """sends a ``<stream:error>`` followed by ``</stream:stream>``
+        and sets the state to ``CLOSED``, the incoming data is then
+        discarded until :py:meth:`reset`
+
+        :param condition: the :py:class:`~xmpp.models.core.Error` subclass of the condition, e.g. :py:class:`~xmpp.models.core.PolicyViolation`
+        :param text: the description sent in the ``<text>`` element
+        """
+        error = self.create_stream_error(condition, text)
+        self._failed = True
+        self.set_state(STREAM_STATES.CLOSED)
+        # the parser and its target hold the partial stanza and the
+        # buffered input, nothing is parsed anymore until reset()
+        self.release_parser()
+        self.target = None
+        if self._connection is not None:
+            with self.batch():
+                self.send(error)
+                self.write(b'</stream:stream>')
+
+        self.on.error.shout(error)
+        return error
 
     def start_tls_handshake(self, domain):
         self.send(StartTLS.create())
@@ -494,6 +650,19 @@ class XMLStream(object):
         """
         self.send(Message.create(message, to=to, **params))
 
+    def send_template(self, template, **values):
+        """sends a stanza rendered from a template, without building any node
+
+        ::
+
+          template = presence_template()
+          stream.send_template(template, **{'from': stream.bound_jid.full, 'to': 'juliet@capulet'})
+
+        :param template: the :py:class:`~xmpp.templates.StanzaTemplate`
+        :param values: the value of each slot of the template
+        """
+        self.write(template.render(values))
+
     def add_contact(self, contact_jid, from_jid=None, groups=None):
         """adds a contact to the roster of the ``bound_jid`` or the provided ``from_jid`` parameter.
 
@@ -535,53 +704,160 @@ class XMLStream(object):
 
 
 class NodeHandler(object):
+    """target of the :py:class:`~xmpp.parser.IncrementalParser`, builds
+    nodes out of the parser events and notifies the given
+    :py:class:`~xmpp.stream.XMLStream` about them.
+
+    A top-level stanza is any node whose parent is a
+    :py:class:`~xmpp.models.core.Stream` or that has no parent at
+    all. Stanzas are never attached to their stream, once dispatched
+    they are only referenced by the event handlers that kept them.
+
+    The :py:class:`~xmpp.parser.ParserLimits` of the parent stream are
+    enforced as the events arrive, raising
+    :py:class:`~xmpp.parser.StanzaLimitExceeded`.
+    """
     def __init__(self, parent):
-        self.nodes = []
-        self._data = []
         self.parent = parent
+        self.limits = parent.limits
+        self.lazy = parent.lazy_nodes
+        self.rate_window = 0
+        self.rate_count = 0
+        self.reset()
+
+    def reset(self):
+        self.nodes = []
+        self.depth = -1
+        self.stanza_level = None
+        self._text = []
+        # bytes fed to the parser so far, and how many of them were
+        # fed when the parser last fired an event
+        self.position = 0
+        self.reported = 0
+
+    def start_stanza(self):
+        self.stanza_level = len(self.nodes)
+        # the stanza takes every byte after the previous event
+        self.stanza_start = self.reported
+        self.stanza_text = 0
+
+        max_rate = self.limits.max_stanza_rate
+        if max_rate:
+            window = int(time.time())
+            if window != self.rate_window:
+                self.rate_window = window
+                self.rate_count = 0
+
+            self.rate_count += 1
+            if self.rate_count > max_rate:
+                self.exceeded('stanza rate exceeds {0} per second', max_rate)
+
+    def exceeded(self, message, limit):
+        raise StanzaLimitExceeded(message.format(limit))
+
+    def check_size(self, size):
+        max_size = self.limits.max_stanza_size
+        if max_size and size > max_size:
+            self.exceeded('stanza exceeds {0} bytes', max_size)
+
+    def will_feed(self, size):
+        # the parser is about to take a slice that ends right after a
+        # ``>``, or at the end of a chunk. Outside of a stanza these
+        # are the bytes that the parser holds without reporting them,
+        # like the attributes of a start tag that never ends
+        self.position += size
+        if self.stanza_level is None:
+            self.check_size(self.position - self.reported)
+        else:
+            self.check_size(self.position - self.stanza_start)
+
+    def flush_text(self):
+        if not self._text:
+            return
+
+        node = self.nodes[-1]
+        element = node._element
+        text = ''.join(self._text)
+        element.text = element.text and element.text + text or text
+        self._text = []
+        node.changed()
 
     def start(self, tag, attrib):
+        self.depth += 1
+        if not self.depth:
+            # the envelope of the incremental parser
+            return
+
+        self.flush_text()
         parent_node = self.nodes and self.nodes[-1] or None
         has_parent = parent_node and not parent_node.is_closed
         element = ET.Element(tag, attrib)
-        node = self.notify_and_store_node(element)
+        node = Node.from_element(element, lazy=self.lazy)
+
+        if isinstance(node, Stream):
+            pass
+        elif parent_node is None or isinstance(parent_node, Stream):
+            self.start_stanza()
+
+        if self.stanza_level is not None:
+            self.check_element(tag, attrib)
+
+        self.reported = self.position
+        self.nodes.append(node)
+
+        if isinstance(parent_node, Stream):
+            # the stream only keeps its features, used by Stream.features
+            has_parent = isinstance(node, StreamFeatures)
 
         if has_parent:
             parent_node.append(node)
 
         self.parent.node_did_open(node)
 
+    def check_element(self, tag, attrib):
+        limits = self.limits
+        depth = len(self.nodes) - self.stanza_level + 1
+        if limits.max_depth and depth > limits.max_depth:
+            self.exceeded('stanza is nested deeper than {0} elements', limits.max_depth)
+
+        if limits.max_attributes and len(attrib) > limits.max_attributes:
+            self.exceeded('element has more than {0} attributes', limits.max_attributes)
+
     def end(self, tag):
-        current = self.nodes.pop()
-        if not self.nodes:
-            # always have only one node
-            self.nodes.append(current)
+        self.depth -= 1
+        if self.depth < 0:
             return
 
-        possible_parent = self.nodes[-1]
-        if possible_parent.is_parent_of(current):
+        self.reported = self.position
+        self.flush_text()
+        current = self.nodes.pop()
+        possible_parent = self.nodes and self.nodes[-1] or None
+
+        if len(self.nodes) == self.stanza_level:
+            self.stanza_level = None
+
+        if isinstance(current, Stream):
+            self.parent.node_did_close(current)
+        elif possible_parent is None or isinstance(possible_parent, Stream):
+            self.parent.stanza_did_close(current)
+        elif possible_parent.is_parent_of(current):
             self.parent.node_did_close(current)
 
     def close(self):
         if not self.nodes:
             return
 
-        for node in reversed(self.nodes):
-            if node.is_closed:
-                return node._element
-
-        return node._element
+        return self.nodes[0]._element
 
     def data(self, data):
-        target = self.nodes[-1]._element
-        if not target.text:
-            target.text = data
-        else:
-            target.text += data
+        self.reported = self.position
+        if self.stanza_level is None:
+            # whitespace keepalives between stanzas
+            return
 
-        return False
+        max_text = self.limits.max_text_length
+        self.stanza_text += len(data)
+        if max_text and self.stanza_text > max_text:
+            self.exceeded('stanza text exceeds {0} characters', max_text)
 
-    def notify_and_store_node(self, element):
-        node = Node.from_element(element)
-        self.nodes.append(node)
-        return node
+        self._text.append(data)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# <xmpp - stateless and concurrency-agnostic XMPP library for python>
+#
+# Copyright (C) <2016-2017> Gabriel Falcao <gabriel@nacaolivre.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""stanzas that are serialized once and then sent many times with
+different values, without building an element tree for each one.
+
+::
+
+  template = presence_template(type='available')
+
+  stream.send_template(template, **{'from': 'romeo@montague/orchard', 'to': 'juliet@capulet'})
+"""
+import re
+
+from xmpp import serializer
+from xmpp.compat import text_type
+from xmpp.compat import cast_string
+from xmpp.models.core import Message
+from xmpp.models.core import Presence
+from xmpp.models.core import PresenceDelay
+from xmpp.models.core import PresencePriority
+
+
+# private use characters never sent by the library, they mark where
+# the values go in the serialized skeleton
+SLOT_START = u'\ue000'
+SLOT_END = u'\ue001'
+SLOT = re.compile(u'{0}([^{1}]*){1}'.format(SLOT_START, SLOT_END))
+
+
+def slot(name):
+    """:returns: the placeholder of a value in the attributes or in the text of a template skeleton
+
+    :param name: the name of the value passed to :py:meth:`~xmpp.templates.StanzaTemplate.render`
+    """
+    return u''.join([SLOT_START, name, SLOT_END])
+
+
+def escape_text(value):
+    return serializer.escape_text(cast_string(value)).encode('utf-8')
+
+
+def escape_attribute(value):
+    return serializer.escape_attribute(cast_string(value)).encode('utf-8')
+
+
+class StanzaTemplate(object):
+    """a stanza serialized once, with :py:func:`~xmpp.templates.slot`
+    placeholders that are replaced by escaped values every time it is
+    rendered.
+
+    :param skeleton: the :py:class:`~xmpp.models.node.Node` with placeholders in its attributes or texts
+    :param defaults: values of the slots that don't need to be passed to :py:meth:`~xmpp.templates.StanzaTemplate.render`
+    """
+    def __init__(self, skeleton, **defaults):
+        xml = skeleton if isinstance(skeleton, text_type) else skeleton.to_xml()
+        self.defaults = defaults
+        self.chunks = []
+        self.slots = []
+
+        position = 0
+        for found in SLOT.finditer(xml):
+            before = xml[position:found.start()]
+            self.chunks.append(before.encode('utf-8'))
+
+            # a placeholder between a "<" and a ">" is in an attribute
+            in_tag = xml.rfind(u'<', 0, found.start()) > xml.rfind(u'>', 0, found.start())
+            self.slots.append((found.group(1), in_tag and escape_attribute or escape_text))
+            position = found.end()
+
+        self.chunks.append(xml[position:].encode('utf-8'))
+        self.names = frozenset(name for name, _ in self.slots)
+
+    def render(self, values=None, **kw):
+        """:returns: the ``bytes`` of the stanza with the given values in its slots
+
+        :param values: ``dict`` with the value of each slot, names like ``from`` can't be keyword arguments
+        :param kw: the value of each slot
+        """
+        if values:
+            kw.update(values)
+
+        if self.defaults:
+            params = dict(self.defaults)
+            params.update(kw)
+        else:
+            params = kw
+
+        chunks = self.chunks
+        output = [chunks[0]]
+        for index, (name, escape) in enumerate(self.slots):
+            try:
+                value = params[name]
+            except KeyError:
+                raise TypeError('missing the value of the template slot "{0}"'.format(name))
+
+            output.append(escape(value))
+            output.append(chunks[index + 1])
+
+        return b''.join(output)
+
+    def __repr__(self):
+        return 'StanzaTemplate({0})'.format(b''.join(self.chunks))
+
+
+def presence_template(to=True, delay=False, priority=10, **attributes):
+    """:returns: a :py:class:`~xmpp.templates.StanzaTemplate` of the
+    presences sent by :py:meth:`~xmpp.stream.XMLStream.send_presence`,
+    with the slots ``from``, ``to`` and ``stamp``.
+
+    :param to: whether the presence has a ``to`` slot
+    :param delay: whether the presence has a ``<delay stamp="" />`` with a ``stamp`` slot
+    :param priority: the priority of the resource, ``None`` leaves it out
+    :param attributes: other attributes of the presence, values can be slots as well
+    """
+    attributes['from'] = slot('from')
+    if to:
+        attributes['to'] = slot('to')
+
+    presence = Presence.create(**attributes)
+    if delay:
+        presence.append(PresenceDelay.create(**{'stamp': slot('stamp'), 'from': slot('from')}))
+
+    if priority:
+        presence.append(PresencePriority.create(str(priority)))
+
+    return StanzaTemplate(presence)
+
+
+def message_template(**attributes):
+    """:returns: a :py:class:`~xmpp.templates.StanzaTemplate` of the
+    messages sent by :py:meth:`~xmpp.stream.XMLStream.send_message`,
+    with the slots ``to`` and ``body``.
+
+    :param attributes: other attributes of the message, e.g. ``id=slot('id')``
+    """
+    attributes.setdefault('to', slot('to'))
+    return StanzaTemplate(Message.create(slot('body'), **attributes))